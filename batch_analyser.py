@@ -0,0 +1,65 @@
+'''
+/***
+** Script:   batch_analyser.py
+** Desc:     Script to analyse many PCAP Files and define their Digital Network Signatures in one run
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+"""Master script to run the packet capture analysis over many files."""
+import argparse
+
+from pcapanalyser.batch import analyse_batch, BATCH_COMMANDS
+from pcapanalyser.utils import create_logger
+from pcapanalyser.writers import OUTPUT_FORMAT, WRITERS, missing_module
+
+
+def parse_args() -> argparse.Namespace:
+    """Set up argument parsing."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source",
+                        help="Directory or glob pattern of PCAP files")
+    parser.add_argument("commands", nargs="*", default=["summarise"],
+                        choices=BATCH_COMMANDS + ["all"])
+    parser.add_argument("--out", default="pcapanalyser/outputs/batch",
+                        help="Directory to write per-file and aggregate "
+                        "results to")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Size of the worker pool, defaults to the "
+                        "number of CPUs")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream each capture instead of loading it "
+                        "into memory")
+    parser.add_argument("--geoip-in-memory", action="store_true",
+                        help="Load the GeoIP database into memory once per "
+                        "worker for the kml command")
+    parser.add_argument("--format", default=OUTPUT_FORMAT,
+                        choices=WRITERS.keys(),
+                        help="Format to write the results in, csv, arrow "
+                        "and parquet write a file per command")
+    args = parser.parse_args()
+    if missing_module(args.format) is not None:
+        parser.error(f"--format {args.format} needs "
+                     f"{missing_module(args.format)} installed")
+    return args
+
+
+def main(args: argparse.Namespace) -> None:
+    """Analyse every capture and print the aggregate results."""
+    logger = create_logger()
+    logger.info("Batch Program Started")
+    commands = BATCH_COMMANDS if "all" in args.commands else args.commands
+    print(analyse_batch(args.source, commands, args.out,
+                        workers=args.workers, streaming=args.stream,
+                        geoip_in_memory=args.geoip_in_memory,
+                        output_format=args.format))
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    main(arguments)
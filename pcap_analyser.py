@@ -26,19 +26,85 @@
 """Master script to run the packet capture analysis program."""
 import argparse
 
-from pcapanalyser.captureanalyser import CaptureAnalyser, FUNCTION_MAP
-from pcapanalyser.utils import is_valid_pcap_file, create_logger
+from pcapanalyser.captureanalyser import (CaptureAnalyser, FUNCTION_MAP,
+                                          GRAPH_FORMAT, KML_FORMAT)
+from pcapanalyser.follow import (CaptureFollower, EVERY, FOLLOW_COMMANDS,
+                                 STDIN, WINDOW)
+from pcapanalyser.grapher import IMAGE_FORMATS
+from pcapanalyser.utils import (is_valid_pcap_file, create_logger,
+                                parse_time_bound, validate_filename)
+from pcapanalyser.writers import OUTPUT_FORMAT, WRITERS, missing_module
 
 
 def parse_args() -> argparse.Namespace:
     """Set up argument parsing."""
     parser = argparse.ArgumentParser()
-    parser.add_argument("file", help="The PCAP file to analyse",
-                        type=lambda y: is_valid_pcap_file(y, parser))
+    parser.add_argument("file", help="The PCAP file to analyse, - reads "
+                        "it from stdin with --follow")
     parser.add_argument("command", default="all", choices=FUNCTION_MAP.keys())
-    parser.add_argument("--out", default="pcapanalyser/outputs/results.txt",
-                        help="File path to write the results of the analysis")
+    parser.add_argument("--out", default=None,
+                        help="File path to write the results of the "
+                        "analysis, pcapanalyser/outputs/results.<format> "
+                        "by default")
+    parser.add_argument("--format", default=OUTPUT_FORMAT,
+                        choices=WRITERS.keys(),
+                        help="Format to write the results in, csv, arrow "
+                        "and parquet write a file per command")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the capture through each command "
+                        "instead of loading it into memory")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to parse the capture "
+                        "with, implies --stream when more than one")
+    parser.add_argument("--start", default=None,
+                        type=lambda y: parse_time_bound(y, parser),
+                        help="Only analyse packets captured at or after "
+                        "this time, epoch seconds or ISO 8601")
+    parser.add_argument("--end", default=None,
+                        type=lambda y: parse_time_bound(y, parser),
+                        help="Only analyse packets captured before this "
+                        "time, epoch seconds or ISO 8601")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Neither load nor save cached analysis "
+                        "results for the capture")
+    parser.add_argument("--headless", action="store_true",
+                        help="Save the graph without showing it, the "
+                        "default when there is no display")
+    parser.add_argument("--graph-format", default=GRAPH_FORMAT,
+                        choices=IMAGE_FORMATS,
+                        help="Image format the graph is saved in")
+    parser.add_argument("--kml-format", default=KML_FORMAT,
+                        choices=("kml", "kmz"),
+                        help="Save the kml command's points as plain or "
+                        "zipped KML")
+    parser.add_argument("--geoip-in-memory", action="store_true",
+                        help="Load the GeoIP database into memory "
+                        "instead of memory mapping it")
+    parser.add_argument("--follow", action="store_true",
+                        help="Keep reading the capture as it is written "
+                        "and report on a sliding window of it, for "
+                        f"{', '.join(FOLLOW_COMMANDS)} and all")
+    parser.add_argument("--window", type=float, default=WINDOW,
+                        help="Seconds of capture time --follow reports on")
+    parser.add_argument("--every", type=float, default=EVERY,
+                        help="Seconds between --follow snapshots")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="Stop following once the file has not grown "
+                        "for this many seconds")
     args = parser.parse_args()
+    if missing_module(args.format) is not None:
+        parser.error(f"--format {args.format} needs "
+                     f"{missing_module(args.format)} installed")
+    if args.out is None:
+        args.out = "pcapanalyser/outputs/results." + \
+            WRITERS[args.format].extension
+    if not args.follow:
+        is_valid_pcap_file(args.file, parser)
+    elif args.command not in (*FOLLOW_COMMANDS, "all"):
+        parser.error(f"{args.command} cannot be used with --follow")
+    elif args.file != STDIN and not validate_filename(args.file):
+        # The capture may not have a header yet, it is checked once it has
+        parser.error(f"The file {args.file} does not exist")
     return args
 
 
@@ -46,11 +112,29 @@ def main(args: argparse.Namespace) -> None:
     """Create a CaptureAnalyser object and handle argument presences."""
     logger = create_logger()
     logger.info("Program Started")
-    capture_analyser = CaptureAnalyser(args.file)
+    if args.follow:
+        commands = list(FOLLOW_COMMANDS) if args.command == "all" \
+            else [args.command]
+        follower = CaptureFollower(args.file, commands, args.out,
+                                   window=args.window, every=args.every)
+        follower.output_format = args.format
+        print(follower.run(args.idle_timeout))
+        return
+    capture_analyser = CaptureAnalyser(args.file, streaming=args.stream,
+                                       workers=args.workers,
+                                       window=(args.start, args.end),
+                                       use_cache=not args.no_cache)
+    if args.headless:
+        capture_analyser.headless = True
+    capture_analyser.graph_format = args.graph_format
+    capture_analyser.kml_format = args.kml_format
+    capture_analyser.geoip_in_memory = args.geoip_in_memory
+    capture_analyser.output_format = args.format
     # Use command from CLI input, map it to a python function and execute.
     # CaptureAnalyser.<input_command>()
-    print(getattr(capture_analyser,
-                  FUNCTION_MAP[args.command])(writefile=args.out))
+    with capture_analyser:
+        print(getattr(capture_analyser,
+                      FUNCTION_MAP[args.command])(writefile=args.out))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+'''
+/***
+** Script:   batch.py
+** Desc:     Batch analysis of many captures for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Captures are analysed on a persistent process pool, so
+*               interpreter startup, imports and logger setup are paid once
+*               per worker rather than once per file.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+# pylint: disable=R0913,R0917
+"""Run CaptureAnalyser commands across many capture files."""
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from pcapanalyser.captureanalyser import CaptureAnalyser, FUNCTION_MAP
+from pcapanalyser.geoip import DB_PATH, load_database
+from pcapanalyser.timeindex import INDEX_SUFFIX
+from pcapanalyser.utils import (create_logger, validate_filename,
+                                validate_file_format)
+from pcapanalyser.writers import OUTPUT_FORMAT, WRITERS, Result, ResultTable
+
+# Commands that need a display are left out of batch runs
+BATCH_COMMANDS = [command for command in FUNCTION_MAP
+                  if command not in ("graph", "all")]
+
+logger = create_logger()
+
+
+def find_captures(source: str) -> list[str]:
+    """Expand a directory or glob pattern into capture file names."""
+    if os.path.isdir(source):
+        files = [str(path) for path in Path(source).rglob("*")]
+    else:
+        files = glob.glob(source, recursive=True)
+    return sorted(file for file in files if os.path.isfile(file)
+                  and not file.endswith(INDEX_SUFFIX))
+
+
+def init_worker(geoip_in_memory: bool = False) -> None:
+    """Set up a pool worker once, before it analyses any file.
+
+    Arguments
+    geoip_in_memory -- load the GeoIP database now, it then stays in
+    memory for every file the worker analyses
+    """
+    create_logger()
+    if geoip_in_memory and load_database(DB_PATH) is None:
+        logger.error("GeoIP - No database at %s", DB_PATH)
+
+
+def analyse_file(filename: str, commands: list[str], out_dir: str,
+                 streaming: bool = False, geoip_in_memory: bool = False,
+                 output_format: str = OUTPUT_FORMAT
+                 ) -> tuple[str, dict[str, int], str | None]:
+    """Run commands on a single capture, writing to its own results file.
+
+    An error analysing the capture is logged and returned rather than
+    raised, so it does not stop the rest of the batch.
+
+    Returns
+    (filename, protocol_count, error) -- used to build the aggregate
+    results, an empty count means the file could not be analysed and
+    error says why if it failed part way
+    """
+    if not validate_filename(filename) or \
+            not validate_file_format(filename):
+        return (filename, {}, None)
+    writefile = os.path.join(
+        out_dir, f"{Path(filename).name}.{WRITERS[output_format].extension}")
+    try:
+        with CaptureAnalyser(filename,
+                             streaming=streaming) as capture_analyser:
+            capture_analyser.geoip_in_memory = geoip_in_memory
+            capture_analyser.output_format = output_format
+            for command in commands:
+                getattr(capture_analyser,
+                        FUNCTION_MAP[command])(writefile=writefile)
+            return (filename,
+                    dict(capture_analyser.analyse("get_protocol_count")),
+                    None)
+    # Any error is the file's, the other files are still analysed
+    except Exception as error:  # pylint: disable=W0718
+        logger.error("Batch - Failed to analyse %s - %r", filename, error)
+        return (filename, {}, f"{type(error).__name__}: {error}")
+
+
+def write_aggregate(results: list[tuple[str, dict[str, int], str | None]],
+                    out_dir: str,
+                    output_format: str = OUTPUT_FORMAT) -> Result:
+    """Write per-file and per-protocol totals across the whole batch.
+
+    Files that failed are listed with their error and left out of the
+    protocol totals.
+    """
+    files = ResultTable()
+    files.field_names = ["File", "Number of Packets", "Protocols"]
+    protocols = ResultTable()
+    protocols.field_names = ["Protocol", "Number of Packets", "Files"]
+    totals: dict[str, list[int]] = {}
+    for filename, protocol_count, error in results:
+        if error is not None:
+            files.add_row([filename, "Failed", error])
+            continue
+        if not protocol_count:
+            files.add_row([filename, "Not a valid PCAP", ""])
+            continue
+        files.add_row([filename, sum(protocol_count.values()),
+                       ", ".join(protocol_count)])
+        for protocol, number_of_packets in protocol_count.items():
+            totals.setdefault(protocol, [0, 0])
+            totals[protocol][0] += number_of_packets
+            totals[protocol][1] += 1
+    for protocol, (number_of_packets, number_of_files) in sorted(
+            totals.items(), key=lambda item: item[1][0], reverse=True):
+        protocols.add_row([protocol, number_of_packets, number_of_files])
+    writer_class = WRITERS[output_format]
+    with writer_class(os.path.join(
+            out_dir, f"aggregate.{writer_class.extension}")) as writer:
+        writer.write("files", files)
+        writer.write("protocols", protocols)
+    return protocols
+
+
+def analyse_batch(source: str, commands: list[str], out_dir: str,
+                  workers: int | None = None,
+                  streaming: bool = False,
+                  geoip_in_memory: bool = False,
+                  output_format: str = OUTPUT_FORMAT) -> Result:
+    """Analyse every capture matched by source on a shared worker pool.
+
+    Arguments
+    source -- a directory (searched recursively) or a glob pattern
+    commands -- FUNCTION_MAP commands to run on each capture
+    out_dir -- directory for the per-file and aggregate results
+    workers -- pool size, defaults to the number of CPUs
+    geoip_in_memory -- load the GeoIP database into memory once per
+    worker, for the kml command
+    output_format -- writers.WRITERS format of the results files
+    """
+    files = find_captures(source)
+    if not files:
+        return f"No files found for {source}"
+    os.makedirs(out_dir, exist_ok=True)
+    logger.info("Batch analysing %s files from %s", len(files), source)
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(geoip_in_memory,)) as pool:
+        results = list(pool.map(analyse_file, files,
+                                [commands] * len(files),
+                                [out_dir] * len(files),
+                                [streaming] * len(files),
+                                [geoip_in_memory] * len(files),
+                                [output_format] * len(files)))
+    return write_aggregate(results, out_dir, output_format)
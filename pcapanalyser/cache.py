@@ -0,0 +1,213 @@
+'''
+/***
+** Script:   cache.py
+** Desc:     Persistent analysis cache for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               The parsed PacketTable and the result of every analysis
+*               query are saved per capture, so repeat runs on an
+*               unchanged capture skip parsing and analysis entirely.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+"""Content keyed cache of parsed captures and query results."""
+# pylint: disable=R0902,R0913,R0917
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from typing import Any
+
+from pcapanalyser.packettable import PacketTable
+from pcapanalyser.protocolindex import ProtocolIndex
+from pcapanalyser.utils import create_logger
+
+logger = create_logger()
+
+CACHE_DIR = "pcapanalyser/outputs/cache"
+# Least recently used entries are evicted beyond this size
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+# Bytes hashed from the start, middle and end of the capture
+SAMPLE_BYTES = 64 * 1024
+TABLE_SUFFIX = ".table"
+RESULTS_SUFFIX = ".results"
+
+
+def sample_hash(filename: str, size: int) -> str:
+    """Hash the size and samples of a capture's content.
+
+    Hashing samples rather than the whole file keeps the key cheap for
+    large captures, size and mtime catch the rest of the changes.
+    """
+    digest = hashlib.sha256(str(size).encode())
+    with open(filename, "rb") as capture:
+        for offset in (0, max(0, size // 2 - SAMPLE_BYTES // 2),
+                       max(0, size - SAMPLE_BYTES)):
+            capture.seek(offset)
+            digest.update(capture.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """Cache entry for one capture, time window and parser version.
+
+    Entries are files in CACHE_DIR named <prefix>-<key>, the pickled
+    PacketTable and the pickled query results of each analysis mode.
+    The prefix covers the capture's path and time window, the key its
+    size, mtime, sampled content hash and the parser version. Entries
+    with the same prefix but another key are for a changed capture and
+    are removed.
+
+    Results are kept per mode, so a result is only ever served to the
+    mode that computed it.
+    """
+
+    def __init__(self, filename: str, parser_version: int,
+                 window: tuple[float | None, float | None] = (None, None),
+                 mode: str = "memory",
+                 cache_dir: str = CACHE_DIR,
+                 max_bytes: int = MAX_CACHE_BYTES) -> None:
+        """Work out the cache key and load any saved results.
+
+        Arguments
+        filename -- the capture being analysed
+        parser_version -- bumped whenever parsing output changes
+        window -- (start_time, end_time) the capture is analysed over
+        mode -- how the results are computed, "memory", "stream" or
+        "workers"
+        """
+        self.cache_dir = Path(cache_dir)
+        self.results_suffix = f".{mode}{RESULTS_SUFFIX}"
+        self.max_bytes = max_bytes
+        path = Path(filename).expanduser().resolve()
+        self.capture = str(path)
+        stat = path.stat()
+        self.prefix = hashlib.sha256(
+            repr((str(path), window)).encode()).hexdigest()[:16]
+        key = hashlib.sha256(repr((
+            stat.st_size, stat.st_mtime_ns,
+            sample_hash(filename, stat.st_size),
+            parser_version)).encode()).hexdigest()[:32]
+        self.name = f"{self.prefix}-{key}"
+        loaded = self.read(self.results_suffix)
+        self.results: dict[tuple, Any] = loaded["results"] if loaded \
+            else {}
+        self.protocols: ProtocolIndex = loaded["protocols"] if loaded \
+            else ProtocolIndex()
+
+    def entry(self, suffix: str) -> Path:
+        """Get the path of one of this entry's files."""
+        return self.cache_dir / f"{self.name}{suffix}"
+
+    def read(self, suffix: str) -> Any:
+        """Unpickle one of this entry's files, None if not cached.
+
+        A file that cannot be loaded, e.g. truncated or pickled from
+        classes that have since changed, is a miss like a missing one.
+        """
+        try:
+            with open(self.entry(suffix), "rb") as cache_file:
+                value = pickle.load(cache_file)
+            # Mark as recently used for eviction
+            os.utime(self.entry(suffix))
+        except FileNotFoundError:
+            return None
+        # Unpickling can raise almost anything for a bad file
+        except Exception as error:  # pylint: disable=W0718
+            logger.warning("Ignoring unreadable cache entry %s - %r",
+                           self.entry(suffix), error)
+            return None
+        logger.info("Loaded %s from cache", self.entry(suffix))
+        return value
+
+    def write(self, suffix: str, value: Any) -> None:
+        """Pickle a value to one of this entry's files, then evict."""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            temporary = self.entry(f"{suffix}.{os.getpid()}.tmp")
+            with open(temporary, "wb") as cache_file:
+                pickle.dump(value, cache_file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            # Atomic, so concurrent batch workers never read half a file
+            os.replace(temporary, self.entry(suffix))
+        except OSError:
+            logger.warning("Unable to write cache entry %s",
+                           self.entry(suffix))
+            return
+        self.evict()
+
+    def load_table(self) -> tuple[PacketTable, ProtocolIndex] | None:
+        """Get the cached PacketTable and its protocols, None if not cached.
+
+        The protocols are saved with the table rather than taken from
+        the results, which can be missing while the table is not.
+        """
+        entry = self.read(TABLE_SUFFIX)
+        if not isinstance(entry, dict) or \
+                not isinstance(entry.get("table"), PacketTable) or \
+                not isinstance(entry.get("protocols"), ProtocolIndex):
+            return None
+        # Payloads are read back from the capture, however it is named
+        entry["table"].filename = self.capture
+        return entry["table"], entry["protocols"]
+
+    def store_table(self, table: PacketTable,
+                    protocols: ProtocolIndex) -> None:
+        """Save a parsed PacketTable with the protocols it holds."""
+        self.write(TABLE_SUFFIX, {"table": table, "protocols": protocols})
+
+    def has_result(self, query: tuple) -> bool:
+        """Check for a cached query result."""
+        return query in self.results
+
+    def store_result(self, query: tuple, result: Any,
+                     protocols: ProtocolIndex) -> None:
+        """Save a query result with the protocols it refers to."""
+        self.results[query] = result
+        self.protocols.update(protocols)
+        self.write(self.results_suffix, {"results": self.results,
+                                         "protocols": self.protocols})
+
+    def evict(self) -> None:
+        """Remove stale entries of this capture, then trim to max_bytes.
+
+        Only entry files count, other files in the directory, e.g. the
+        temporary files of writes in progress, are left alone. An
+        entry's files are evicted together, the least recently used
+        entry first.
+        """
+        # Entry name -> [size, last used, files]
+        entries: dict[str, list[Any]] = {}
+        for cache_file in self.cache_dir.iterdir():
+            if not cache_file.name.endswith((TABLE_SUFFIX, RESULTS_SUFFIX)):
+                continue
+            name = cache_file.name.split(".", 1)[0]
+            try:
+                if name.startswith(f"{self.prefix}-") and name != self.name:
+                    # The capture changed since this entry was written
+                    cache_file.unlink()
+                    continue
+                stat = cache_file.stat()
+            except OSError:
+                # Removed by another process
+                continue
+            entry = entries.setdefault(name, [0, 0.0, []])
+            entry[0] += stat.st_size
+            entry[1] = max(entry[1], stat.st_mtime)
+            entry[2].append(cache_file)
+        total = sum(size for size, _, _ in entries.values())
+        for name, (size, _, files) in sorted(entries.items(),
+                                             key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if name == self.name:
+                continue
+            logger.info("Evicting %s from cache", self.cache_dir / name)
+            for cache_file in files:
+                cache_file.unlink(missing_ok=True)
+            total -= size
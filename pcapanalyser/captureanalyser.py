@@ -16,21 +16,42 @@
 
 # suppress PEP8 import errors due to PATH settings
 # pylint: disable=E0401
+# pylint: disable=R0902
 """
 """
 import os
+from collections.abc import Callable
+from typing import Any
 
-from prettytable import PrettyTable
+import dpkt
 
 from pcapanalyser.grapher import Grapher
-from pcapanalyser.utils import create_logger, key_from_val
-from pcapanalyser.output import write_command_output, generate_kml
+from pcapanalyser.utils import (create_logger,
+                                format_address, format_endpoint)
+from pcapanalyser.output import generate_kml
+from pcapanalyser.streaming import StreamingAnalysis, AGGREGATORS
+from pcapanalyser.cache import AnalysisCache
+from pcapanalyser.packettable import PacketTable
+from pcapanalyser.protocolindex import ProtocolIndex
+from pcapanalyser.flows import NON_IP_CONVERSATION
+from pcapanalyser.dissectors import ip_protocol_name
+from pcapanalyser.writers import (OUTPUT_FORMAT, WRITERS, Result,
+                                  ResultTable, ResultWriter, close_writers)
 from pcapanalyser import parsing
 
 logger = create_logger()
 # Specify graph interval here
 # If none is specified, a default suitable value will be calculated
 GRAPH_INTERVAL = None
+# Graphs are saved as graph.<format> next to the results, png or svg
+GRAPH_FORMAT = "png"
+# KML is saved as ip_activity.<format> next to the results, kml or kmz
+KML_FORMAT = "kml"
+# Queries answered from the frames, which a parsed capture does not keep,
+# so they are always streamed
+FRAME_QUERIES = ("get_aggregate",)
+# Most common values listed for each protocol field
+LISTED_VALUES = 3
 
 
 FUNCTION_MAP = {
@@ -39,6 +60,7 @@ FUNCTION_MAP = {
     "filenames": "get_filenames_from_uris",
     "emails": "smtp_emails",
     "conversations": "conversations",
+    "flows": "flows",
     "plength": "avg_packet_length",
     "timestamps": "first_last_timestamps",
     "kml": "create_kml",
@@ -50,66 +72,165 @@ FUNCTION_MAP = {
 class CaptureAnalyser:
     """Capture Analyser object from which all functionality will be called."""
 
-    def __init__(self, filename: str) -> None:
-        """Initialise variables."""
-        self.packets = parsing.parse_packets(filename)
+    def __init__(self, filename: str, streaming: bool = False,
+                 workers: int = 1,
+                 window: tuple[float | None, float | None] = (None, None),
+                 use_cache: bool = True) -> None:
+        """Initialise variables.
+
+        Arguments
+        streaming -- feed each command from the file packet by packet
+        instead of parsing the whole capture into memory first
+        workers -- number of processes to stream the capture with, more
+        than one implies streaming
+        window -- (start_time, end_time), only analyse the packets
+        captured in [start_time, end_time), None leaves that side open
+        use_cache -- load and save the parsed capture and query results
+        in the analysis cache
+        """
+        self._packets: PacketTable | None = None
+        self.stream = None
+        self.window = window
+        self.cache = None
+        # The protocols seen in this capture, by name and by value
+        self.protocols = ProtocolIndex()
+        if use_cache:
+            mode = "workers" if workers > 1 else \
+                "stream" if streaming else "memory"
+            self.cache = AnalysisCache(filename, parsing.PARSER_VERSION,
+                                       self.window, mode)
+            # Cached results refer to the protocols of their parse
+            self.protocols.update(self.cache.protocols)
+        if streaming or workers > 1:
+            self.stream = StreamingAnalysis(filename, workers, *window,
+                                            self.protocols)
         self.write_filename = filename
+        # Graphs are only saved, not shown, when True. None decides by
+        # whether there is a display.
+        self.headless: bool | None = None
+        self.graph_format = GRAPH_FORMAT
+        self.kml_format = KML_FORMAT
+        # Keep the GeoIP database in memory between kml commands
+        self.geoip_in_memory = False
+        # Format results are saved in, see writers.WRITERS
+        self.output_format = OUTPUT_FORMAT
+        # The run's writer for each results file, opened by its first
+        # result and kept open until close
+        self.writers: dict[str, ResultWriter] = {}
         logger.info("Beginning Analysis for %s", self.write_filename)
 
-    def summarise(self, writefile: str) -> PrettyTable:
+    @property
+    def packets(self) -> PacketTable:
+        """Get the parsed capture, parsing it on first use."""
+        if self._packets is None and self.cache is not None:
+            loaded = self.cache.load_table()
+            if loaded is not None:
+                self._packets, protocols = loaded
+                self.protocols.update(protocols)
+        if self._packets is None:
+            self._packets = parsing.parse_packets(self.write_filename,
+                                                  *self.window,
+                                                  self.protocols)
+            if self.cache is not None:
+                self.cache.store_table(self._packets, self.protocols)
+        return self._packets
+
+    def analyse(self, function: str, *args: Any) -> Any:
+        """Call a parsing.get_* function on the packets or the stream.
+
+        Results are cached, so a repeat run on an unchanged capture
+        neither parses nor streams it.
+        """
+        query = (function, *args)
+        if self.cache is not None and self.cache.has_result(query):
+            return self.cache.results[query]
+        if self.stream is not None:
+            result = getattr(self.stream, function)(*args)
+        elif function in FRAME_QUERIES:
+            result = getattr(StreamingAnalysis(
+                self.write_filename, 1, *self.window, self.protocols),
+                function)(*args)
+        else:
+            result = getattr(parsing, function)(self.packets, *args)
+        if self.cache is not None:
+            self.cache.store_result(query, result, self.protocols)
+        return result
+
+    def write(self, command: str, result: Result, writefile: str) -> None:
+        """Save the result of a FUNCTION_MAP command to writefile."""
+        if writefile not in self.writers:
+            logger.info("Writing results to %s", writefile)
+            self.writers[writefile] = WRITERS[self.output_format](
+                writefile, self.write_filename)
+        self.writers[writefile].write(command, result)
+
+    def close(self) -> None:
+        """Close the writers, writing out any buffered results."""
+        close_writers(self.writers)
+
+    def __enter__(self) -> "CaptureAnalyser":
+        """Return the analyser, to be closed on exit."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Close the writers."""
+        self.close()
+
+    def summarise(self, writefile: str) -> Result:
         """Print summary of analysis."""
         logger.info("'summary' command executed")
-        output = PrettyTable()
+        output = ResultTable()
         output.field_names = ["Protocol", "Number of Packets",
                               "First timestamp", "Last timestamp",
                               "Avg packet length"]
         total_packets = 0
-        for protocol in self.packets["count"]:
-            protocol_id = parsing.protocol_ids[protocol]
-            number_of_packets = self.packets["count"][protocol]
+        protocol_count = self.analyse("get_protocol_count")
+        protocol_stats = self.analyse("get_protocol_stats")
+        for protocol, number_of_packets in protocol_count.items():
+            stats = protocol_stats.get(self.protocols.value(protocol))
             total_packets += number_of_packets
-            first, last = parsing.get_first_last_timestamps(
-                self.packets, protocol_id)
-            avg_length = parsing.get_avg_packet_length(
-                self.packets, protocol_id)
+            first, last = parsing.format_first_last(stats)
+            avg_length = parsing.format_avg_length(stats)
             output.add_row([protocol, number_of_packets,
                             first, last, avg_length])
         if len(output.rows) < 1:
             output = "No Supported Packets Detected"
-        write_command_output(str(output), writefile)
+        self.write("summarise", output, writefile)
         return output
 
-    def image_uris(self, writefile: str) -> PrettyTable | str:
+    def image_uris(self, writefile: str) -> Result:
         """Format and return image URI results."""
         logger.info("'image_uris' command executed")
-        image_uris = parsing.get_image_uris(self.packets)
-        output = PrettyTable()
+        image_uris = self.analyse("get_image_uris")
+        output = ResultTable()
         output.field_names = ["URI"]
         for uri in image_uris:
             output.add_row([uri])
         if len(output.rows) < 1:
             output = "No image URIs detected"
-        write_command_output(str(output), writefile)
+        self.write("uris", output, writefile)
         return output
 
-    def get_filenames_from_uris(self, writefile: str) -> PrettyTable | str:
+    def get_filenames_from_uris(self, writefile: str) -> Result:
         """Format and return filenames from URI results."""
         logger.info("'get_filenames_from_uris' command executed")
-        filenames = parsing.get_filenames_from_uris(self.packets)
-        output = PrettyTable()
+        # Reuses the image_uris query rather than extracting again
+        filenames = [parsing.uri_to_filename(uri)
+                     for uri in self.analyse("get_image_uris")]
+        output = ResultTable()
         output.field_names = ["Filename"]
         for filename in filenames:
             output.add_row([filename])
         if len(output.rows) < 1:
             output = "No filenames detected"
-        write_command_output(str(output), writefile)
+        self.write("filenames", output, writefile)
         return output
 
-    def smtp_emails(self, writefile: str) -> PrettyTable | str:
+    def smtp_emails(self, writefile: str) -> Result:
         """Format and return email results."""
         logger.info("'smtp_emails' command executed")
-        emails = parsing.get_smtp_emails(self.packets)
-        output = PrettyTable()
+        emails = self.analyse("get_smtp_emails")
+        output = ResultTable()
         output.field_names = ["Address", "To/From"]
         for direction, addresses in emails.items():
             # Mypy known bug below, ignore
@@ -117,69 +238,148 @@ class CaptureAnalyser:
                 output.add_row([email, direction])
         if len(output.rows) < 1:
             output = "No emails detected"
-        write_command_output(str(output), writefile)
+        self.write("emails", output, writefile)
         return output
 
-    def conversations(self, writefile: str) -> PrettyTable:
+    def conversations(self, writefile: str) -> Result:
         """Format and return conversations results."""
         logger.info("'conversations' command executed")
-        conversations = parsing.get_conversations(self.packets)
-        output = PrettyTable()
-        output.field_names = ["Sender", "Recipient", "Packets Sent"]
-        for key in sorted(conversations,
-                          key=lambda k: len(conversations[k]),
-                          reverse=True):
-            output.add_row([key[0], key[1], len(conversations[key])])
-        write_command_output(str(output), writefile)
+        flows = self.analyse("get_flows")
+        output = ResultTable()
+        output.field_names = ["Sender", "Recipient", "Packets Sent",
+                              "Bytes Sent", "Duration (s)"]
+        # Most packets first, then in the order they started
+        conversations = flows.host_pairs()
+        for key, stats in sorted(conversations.items(), key=lambda item: (
+                -item[1]["packets"], item[1]["first"], item[0])):
+            output.add_row([format_address(key[0]), format_address(key[1]),
+                            stats["packets"], stats["bytes"],
+                            round(stats["last"] - stats["first"], 3)])
+        if flows.non_ip_packets:
+            output.add_row([*NON_IP_CONVERSATION, 0, 0, 0.0])
+        self.write("conversations", output, writefile)
         return output
 
-    def avg_packet_length(self, writefile: str) -> PrettyTable:
+    def flows(self, writefile: str) -> Result:
+        """Format and return the bidirectional 5-tuple flows."""
+        logger.info("'flows' command executed")
+        flows = self.analyse("get_flows").flows
+        output = ResultTable()
+        output.field_names = ["Protocol", "Endpoint A", "Endpoint B",
+                              "Packets A->B", "Packets B->A", "Bytes A->B",
+                              "Bytes B->A", "Duration (s)", "TCP Flags"]
+        # Largest flows first, then in the order they started
+        for key, flow in sorted(flows.items(), key=lambda item: (
+                -sum(item[1].bytes), min(item[1].first), item[0])):
+            output.add_row([
+                ip_protocol_name(key.protocol),
+                format_endpoint(key.a, key.a_port),
+                format_endpoint(key.b, key.b_port),
+                *flow.packets, *flow.bytes, round(flow.duration(), 3),
+                dpkt.tcp.tcp_flags_to_str(flow.tcp_flags)])
+        if len(output.rows) < 1:
+            output = "No IP flows detected"
+        self.write("flows", output, writefile)
+        return output
+
+    def avg_packet_length(self, writefile: str) -> Result:
         """Format and return average packet length for each protocol."""
         logger.info("'avg_packet_length' command executed")
-        output = PrettyTable()
-        output.field_names = ["Protocol", "Avg Length"]
-        for protocol_id in parsing.protocol_ids.values():
-            avg_length = parsing.get_avg_packet_length(self.packets,
-                                                       protocol_id)
-            protocol = key_from_val(parsing.protocol_ids, protocol_id)
-            output.add_row([protocol, avg_length])
-        write_command_output(str(output), writefile)
+        output = ResultTable()
+        output.field_names = ["Protocol", "Avg Length", "Min Length",
+                              "Max Length", "Median Length",
+                              "95th Percentile Length"]
+        # Streamed captures only fill the protocols once they are read
+        protocol_stats = self.analyse("get_protocol_stats")
+        for protocol, protocol_id in self.protocols.items():
+            output.add_row([protocol, *parsing.format_lengths(
+                protocol_stats.get(protocol_id))])
+        self.write("plength", output, writefile)
         return output
 
-    def first_last_timestamps(self, writefile: str) -> PrettyTable:
+    def first_last_timestamps(self, writefile: str) -> Result:
         """Format and return first and last timestamps for each protocol."""
         logger.info("'first_last_timestamps' command executed")
-        output = PrettyTable()
+        output = ResultTable()
         output.field_names = ["Protocol", "First Timestamp", "Last Timestamp"]
-        for protocol_id in parsing.protocol_ids.values():
-            first, last = parsing.get_first_last_timestamps(self.packets,
-                                                            protocol_id)
-            protocol = key_from_val(parsing.protocol_ids, protocol_id)
+        # Streamed captures only fill the protocols once they are read
+        protocol_stats = self.analyse("get_protocol_stats")
+        for protocol, protocol_id in self.protocols.items():
+            first, last = parsing.format_first_last(
+                protocol_stats.get(protocol_id))
             output.add_row([protocol, first, last])
-        write_command_output(str(output), writefile)
+        self.write("timestamps", output, writefile)
         return output
 
     def draw_graph(self, writefile: str,
                    interval: float | None = GRAPH_INTERVAL) -> str:
         """Use Grapher class to plot packet data."""
         logger.info("'draw_graph' command executed")
-        directory, _ = os.path.split(writefile)
-        writefile = f"{directory}/graph.png"
-        grapher = Grapher(self.packets, self.write_filename,
-                          interval=interval, writefile=writefile)
+        writefile = os.path.join(os.path.dirname(writefile) or ".",
+                                 f"graph.{self.graph_format}")
+        grapher = Grapher(self.analyse("get_traffic"), self.write_filename,
+                          interval=interval, writefile=writefile,
+                          headless=self.headless)
         grapher.plot()
+        if grapher.headless:
+            return f"Graph saved to {writefile}"
         return "Graphing Success"
 
-    def create_kml(self, writefile: str) -> PrettyTable:
+    def create_kml(self, writefile: str) -> str:
         """Create and provide output for KML command."""
         logger.info("'create_kml' command executed")
-        result = generate_kml(self.packets)
-        write_command_output(str(result), writefile)
+        kml_path = os.path.join(os.path.dirname(writefile) or ".",
+                                f"ip_activity.{self.kml_format}")
+        result = generate_kml(self.analyse("get_destination_counts"),
+                              kml_path,
+                              use_cache=self.cache is not None,
+                              in_memory=self.geoip_in_memory)
+        self.write("kml", result, writefile)
         return result
 
     def execute_all_commands(self, writefile: str) -> str:
         """Execute every command."""
+        if self.stream is not None and \
+                (self.cache is None or not self.cache.results):
+            # Read the capture once for every command
+            self.stream.prepare(*AGGREGATORS)
         for mapping in FUNCTION_MAP.values():
             if mapping != "execute_all_commands":
                 print(getattr(self, mapping)(writefile))
         return "All commands executed"
+
+
+def register_command(name: str) -> Callable[[Callable], Callable]:
+    """Add a FUNCTION_MAP command, run by the decorated function.
+
+    The function is added to CaptureAnalyser and called like its other
+    commands, with the analyser and writefile. "all" runs it too.
+    """
+    def register(function: Callable) -> Callable:
+        setattr(CaptureAnalyser, function.__name__, function)
+        run_all = FUNCTION_MAP.pop("all")
+        FUNCTION_MAP[name] = function.__name__
+        FUNCTION_MAP["all"] = run_all
+        return function
+    return register
+
+
+@register_command("fields")
+def protocol_fields(analyser: CaptureAnalyser,
+                    writefile: str) -> Result:
+    """Format and return the most common values of each protocol field."""
+    logger.info("'protocol_fields' command executed")
+    protocols = analyser.analyse("get_aggregate", "fields")
+    output = ResultTable()
+    output.field_names = ["Protocol", "Field", "Most common values"]
+    for protocol, fields in protocols.items():
+        for field, values in fields.items():
+            listed = ", ".join(f"{value} ({number})" for value, number in
+                               values.most_common(LISTED_VALUES))
+            if len(values) > LISTED_VALUES:
+                listed += f" and {len(values) - LISTED_VALUES} more"
+            output.add_row([protocol, field, listed])
+    if len(output.rows) < 1:
+        output = "No registered protocols detected"
+    analyser.write("fields", output, writefile)
+    return output
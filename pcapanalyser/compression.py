@@ -0,0 +1,443 @@
+'''
+/***
+** Script:   compression.py
+** Desc:     Compressed capture input for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               gzip, zstd and lz4 captures are detected from their magic
+*               bytes and decompressed in large chunks on a background
+*               thread, so decompression overlaps with decoding.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+# pylint: disable=R0902
+"""Streaming decompression of gzip, zstd and lz4 captures."""
+import bisect
+import importlib
+import mmap
+import queue
+import struct
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from types import TracebackType
+from typing import Any, NamedTuple
+
+# Magic bytes -> compression, checked against the start of the file
+MAGICS = {
+    b"\x1f\x8b": "gzip",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"\x04\x22\x4d\x18": "lz4"
+}
+# Modules the compressions need that are not in the standard library
+MODULES = {"zstd": "zstandard", "lz4": "lz4.frame"}
+# Compressed bytes read at a time
+READ_SIZE = 1 << 20
+# Decompressed bytes handed to the reader at a time
+CHUNK_SIZE = 4 << 20
+# Decompressed chunks the thread may get ahead of the reader by
+QUEUED_CHUNKS = 4
+# BGZF member header up to its block size, see the SAM specification
+BGZF_HEADER = struct.Struct("<4s6xH2sHH")
+# zstd seekable format footer, number of frames, descriptor and magic
+SEEKABLE_FOOTER = struct.Struct("<IBI")
+SEEKABLE_MAGIC = 0x8f92eab1
+SKIPPABLE_FRAME_HEADER = struct.Struct("<II")
+SEEK_TABLE_MAGIC = 0x184d2a5e
+
+
+class SeekPoints(NamedTuple):
+    """Where each independently compressed member starts.
+
+    decompressed, compressed -- ascending offsets of the member starts in
+    the decompressed data and in the file
+    size -- length of the decompressed data
+    """
+
+    decompressed: list[int]
+    compressed: list[int]
+    size: int
+
+
+def detect_compression(filename: str) -> str | None:
+    """Get the compression of a file from its magic bytes, None if none."""
+    with open(filename, "rb") as capture:
+        start = capture.read(4)
+    for magic, compression in MAGICS.items():
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def new_decompressor(compression: str) -> Any:
+    """Create a decompressor for one member of a compressed file.
+
+    Every decompressor has decompress(), eof and unused_data, the data
+    after the end of its member.
+
+    Raises ValueError if the module for the compression is missing.
+    """
+    if compression == "gzip":
+        return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    try:
+        module = importlib.import_module(MODULES[compression])
+    except ImportError as error:
+        raise ValueError(f"{compression} compressed capture, install "
+                         f"{MODULES[compression].split('.')[0]} to read "
+                         "it") from error
+    if compression == "zstd":
+        return module.ZstdDecompressor().decompressobj()
+    return module.LZ4FrameDecompressor()
+
+
+def decompression_errors(compression: str) -> tuple[type[Exception], ...]:
+    """Get the exceptions a decompressor raises for corrupt data."""
+    if compression == "gzip":
+        return (zlib.error,)
+    if compression == "zstd":
+        return (importlib.import_module(MODULES[compression]).ZstdError,)
+    return (RuntimeError,)
+
+
+def decompress(data: bytes, decompressor: Any,
+               compression: str) -> tuple[bytes, Any]:
+    """Decompress data that may run over into the next members.
+
+    Returns
+    (output, decompressor) -- the decompressed data and the decompressor
+    for the rest of the file
+    """
+    output = []
+    while data:
+        output.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            break
+        data = decompressor.unused_data
+        decompressor = new_decompressor(compression)
+    return (b"".join(output), decompressor)
+
+
+def first_bytes(filename: str, length: int) -> bytes:
+    """Get the first bytes of a file, decompressed if it is compressed."""
+    compression = detect_compression(filename)
+    with open(filename, "rb") as capture:
+        if compression is None:
+            return capture.read(length)
+        decompressor = new_decompressor(compression)
+        output = b""
+        # A whole compressed block may be needed before there is output
+        while len(output) < length and (data := capture.read(READ_SIZE)):
+            try:
+                decompressed, decompressor = decompress(data, decompressor,
+                                                        compression)
+            except decompression_errors(compression) as error:
+                raise ValueError(f"corrupt {compression} data") from error
+            output += decompressed
+    return output[:length]
+
+
+def bgzf_seek_points(mapping: mmap.mmap) -> SeekPoints | None:
+    """Get the members of a BGZF file, None for any other gzip file.
+
+    Every BGZF member records its compressed size in its header and its
+    decompressed size in its trailer, so nothing is decompressed.
+    """
+    decompressed: list[int] = []
+    compressed: list[int] = []
+    size = offset = 0
+    while offset < len(mapping):
+        try:
+            magic, extra_length, subfield, subfield_length, block_size = \
+                BGZF_HEADER.unpack_from(mapping, offset)
+        except struct.error:
+            return None
+        if magic != b"\x1f\x8b\x08\x04" or extra_length != 6 or \
+                subfield != b"BC" or subfield_length != 2 or \
+                offset + block_size + 1 > len(mapping):
+            return None
+        decompressed.append(size)
+        compressed.append(offset)
+        offset += block_size + 1
+        size += struct.unpack_from("<I", mapping, offset - 4)[0]
+    return SeekPoints(decompressed, compressed, size)
+
+
+def zstd_seek_points(mapping: mmap.mmap) -> SeekPoints | None:
+    """Get the frames of a zstd seekable format file, None if not one.
+
+    The frame sizes come from the seek table at the end of the file.
+    """
+    if len(mapping) < SEEKABLE_FOOTER.size:
+        return None
+    frames, descriptor, magic = SEEKABLE_FOOTER.unpack_from(
+        mapping, len(mapping) - SEEKABLE_FOOTER.size)
+    # Each entry is the compressed and decompressed size, and a checksum
+    # if the top bit of the descriptor is set
+    entry = struct.Struct("<II4x" if descriptor & 0x80 else "<II")
+    table_start = len(mapping) - SEEKABLE_FOOTER.size - \
+        frames * entry.size - SKIPPABLE_FRAME_HEADER.size
+    if magic != SEEKABLE_MAGIC or table_start < 0 or \
+            SKIPPABLE_FRAME_HEADER.unpack_from(mapping, table_start)[0] \
+            != SEEK_TABLE_MAGIC:
+        return None
+    decompressed: list[int] = []
+    compressed: list[int] = []
+    size = offset = 0
+    for compressed_size, decompressed_size in entry.iter_unpack(
+            mapping[table_start + SKIPPABLE_FRAME_HEADER.size:
+                    len(mapping) - SEEKABLE_FOOTER.size]):
+        decompressed.append(size)
+        compressed.append(offset)
+        size += decompressed_size
+        offset += compressed_size
+    return SeekPoints(decompressed, compressed, size)
+
+
+SEEK_POINT_READERS: dict[str, Callable[[mmap.mmap], SeekPoints | None]] = {
+    "gzip": bgzf_seek_points,
+    "zstd": zstd_seek_points
+}
+
+
+def find_seek_points(filename: str, compression: str) -> SeekPoints | None:
+    """Get the members of a seekable compressed file, None if not one."""
+    reader = SEEK_POINT_READERS.get(compression)
+    if reader is None:
+        return None
+    with open(filename, "rb") as capture:
+        with mmap.mmap(capture.fileno(), 0,
+                       access=mmap.ACCESS_READ) as mapping:
+            return reader(mapping)
+
+
+class ChunkStream(ABC):
+    """Bytes produced in chunks on a background thread.
+
+    window() gives a reader a contiguous run of the bytes, reading
+    forwards consumes the chunks the thread has queued. Subclasses start
+    the thread in begin() and may seek backwards.
+    """
+
+    # Seconds to wait for a chunk before giving up, None waits forever
+    wait: float | None = None
+
+    def __init__(self) -> None:
+        """Initialise variables, the thread starts on first use."""
+        # The current window and the offset of its first byte
+        self.base = 0
+        self.data = b""
+        self.chunks: queue.Queue | None = None
+        self.stop = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.finished = False
+
+    @property
+    def seekable(self) -> bool:
+        """Check if reading can start part way through the data."""
+        return False
+
+    @property
+    def size(self) -> int | None:
+        """Get the length of the data, None until it is known."""
+        return self.base + len(self.data) if self.finished else None
+
+    @abstractmethod
+    def begin(self) -> None:
+        """Start producing chunks from the start of the data."""
+
+    def start_thread(self, target: Callable[..., None],
+                     *args: Any) -> None:
+        """Stop any running thread and start target on a new one.
+
+        target is called with args, then the queue to put chunks on and
+        the event that tells it to stop.
+        """
+        self.halt()
+        self.finished = False
+        self.stop = threading.Event()
+        self.chunks = queue.Queue(QUEUED_CHUNKS)
+        self.thread = threading.Thread(target=target, daemon=True,
+                                       args=(*args, self.chunks, self.stop))
+        self.thread.start()
+
+    @staticmethod
+    def put(chunks: queue.Queue, stop: threading.Event,
+            item: bytes | Exception | None) -> None:
+        """Queue an item, giving up if the reader stops the thread."""
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def halt(self) -> None:
+        """Stop the thread, if there is one."""
+        if self.thread is None:
+            return
+        self.stop.set()
+        # A thread blocked reading a pipe is left to end with the process
+        self.thread.join(timeout=1)
+        self.thread = None
+
+    def next_chunk(self) -> bytes | None:
+        """Get the next chunk, None at the end or if none came in time."""
+        if self.finished:
+            return None
+        if self.chunks is None:
+            self.begin()
+        if self.chunks is None:
+            raise RuntimeError(f"{type(self).__name__}.begin did not "
+                               "start producing chunks")
+        try:
+            chunk = self.chunks.get(timeout=self.wait)
+        except queue.Empty:
+            return None
+        if isinstance(chunk, Exception):
+            self.finished = True
+            raise chunk
+        if chunk is None:
+            self.finished = True
+        return chunk
+
+    def seek(self, start: int) -> None:
+        """Move the window forwards to start, if the data is that long."""
+        if start < self.base:
+            raise ValueError("cannot read back from a stream")
+        # Skip the chunks that end before start
+        while self.base + len(self.data) <= start:
+            chunk = self.next_chunk()
+            if chunk is None:
+                return
+            self.base, self.data = self.base + len(self.data), chunk
+
+    def window(self, start: int, end: int) -> tuple[int, bytes]:
+        """Get the data from start up to at least end.
+
+        Returns
+        (base, data) -- data starts at offset base, which is start unless
+        the data ends before it. It is shorter than asked for if the data
+        ends, or no more arrived in time, before end.
+        """
+        if not self.base <= start <= self.base + len(self.data):
+            self.seek(start)
+        if start > self.base + len(self.data):
+            # The data ends before start
+            return (start, b"")
+        parts = [self.data[start - self.base:]]
+        length = len(parts[0])
+        while start + length < end:
+            chunk = self.next_chunk()
+            if chunk is None:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        self.base, self.data = start, b"".join(parts)
+        return (self.base, self.data)
+
+    def close(self) -> None:
+        """Stop the thread."""
+        self.halt()
+
+    def __enter__(self) -> "ChunkStream":
+        """Use the stream as a context manager."""
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None,
+                 exc_value: BaseException | None,
+                 traceback: TracebackType | None) -> None:
+        """Stop the thread on leaving the context."""
+        self.close()
+
+
+class DecompressedStream(ChunkStream):
+    """Decompressed data of a capture, produced on a background thread.
+
+    Reading anything but forwards restarts decompression. Seekable files,
+    BGZF and the zstd seekable format, restart at the member before the
+    offset, others from the start of the file.
+    """
+
+    def __init__(self, filename: str, compression: str) -> None:
+        """Find any seek points, decompression starts on first use."""
+        super().__init__()
+        self.filename = filename
+        self.compression = compression
+        # Fail now rather than on the thread if the module is missing
+        new_decompressor(compression)
+        self.seek_points = find_seek_points(filename, compression)
+
+    @property
+    def seekable(self) -> bool:
+        """Check if decompression can start part way through the file."""
+        return self.seek_points is not None
+
+    @property
+    def size(self) -> int | None:
+        """Get the decompressed length, None until it is known."""
+        if self.seek_points is not None:
+            return self.seek_points.size
+        return super().size
+
+    def begin(self) -> None:
+        """Decompress from the start of the file."""
+        self.restart(0, 0)
+
+    def produce(self, compressed_offset: int, chunks: queue.Queue,
+                stop: threading.Event) -> None:
+        """Decompress from compressed_offset, queueing CHUNK_SIZE chunks.
+
+        Runs on the background thread. The queue ends with None, or the
+        error that stopped decompression.
+        """
+        try:
+            decompressor = new_decompressor(self.compression)
+            pending: list[bytes] = []
+            pending_length = 0
+            with open(self.filename, "rb") as capture:
+                capture.seek(compressed_offset)
+                while not stop.is_set():
+                    data = capture.read(READ_SIZE)
+                    if not data:
+                        break
+                    output, decompressor = decompress(data, decompressor,
+                                                      self.compression)
+                    pending.append(output)
+                    pending_length += len(output)
+                    if pending_length >= CHUNK_SIZE:
+                        self.put(chunks, stop, b"".join(pending))
+                        pending, pending_length = [], 0
+            if pending_length:
+                self.put(chunks, stop, b"".join(pending))
+            self.put(chunks, stop, None)
+        except decompression_errors(self.compression) as error:
+            corrupt = ValueError(f"corrupt {self.compression} data")
+            corrupt.__cause__ = error
+            self.put(chunks, stop, corrupt)
+
+    def restart(self, compressed_offset: int,
+                decompressed_offset: int) -> None:
+        """Stop any decompression and start again from an offset."""
+        self.start_thread(self.produce, compressed_offset)
+        self.base, self.data = decompressed_offset, b""
+
+    def seek(self, start: int) -> None:
+        """Move the window to start, if the capture is that long."""
+        restart = start < self.base
+        compressed_offset = decompressed_offset = 0
+        if self.seek_points is not None:
+            member = bisect.bisect_right(self.seek_points.decompressed,
+                                         start) - 1
+            compressed_offset = self.seek_points.compressed[member]
+            decompressed_offset = self.seek_points.decompressed[member]
+            # Jump ahead rather than decompress up to a later member
+            restart |= decompressed_offset > self.base + len(self.data)
+        if restart:
+            self.restart(compressed_offset, decompressed_offset)
+        super().seek(start)
@@ -0,0 +1,221 @@
+'''
+/***
+** Script:   dissectors.py
+** Desc:     Protocol dissectors for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Each protocol is registered under the value that
+*               identifies it at its layer and declares the fields it
+*               extracts. Fields are only parsed from the frame when a
+*               command reads them.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+# pylint: disable=R0903
+"""Registry of protocol dissectors with lazily parsed fields."""
+import ipaddress
+import struct
+from collections.abc import Callable
+from typing import Any
+
+import dpkt
+
+# A field is read from the frame and the offset its protocol starts at
+FieldReader = Callable[[bytes | memoryview, int], Any]
+
+# Layer -> the values identifying a protocol there -> its dissector.
+# ethertype: EtherType, snap: (OUI, type) of an 802.3 LLC SNAP header,
+# ip: IP protocol number, udp: UDP port, ipx: IPX socket
+DISSECTORS: dict[str, dict[Any, "Dissector"]] = {
+    "ethertype": {},
+    "snap": {},
+    "ip": {},
+    "udp": {},
+    "ipx": {}
+}
+# LLC header of 802.3 frames carrying a SNAP header
+SNAP_LLC = b"\xaa\xaa\x03"
+SNAP_HEADER_LENGTH = 8
+IPX_HEADER_LENGTH = 30
+IPX_DST_SOCKET = 16
+# Offset and option number of the DHCP message type option
+DHCP_OPTIONS_START = 240
+DHCP_MESSAGE_TYPE = 53
+DHCP_MESSAGE_TYPES = {1: "DISCOVER", 2: "OFFER", 3: "REQUEST",
+                      4: "DECLINE", 5: "ACK", 6: "NAK", 7: "RELEASE",
+                      8: "INFORM"}
+
+
+class Dissector:
+    """How to read the fields of one protocol from its header."""
+
+    def __init__(self, name: str, fields: dict[str, FieldReader]) -> None:
+        """Initialise variables.
+
+        Arguments
+        name -- the protocol name, counted under it if the protocol is
+        the network layer of a frame
+        fields -- field name -> reader, see at
+        """
+        self.name = name
+        self.fields = fields
+
+    def dissect(self, frame: bytes | memoryview, start: int) -> "Dissection":
+        """Get the fields of the protocol starting at start of frame."""
+        return Dissection(self, frame, start)
+
+
+class Dissection:
+    """The fields of one protocol in a frame, each parsed when first read."""
+
+    def __init__(self, dissector: Dissector, frame: bytes | memoryview,
+                 start: int) -> None:
+        """Initialise variables, nothing is parsed yet."""
+        self.dissector = dissector
+        self.frame = frame
+        self.start = start
+        self._values: dict[str, Any] = {}
+
+    def __getitem__(self, field: str) -> Any:
+        """Parse a field, None if the frame is too short to hold it."""
+        if field not in self._values:
+            try:
+                self._values[field] = self.dissector.fields[field](
+                    self.frame, self.start)
+            except (struct.error, IndexError, ValueError):
+                self._values[field] = None
+        return self._values[field]
+
+    def values(self) -> dict[str, Any]:
+        """Parse every field the dissector declares."""
+        return {field: self[field] for field in self.dissector.fields}
+
+
+def register_dissector(dissector: Dissector, layer: str,
+                       *keys: Any) -> Dissector:
+    """Register a dissector for the values identifying it at layer."""
+    for key in keys:
+        DISSECTORS[layer][key] = dissector
+    return dissector
+
+
+def at(offset: int, fmt: str,
+       convert: Callable[[Any], Any] | None = None) -> FieldReader:
+    """Read a field with struct format fmt at offset into its protocol."""
+    field = struct.Struct("!" + fmt)
+
+    def read(frame: bytes | memoryview, start: int) -> Any:
+        value = field.unpack_from(frame, start + offset)[0]
+        return convert(value) if convert is not None else value
+    return read
+
+
+def ipv4(packed: bytes) -> str:
+    """Format a packed IPv4 address."""
+    return str(ipaddress.IPv4Address(packed))
+
+
+def mac(packed: bytes) -> str:
+    """Format a packed MAC address."""
+    return ":".join(f"{byte:02x}" for byte in packed)
+
+
+def ip_protocol_name(protocol: int) -> str:
+    """Name an IP protocol number, registered names first."""
+    dissector = DISSECTORS["ip"].get(protocol)
+    return dissector.name if dissector is not None else \
+        dpkt.ip.get_ip_proto_name(protocol)
+
+
+def cdp_tlv(tlv_type: int) -> FieldReader:
+    """Read the text of a CDP type-length-value field."""
+    def read(frame: bytes | memoryview, start: int) -> str | None:
+        # Version, TTL and checksum, then the TLVs
+        offset = start + 4
+        while offset + 4 <= len(frame):
+            field_type, length = struct.unpack_from("!HH", frame, offset)
+            if length < 4:
+                break
+            if field_type == tlv_type:
+                return bytes(frame[offset + 4:offset + length]).decode(
+                    errors="replace")
+            offset += length
+        return None
+    return read
+
+
+def dhcp_message_type(frame: bytes | memoryview, start: int) -> str | None:
+    """Read the DHCP message type option."""
+    offset = start + DHCP_OPTIONS_START
+    while offset < len(frame):
+        option = frame[offset]
+        # Pad, then end of options
+        if option == 0:
+            offset += 1
+            continue
+        if option == 255 or offset + 2 >= len(frame):
+            break
+        if option == DHCP_MESSAGE_TYPE:
+            return DHCP_MESSAGE_TYPES.get(frame[offset + 2],
+                                          str(frame[offset + 2]))
+        offset += 2 + frame[offset + 1]
+    return None
+
+
+def rip_routes(frame: bytes | memoryview, start: int) -> int:
+    """Count the route entries of a RIP message."""
+    return max(0, (len(frame) - start - 4) // 20)
+
+
+register_dissector(Dissector("ARP", {
+    "opcode": at(6, "H"),
+    "sender_mac": at(8, "6s", mac),
+    "sender_ip": at(14, "4s", ipv4),
+    "target_ip": at(24, "4s", ipv4)
+}), "ethertype", dpkt.ethernet.ETH_TYPE_ARP)
+register_dissector(Dissector("IPX", {
+    "packet_type": at(5, "B"),
+    "dst_socket": at(IPX_DST_SOCKET, "H", hex),
+    "src_socket": at(28, "H", hex)
+}), "ethertype", dpkt.ethernet.ETH_TYPE_IPX)
+register_dissector(Dissector("CDP", {
+    "version": at(0, "B"),
+    "ttl": at(1, "B"),
+    "device_id": cdp_tlv(0x0001),
+    "port_id": cdp_tlv(0x0003),
+    "platform": cdp_tlv(0x0006)
+}), "snap", (0x00000c, dpkt.ethernet.ETH_TYPE_CDP))
+register_dissector(Dissector("EDP", {
+    "version": at(0, "B"),
+    "sequence": at(6, "H"),
+    "machine_mac": at(10, "6s", mac)
+}), "snap", (0x00e02b, 0x00bb))
+register_dissector(Dissector("OSPF", {
+    "version": at(0, "B"),
+    "type": at(1, "B"),
+    "router_id": at(4, "4s", ipv4),
+    "area_id": at(8, "4s", ipv4)
+}), "ip", dpkt.ip.IP_PROTO_OSPF)
+# EIGRP runs over IP, and IPX for Cisco's IPX routing
+EIGRP = Dissector("EIGRP", {
+    "version": at(0, "B"),
+    "opcode": at(1, "B"),
+    "as_number": at(16, "I")
+})
+register_dissector(EIGRP, "ip", 88)
+register_dissector(EIGRP, "ipx", 0x85be)
+register_dissector(Dissector("RIP", {
+    "command": at(0, "B"),
+    "version": at(1, "B"),
+    "routes": rip_routes
+}), "udp", 520)
+register_dissector(Dissector("DHCP", {
+    "op": at(0, "B"),
+    "message_type": dhcp_message_type,
+    "client_mac": at(28, "6s", mac)
+}), "udp", 67, 68)
@@ -0,0 +1,126 @@
+'''
+/***
+** Script:   flows.py
+** Desc:     Bidirectional flow table for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Packets are counted against their 5-tuple flow, both
+*               directions of a connection share one entry of fixed size.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+"""5-tuple flow table with per direction counters."""
+import math
+
+from pcapanalyser.types import Conversations, ConversationStats, FlowKey
+
+# Direction of a packet within its flow
+FORWARD = 0  # endpoint a to endpoint b
+REVERSE = 1  # endpoint b to endpoint a
+# Row shown for non-IP packets, kept from the original conversations output
+NON_IP_CONVERSATION = ("Unable to", "Calculate")
+
+
+def flow_key(protocol: int, src: int, sport: int, dst: int,
+             dport: int) -> tuple[FlowKey, int]:
+    """Get the flow of a packet and the direction it was sent in.
+
+    Endpoint a is the lower (address, port) so both directions of a
+    connection map to the same key.
+    """
+    if (src, sport) <= (dst, dport):
+        return (FlowKey(protocol, src, sport, dst, dport), FORWARD)
+    return (FlowKey(protocol, dst, dport, src, sport), REVERSE)
+
+
+class Flow:
+    """Counters of one flow, each list is indexed by direction."""
+
+    __slots__ = ("packets", "bytes", "first", "last", "tcp_flags")
+
+    def __init__(self) -> None:
+        """Initialise counters."""
+        self.packets = [0, 0]
+        self.bytes = [0, 0]
+        self.first = [math.inf, math.inf]
+        self.last = [-math.inf, -math.inf]
+        # Every TCP flag seen in either direction
+        self.tcp_flags = 0
+
+    def update(self, direction: int, timestamp: float, length: int,
+               tcp_flags: int = 0) -> None:
+        """Count a single packet."""
+        self.packets[direction] += 1
+        self.bytes[direction] += length
+        self.first[direction] = min(self.first[direction], timestamp)
+        self.last[direction] = max(self.last[direction], timestamp)
+        self.tcp_flags |= tcp_flags
+
+    def merge(self, other: "Flow") -> None:
+        """Add the counters of the same flow from elsewhere."""
+        for direction in (FORWARD, REVERSE):
+            self.packets[direction] += other.packets[direction]
+            self.bytes[direction] += other.bytes[direction]
+            self.first[direction] = min(self.first[direction],
+                                        other.first[direction])
+            self.last[direction] = max(self.last[direction],
+                                       other.last[direction])
+        self.tcp_flags |= other.tcp_flags
+
+    def duration(self) -> float:
+        """Get the seconds between the first and last packet."""
+        return max(self.last) - min(self.first)
+
+
+class FlowTable:
+    """Flows keyed by 5-tuple, with host pair rollups."""
+
+    def __init__(self) -> None:
+        """Initialise variables."""
+        self.flows: dict[FlowKey, Flow] = {}
+        self.non_ip_packets = 0
+
+    def add(self, key: FlowKey, direction: int, timestamp: float,
+            length: int, tcp_flags: int = 0) -> None:
+        """Count a packet against its flow."""
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self.flows[key] = Flow()
+        flow.update(direction, timestamp, length, tcp_flags)
+
+    def merge(self, other: "FlowTable") -> None:
+        """Add the flows counted elsewhere, e.g. by another shard."""
+        for key, flow in other.flows.items():
+            if key not in self.flows:
+                # Copied, so later merges leave the other table untouched
+                self.flows[key] = Flow()
+            self.flows[key].merge(flow)
+        self.non_ip_packets += other.non_ip_packets
+
+    def host_pairs(self) -> Conversations:
+        """Roll the flows up into (sender, recipient) address pairs.
+
+        Each direction of a flow counts towards its own pair, so the
+        result matches what each host sent to the other. Addresses are
+        left as integers, non-IP packets are only in non_ip_packets.
+        """
+        conversations: Conversations = {}
+        for key, flow in self.flows.items():
+            senders = ((key.a, key.b), (key.b, key.a))
+            for direction, (sender, recipient) in enumerate(senders):
+                if not flow.packets[direction]:
+                    continue
+                stats = conversations.setdefault(
+                    (sender, recipient),
+                    ConversationStats(packets=0, bytes=0, first=math.inf,
+                                      last=-math.inf))
+                stats["packets"] += flow.packets[direction]
+                stats["bytes"] += flow.bytes[direction]
+                stats["first"] = min(stats["first"], flow.first[direction])
+                stats["last"] = max(stats["last"], flow.last[direction])
+        return conversations
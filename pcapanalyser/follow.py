@@ -0,0 +1,322 @@
+'''
+/***
+** Script:   follow.py
+** Desc:     Follow mode for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Tails a capture that is still being written, e.g. by
+*               tcpdump -w, or read from stdin, and reports on a sliding
+*               time window of it at a fixed cadence.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+# pylint: disable=R0902
+"""Rolling window analysis of a capture as it is written."""
+import io
+import math
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+from pcapanalyser import parsing
+from pcapanalyser.captureanalyser import CaptureAnalyser, FUNCTION_MAP
+from pcapanalyser.compression import READ_SIZE, ChunkStream
+from pcapanalyser.grapher import Grapher
+from pcapanalyser.protocolindex import ProtocolIndex
+from pcapanalyser.reader import CaptureReader, open_capture
+from pcapanalyser.streaming import AGGREGATORS, Aggregator
+from pcapanalyser.timeseries import TrafficPyramid
+from pcapanalyser.types import PacketRecord
+from pcapanalyser.utils import create_logger
+from pcapanalyser.writers import (OUTPUT_FORMAT, Result, ResultTable,
+                                  ResultWriter, close_writers)
+
+# File name that reads the capture from stdin
+STDIN = "-"
+# Commands that can follow a capture -> the aggregator that answers them.
+# Their aggregators only count, so panes can be merged at any time.
+FOLLOW_COMMANDS = {
+    "summarise": "protocols",
+    "conversations": "flows",
+    "graph": "timestamps"
+}
+# Default seconds of capture time reported on, and between snapshots
+WINDOW = 60.0
+EVERY = 5.0
+# Number of panes a window is split into, data leaves it a pane at a time
+PANES = 12
+# Seconds to wait for a capture file to grow before checking again
+POLL_INTERVAL = 0.2
+# Bytes of a pcapng section header block, more than a pcap global header
+HEADER_LENGTH = 28
+
+logger = create_logger()
+
+
+class TailStream(ChunkStream):
+    """The bytes of a capture as they are written.
+
+    A file is polled for new data until it has not grown for idle_timeout
+    seconds, forever if that is None. A pipe, e.g. stdin, ends when the
+    writer closes it.
+    """
+
+    def __init__(self, source: io.BufferedReader,
+                 poll_interval: float = POLL_INTERVAL,
+                 idle_timeout: float | None = None) -> None:
+        """Initialise variables, reading starts on first use.
+
+        Arguments
+        source -- the capture, opened in binary mode
+        poll_interval -- seconds to wait for more data, a reader asking
+        for bytes that have not been written gets what there is by then
+        """
+        super().__init__()
+        self.source = source
+        self.wait = poll_interval
+        self.idle_timeout = idle_timeout
+
+    def begin(self) -> None:
+        """Start reading the source."""
+        self.start_thread(self.produce)
+
+    def produce(self, chunks: queue.Queue, stop: threading.Event) -> None:
+        """Queue whatever the source has, polling files for more.
+
+        Runs on the background thread. The queue ends with None, or the
+        error that stopped reading.
+        """
+        growing = self.source.seekable()
+        idle_since = time.monotonic()
+        try:
+            while not stop.is_set():
+                # Only what is already there, a pipe blocks until some is
+                data = self.source.read1(READ_SIZE)
+                if data:
+                    self.put(chunks, stop, data)
+                    idle_since = time.monotonic()
+                    continue
+                if not growing or (
+                        self.idle_timeout is not None and
+                        time.monotonic() - idle_since >= self.idle_timeout):
+                    break
+                stop.wait(self.wait)
+            self.put(chunks, stop, None)
+        except OSError as error:
+            self.put(chunks, stop, error)
+
+
+class RollingWindow:
+    """Aggregators over the most recent capture time, kept in panes.
+
+    The window is split into panes of equal length, each with its own
+    aggregators. Once the capture moves a pane past the window the pane
+    is dropped, so memory is bounded by the packets in the window rather
+    than the whole capture. The window always covers whole panes, it
+    spans between length minus one pane and length seconds of capture.
+    Packets older than the window, e.g. out of order, are not counted.
+    """
+
+    def __init__(self, length: float, names: list[str],
+                 panes: int = PANES) -> None:
+        """Initialise variables.
+
+        Arguments
+        length -- seconds of capture time covered
+        names -- the AGGREGATORS to run, their merge must not change the
+        aggregator merged in
+        """
+        self.pane_length = length / panes
+        self.number_of_panes = panes
+        self.names = names
+        # Pane number, counted from the epoch -> its aggregators
+        self.panes: dict[int, dict[str, Aggregator]] = {}
+        self.latest: int | None = None
+
+    def update(self, record: PacketRecord, protocol_name: str) -> None:
+        """Add a packet to its pane, moving the window on if it is new."""
+        pane = math.floor(record.timestamp / self.pane_length)
+        if self.latest is None or pane > self.latest:
+            self.latest = pane
+            self.evict()
+        if pane <= self.latest - self.number_of_panes:
+            return
+        if pane not in self.panes:
+            self.panes[pane] = {name: AGGREGATORS[name]()
+                                for name in self.names}
+        for aggregator in self.panes[pane].values():
+            aggregator.update(record, protocol_name)
+
+    def evict(self) -> None:
+        """Drop the panes the window has moved past.
+
+        Raises RuntimeError if no packet has placed the window yet.
+        """
+        if self.latest is None:
+            raise RuntimeError("the window has not been placed yet, "
+                               "update it with a packet first")
+        for pane in [pane for pane in self.panes
+                     if pane <= self.latest - self.number_of_panes]:
+            del self.panes[pane]
+
+    def bounds(self) -> tuple[float, float] | None:
+        """Get the capture time the window covers, None before any packet."""
+        if self.latest is None:
+            return None
+        return ((self.latest - self.number_of_panes + 1) * self.pane_length,
+                (self.latest + 1) * self.pane_length)
+
+    def snapshot(self) -> dict[str, Aggregator]:
+        """Get the window's aggregators, the panes are left as they are."""
+        merged = {name: AGGREGATORS[name]() for name in self.names}
+        for pane in sorted(self.panes):
+            for name, aggregator in self.panes[pane].items():
+                merged[name].merge(aggregator)
+        return merged
+
+
+def traffic_rate(traffic: TrafficPyramid, interval: float,
+                 write_filename: str) -> Result:
+    """Tabulate the Grapher series of packets and bytes per interval."""
+    if not traffic:
+        return "No packets in the window"
+    grapher = Grapher(traffic, write_filename, interval=interval)
+    times, number_of_packets = grapher.generate_graph_data()
+    _, bytes_sent = grapher.generate_graph_data(value="bytes")
+    output = ResultTable()
+    output.field_names = ["Interval starting time", "Packets Sent",
+                          "Bytes Sent"]
+    for row in zip(times, number_of_packets, bytes_sent):
+        output.add_row(list(row))
+    return output
+
+
+class CaptureFollower:
+    """Report on a sliding window of a capture as it is written.
+
+    Every `every` seconds, and once more when the capture ends, the
+    commands are run on the packets of the last `window` seconds of
+    capture time and printed.
+    """
+
+    def __init__(self, filename: str, commands: list[str], writefile: str,
+                 window: float = WINDOW, every: float = EVERY) -> None:
+        """Initialise variables.
+
+        Arguments
+        filename -- the capture to follow, STDIN to read it from stdin
+        commands -- FOLLOW_COMMANDS to run on each snapshot
+        """
+        self.filename = filename
+        self.commands = commands
+        self.writefile = writefile
+        self.every = every
+        self.rolling = RollingWindow(window, sorted(
+            {FOLLOW_COMMANDS[command] for command in commands}))
+        self.snapshots = 0
+        # Every protocol followed so far, windows only hold recent ones
+        self.protocols = ProtocolIndex()
+        # Format results are saved in, and the writers every snapshot
+        # shares, see CaptureAnalyser.write
+        self.output_format = OUTPUT_FORMAT
+        self.writers: dict[str, ResultWriter] = {}
+
+    def run(self, idle_timeout: float | None = None) -> str:
+        """Follow the capture until it ends.
+
+        Arguments
+        idle_timeout -- stop once a file has not grown for this many
+        seconds, None follows it until interrupted
+        """
+        logger.info("Following %s", self.filename)
+        # stdin is left open for the rest of the program
+        source = sys.stdin.fileno() if self.filename == STDIN \
+            else self.filename
+        try:
+            with open(source, "rb", closefd=source != sys.stdin.fileno()) \
+                    as capture:
+                self.follow_source(capture, idle_timeout)
+        except ValueError as error:
+            logger.error("Invalid PCAP file supplied - %s", error)
+            return f"The file {self.filename} is not a valid PCAP"
+        except KeyboardInterrupt:
+            logger.info("Stopped following %s", self.filename)
+        finally:
+            close_writers(self.writers)
+        return f"Followed {self.filename}, {self.snapshots} snapshots"
+
+    def follow_source(self, source: io.BufferedReader,
+                      idle_timeout: float | None) -> None:
+        """Read records from source as they arrive, until it ends."""
+        with TailStream(source, idle_timeout=idle_timeout) as stream:
+            # The reader needs the whole file header to pick a format
+            while len(stream.window(0, HEADER_LENGTH)[1]) < HEADER_LENGTH \
+                    and not stream.finished:
+                pass
+            with open_capture(self.filename, stream) as reader:
+                self.follow_reader(reader, stream)
+
+    def follow_reader(self, reader: CaptureReader,
+                      stream: ChunkStream) -> None:
+        """Feed the window every record, taking snapshots as they fall due.
+
+        A walk over the records ends where the data written so far does,
+        the next one carries on from the record it stopped at.
+        """
+        offset = 0
+        due = time.monotonic() + self.every
+        while True:
+            for timestamp_ns, link_type, pkt in reader.frames(offset):
+                record, protocol_name = parsing.decode_packet(
+                    timestamp_ns, pkt, link_type)
+                self.protocols.add(protocol_name, record.protocol)
+                self.rolling.update(record, protocol_name)
+                if time.monotonic() >= due:
+                    self.snapshot()
+                    due = time.monotonic() + self.every
+            offset = reader.stopped_at
+            if stream.finished:
+                break
+            if time.monotonic() >= due:
+                self.snapshot()
+                due = time.monotonic() + self.every
+        self.snapshot()
+
+    def snapshot(self) -> None:
+        """Run the commands on the window and print the results."""
+        self.snapshots += 1
+        bounds = self.rolling.bounds()
+        heading = "Waiting for packets" if bounds is None else \
+            "Window " + " to ".join(datetime.fromtimestamp(bound).strftime(
+                "%H:%M:%S") for bound in bounds)
+        print(heading)
+        # The snapshot stands in for streaming the capture
+        analyser = CaptureAnalyser(self.filename, streaming=True,
+                                   use_cache=False)
+        if analyser.stream is None:
+            raise RuntimeError(f"{self.filename} was not opened as a "
+                               "stream to take the snapshot from")
+        analyser.stream.aggregators = self.rolling.snapshot()
+        analyser.protocols.update(self.protocols)
+        analyser.output_format = self.output_format
+        analyser.writers = self.writers
+        analyser.write("window", heading, self.writefile)
+        for command in self.commands:
+            if command == "graph":
+                output = traffic_rate(analyser.stream.get_traffic(),
+                                      self.rolling.pane_length,
+                                      self.filename)
+                analyser.write("graph", output, self.writefile)
+            else:
+                output = getattr(analyser, FUNCTION_MAP[command])(
+                    writefile=self.writefile)
+            print(output)
+        # Each snapshot is readable from the results as soon as it is taken
+        self.writers[self.writefile].flush()
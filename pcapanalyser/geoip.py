@@ -0,0 +1,297 @@
+'''
+/***
+** Script:   geoip.py
+** Desc:     GeoIP lookups for PCAP_Analyser to define the Digital Network Signature in Google Earth
+*
+*               Only public addresses are looked up, and every result is
+*               kept in a persistent cache shared by all runs, so an
+*               address is looked up in the database once. Addresses
+*               are looked up in order, and one lookup answers every
+*               address in the network it finds.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+"""Cached GeoIP city lookups of integer addresses."""
+import ipaddress
+import os
+import sqlite3
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+
+import geoip2.database
+import geoip2.errors
+import maxminddb
+
+from pcapanalyser.types import GeoLocation
+from pcapanalyser.utils import (IPV4_MAPPED, create_logger,
+                                format_address, is_ipv4)
+
+DB_PATH = "pcapanalyser/geolitedatabase/GeoLiteCity.mmdb"
+# Kept out of the analysis cache directory, which is trimmed by age
+GEOIP_CACHE = "pcapanalyser/outputs/geoip/geoip.sqlite"
+# Least recently used results are evicted beyond this many
+MAX_GEOIP_ENTRIES = 1_000_000
+# Addresses per query, below SQLite's limit on query parameters
+BATCH_SIZE = 500
+
+logger = create_logger()
+# Databases loaded into memory, path -> (version, reader). Kept for the
+# life of the process, so a batch worker loads each one once.
+_resident: dict[str, tuple[str, geoip2.database.Reader]] = {}
+
+
+def is_public(address: int) -> bool:
+    """Check if an integer address can be in the GeoIP database.
+
+    Private, reserved, loopback, link-local and multicast ranges are not.
+    """
+    if is_ipv4(address):
+        ip_address: ipaddress.IPv4Address | ipaddress.IPv6Address = \
+            ipaddress.IPv4Address(address & 0xffffffff)
+    else:
+        ip_address = ipaddress.IPv6Address(address)
+    return ip_address.is_global and not ip_address.is_multicast
+
+
+def batches(addresses: list[int]) -> Iterator[list[int]]:
+    """Split addresses into lists of at most BATCH_SIZE."""
+    for start in range(0, len(addresses), BATCH_SIZE):
+        yield addresses[start:start + BATCH_SIZE]
+
+
+def database_version(db_path: str) -> str | None:
+    """Identify a database file by its size and mtime, None if missing."""
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+class GeoIPCache:
+    """Persistent least recently used cache of GeoIP results.
+
+    Results are rows of an SQLite database, shared by every run and
+    batch worker. Addresses the database does not know are cached as
+    well, so they are not looked up again. Results are for one version
+    of the GeoIP database, those of any other version are removed.
+    """
+
+    def __init__(self, version: str, path: str = GEOIP_CACHE,
+                 max_entries: int = MAX_GEOIP_ENTRIES) -> None:
+        """Open the cache, creating it if needed.
+
+        Arguments
+        version -- the GeoIP database the results are from, see
+        database_version
+        """
+        self.version = version
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Batch workers share the file, wait for each other's writes
+        self.connection = sqlite3.connect(path, timeout=30)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS locations ("
+                "address BLOB PRIMARY KEY, version TEXT, country TEXT, "
+                "city TEXT, latitude REAL, longitude REAL, last_used REAL)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS by_last_used "
+                "ON locations (last_used)")
+            self.connection.execute(
+                "DELETE FROM locations WHERE version != ?", (version,))
+
+    def get_many(self,
+                 addresses: list[int]) -> dict[int, GeoLocation | None]:
+        """Get the cached results of addresses, marking them as used.
+
+        Returns
+        results -- address -> its location, None for addresses the
+        database does not know. Uncached addresses are left out.
+        """
+        results: dict[int, GeoLocation | None] = {}
+        with self.connection:
+            for batch in batches(addresses):
+                keys = [address.to_bytes(16, "big") for address in batch]
+                placeholders = ",".join("?" * len(keys))
+                for key, *location in self.connection.execute(
+                        "SELECT address, country, city, latitude, longitude "
+                        f"FROM locations WHERE address IN ({placeholders})",
+                        keys):
+                    results[int.from_bytes(key, "big")] = \
+                        GeoLocation(*location) if location[2] is not None \
+                        else None
+                self.connection.execute(
+                    "UPDATE locations SET last_used = ? "
+                    f"WHERE address IN ({placeholders})",
+                    (time.time(), *keys))
+        return results
+
+    def put_many(self, results: dict[int, GeoLocation | None]) -> None:
+        """Cache lookup results, then evict beyond max_entries."""
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO locations "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(address.to_bytes(16, "big"), self.version,
+                  *(location or (None, None, None, None)), now)
+                 for address, location in results.items()])
+            self.connection.execute(
+                "DELETE FROM locations WHERE address IN (SELECT address "
+                "FROM locations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+    def close(self) -> None:
+        """Close the cache database."""
+        self.connection.close()
+
+
+def load_database(db_path: str = DB_PATH) -> geoip2.database.Reader | None:
+    """Get the database at db_path loaded into memory, None if missing.
+
+    It is read from disk once per process, and again only if the file
+    changes.
+    """
+    version = database_version(db_path)
+    if version is None:
+        return None
+    if db_path in _resident and _resident[db_path][0] != version:
+        _resident.pop(db_path)[1].close()
+    if db_path not in _resident:
+        logger.info("GeoIP - Loading %s into memory", db_path)
+        _resident[db_path] = (version, geoip2.database.Reader(
+            db_path, mode=maxminddb.MODE_MEMORY))
+    return _resident[db_path][1]
+
+
+@contextmanager
+def open_database(db_path: str,
+                  in_memory: bool) -> Iterator[geoip2.database.Reader]:
+    """Open the database, memory mapped, or resident if in_memory.
+
+    A memory mapped database is closed on exit, a resident one is left
+    for the next run. Raises FileNotFoundError if there is no database.
+    """
+    if in_memory:
+        reader = load_database(db_path)
+        if reader is None:
+            raise FileNotFoundError(f"No GeoIP database at {db_path}")
+        yield reader
+    else:
+        with geoip2.database.Reader(db_path) as reader:
+            yield reader
+
+
+def address_range(network: ipaddress.IPv4Network | ipaddress.IPv6Network,
+                  ) -> tuple[int, int]:
+    """Get the first and last integer address of a network."""
+    first = int(network.network_address)
+    last = int(network.broadcast_address)
+    if network.version == 4:
+        return (IPV4_MAPPED | first, IPV4_MAPPED | last)
+    return (first, last)
+
+
+def lookup(reader: geoip2.database.Reader, address: int,
+           ) -> tuple[GeoLocation | None, tuple[int, int] | None]:
+    """Look up a single address.
+
+    Returns
+    (location, addresses) -- None if the database does not know the
+    address, and the range of addresses with the same answer. The range
+    is None if the database cannot tell.
+    """
+    try:
+        response = reader.city(format_address(address))
+    except geoip2.errors.AddressNotFoundError as error:
+        return (None, address_range(error.network)
+                if error.network is not None else None)
+    except ValueError:
+        # IPv6 addresses in an IPv4 only database
+        return (None, None)
+    addresses = address_range(response.traits.network) \
+        if response.traits.network is not None else None
+    if response.location.latitude is None or \
+            response.location.longitude is None:
+        return (None, addresses)
+    return (GeoLocation(response.country.name or "N/A",
+                        response.city.name or "N/A",
+                        response.location.latitude,
+                        response.location.longitude), addresses)
+
+
+def lookup_many(reader: geoip2.database.Reader,
+                addresses: list[int]) -> dict[int, GeoLocation | None]:
+    """Look up addresses in order, a lookup per network they fall in.
+
+    The database answers with the network an address is in, so sorted
+    addresses in the same network reuse the answer without a search.
+
+    Returns
+    results -- address -> its location, None if the database does not
+    know it
+    """
+    results: dict[int, GeoLocation | None] = {}
+    location: GeoLocation | None = None
+    last = -1
+    searches = 0
+    for address in sorted(addresses):
+        if address > last:
+            searches += 1
+            location, network = lookup(reader, address)
+            last = network[1] if network is not None else address
+        results[address] = location
+    logger.info("GeoIP - %s addresses found with %s searches",
+                len(results), searches)
+    return results
+
+
+def locate(addresses: Iterable[int], db_path: str = DB_PATH,
+           use_cache: bool = True,
+           in_memory: bool = False) -> dict[int, GeoLocation]:
+    """Find where the public addresses among addresses are.
+
+    Cached results are used where there are any, the database is only
+    opened for the rest.
+
+    Arguments
+    in_memory -- look up in the database loaded into memory and kept
+    there for later calls, see load_database
+
+    Returns
+    locations -- address -> location, for the addresses found
+
+    Raises FileNotFoundError if there is no database to look up the
+    addresses that are not cached.
+    """
+    public = [address for address in addresses if is_public(address)]
+    version = database_version(db_path)
+    cache = GeoIPCache(version) if use_cache and version is not None \
+        else None
+    try:
+        results = cache.get_many(public) if cache is not None else {}
+        missing = [address for address in public if address not in results]
+        logger.info("GeoIP - %s public addresses, %s cached", len(public),
+                    len(results))
+        if missing and version is None:
+            logger.error("GeoIP - No database at %s", db_path)
+            raise FileNotFoundError(f"No GeoIP database at {db_path}")
+        if missing:
+            with open_database(db_path, in_memory) as reader:
+                looked_up = lookup_many(reader, missing)
+            results.update(looked_up)
+            if cache is not None:
+                cache.put_many(looked_up)
+    finally:
+        if cache is not None:
+            cache.close()
+    return {address: location for address, location in results.items()
+            if location is not None}
@@ -16,34 +16,66 @@
 # pylint: disable=E0401
 """
 """
+import os
 import statistics
-from datetime import datetime
+import sys
+from typing import Any
 import warnings
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-from matplotlib.widgets import TextBox
-
+from pcapanalyser.timeseries import TrafficPyramid, format_times
 from pcapanalyser.utils import create_logger
-from pcapanalyser.types import Packets
 
 logger = create_logger()
 warnings.filterwarnings("ignore")
+IMAGE_FORMATS = ("png", "svg")
+
+
+def has_display() -> bool:
+    """Check if a graph window can be shown."""
+    if sys.platform in ("win32", "darwin"):
+        return True
+    return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def load_pyplot(headless: bool) -> Any:
+    """Import pyplot, only once a graph is drawn.
+
+    Headless graphs use the non-interactive Agg backend, which needs no
+    display and never blocks.
+    """
+    # pylint: disable=C0415
+    import matplotlib
+    if headless:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
 
 
 class Grapher:
-    """Class to handle all graphical functionality."""
+    """Class to handle all graphical functionality.
+
+    The series for any interval is read from a TrafficPyramid, changing
+    the interval never counts the packets again.
+    """
+
+    def __init__(self, traffic: TrafficPyramid, write_filename: str,
+                 interval: float = None, writefile: str = None,
+                 headless: bool | None = None) -> None:
+        """Initialise function for Grapher.
 
-    def __init__(self, packets: Packets, write_filename: str,
-                 interval: float = None, writefile: str = None) -> None:
-        """Initialise function for Grapher."""
-        self.packets = packets
+        Arguments
+        traffic -- the capture's packets and bytes binned over time
+        headless -- save the graph to writefile, in the format of its
+        extension, instead of showing it. None when there is no display.
+        """
+        self.traffic = traffic
         if not interval:
             self.interval = self.calculate_suitable_interval()
         else:
             self.interval = interval
         self.writefile = writefile
         self.write_filename = write_filename
+        self.headless = not has_display() if headless is None else headless
 
     @staticmethod
     def calculate_threshold(number_of_packets: list) -> float | bool:
@@ -63,19 +95,9 @@ class Grapher:
             logger.error("Graph - Error calculating threshold")
             return False
 
-    def increment_interval(self,
-                           current_interval: tuple) -> tuple[float, float]:
-        """Increment the timestamps by the defined interval."""
-        next_interval = (current_interval[0]+self.interval,
-                         current_interval[1]+self.interval)
-        return next_interval
-
     def get_starting_ending_timestamp(self) -> tuple[float, float]:
         """Extract the timestamp of the first packet."""
-        timestamps = []
-        for timestamp, _ in self.packets["raw"].items():
-            timestamps.append(timestamp)
-        return (timestamps[0], timestamps[-1])
+        return (self.traffic.first, self.traffic.last)
 
     def calculate_suitable_interval(self) -> float:
         """Calculate a suitable interval given first and last timestamp."""
@@ -83,77 +105,113 @@ class Grapher:
         # "Suitable" should be 17 intervals
         return (last - first) / 17
 
-    def generate_graph_data(self) -> tuple[list[str], list[int]]:
+    def generate_graph_data(self, protocol: int | str | None = None,
+                            value: str = "packets") -> tuple[list[str],
+                                                             list[int]]:
         """Generate the data for the graph.
 
         Seperates the data into Equal time intervals, and stores the
         number of packets sent during That interval. Returns a tuple
-        containing a list of the last timestamps in each interval
-        and the number of packets sent in that interval
+        containing a list of the first timestamps in each interval
+        and the number of packets sent in that interval. The interval
+        is rounded up to whole bins, see TrafficPyramid.round_interval.
+
+        Arguments
+        protocol -- only count this protocol, None counts every packet
+        value -- "packets", or "bytes" to sum the bytes sent instead
         """
         logger.info("Generating graph data and plotting")
-        timestamp = self.get_starting_ending_timestamp()[0]
-        current_interval = (timestamp, timestamp+self.interval)
-        packets = {current_interval: 0}
-        for timestamp, _ in self.packets["raw"].items():
-            # If new interval, increment timestamps, create new entry in dict
-            if timestamp - current_interval[0] >= self.interval:
-                current_interval = self.increment_interval(current_interval)
-                packets.setdefault(current_interval, 0)
-            # Increment number of packets sent in dict
-            packets[(current_interval[0], current_interval[1])] += 1
-        times = [datetime.fromtimestamp(ts[0]).strftime(
-                "%H:%M:%S") for ts in packets]
-        number_of_packets = list(packets.values())
-        return (times, number_of_packets)
-
-    def change_interval(self, value: str) -> None:
-        """Handle changing on interval and re-drawing."""
+        self.interval, values = self.traffic.series(self.interval,
+                                                    protocol, value)
+        times = format_times(self.traffic.interval_starts(self.interval,
+                                                          len(values)))
+        return (times, values.tolist())
+
+    def draw(self, axis: Any, graph_data: tuple[list[str], list[int]],
+             threshold: float) -> None:
+        """Draw the series and its threshold on an axis."""
+        times, number_of_packets = graph_data
+        axis.set(title=f"""Number Of Packets Sent Over Time
+                        \n{self.write_filename}""",
+                 xlabel="Interval starting time",
+                 ylabel="Packets Sent")
+        axis.plot(times, number_of_packets, marker="o")
+        axis.set_axisbelow(True)
+        axis.yaxis.grid(color="gray", linestyle="dashed")
+        axis.xaxis.grid(color="gray", linestyle="dashed")
+        axis.tick_params(axis="x", which="major", labelsize="small",
+                         labelrotation=90)
+        axis.axhline(y=threshold, color="red",
+                     label=f"Heavy Traffic Threshold {threshold:.2f}")
+        # pylint: disable=C0415
+        import matplotlib.patches as mpatches
+        threshold_label = mpatches.Patch(
+            color="red",
+            label=f"Heavy traffic threshold: {threshold:.2f}")
+        interval_label = mpatches.Patch(
+            color="blue",
+            label=f"Interval: {self.interval:.2f}s")
+        axis.legend(handles=[interval_label, threshold_label])
+
+    def change_interval(self, value: str, axis: Any) -> None:
+        """Handle changing on interval and re-drawing the axis."""
         try:
-            self.interval = float(value)
-            plt.close()
-            self.plot()
+            interval = float(value)
         except ValueError:  # User specified something other than a number
             logger.error("Graph - User Input Error")
+            return
+        if interval <= 0:
+            logger.error("Graph - User Input Error")
+            return
+        self.interval = interval
+        graph_data = self.generate_graph_data()
+        threshold = self.calculate_threshold(graph_data[1])
+        axis.clear()
+        if threshold:
+            self.draw(axis, graph_data, threshold)
+        axis.figure.canvas.draw_idle()
+
+    def save(self, figure: Any) -> None:
+        """Write the figure to writefile, if there is one."""
+        if not self.writefile:
+            return
+        extension = os.path.splitext(self.writefile)[1].lstrip(".").lower()
+        try:
+            figure.savefig(self.writefile, bbox_inches="tight",
+                           format=extension if extension in IMAGE_FORMATS
+                           else None)
+        except PermissionError:
+            pass
 
     def plot(self) -> None:
-        """Plot the data after generation."""
-        times, number_of_packets = self.generate_graph_data()
-        threshold = self.calculate_threshold(number_of_packets)
+        """Plot the data after generation.
+
+        Headless graphs are only saved. Otherwise the graph is shown with
+        a box to change the interval, which redraws it in place.
+        """
+        plt = load_pyplot(self.headless)
+        graph_data = self.generate_graph_data()
+        threshold = self.calculate_threshold(graph_data[1])
         if threshold:
             figure = plt.figure(f"{self.write_filename} Analysis")
             axis = figure.add_subplot()
-            axis.set(title=f"""Number Of Packets Sent Over Time
-                            \n{self.write_filename}""",
-                     xlabel="Interval starting time",
-                     ylabel="Packets Sent")
-            axis.plot(times, number_of_packets, marker="o")
-            axis.set_axisbelow(True)
-            axis.yaxis.grid(color="gray", linestyle="dashed")
-            axis.xaxis.grid(color="gray", linestyle="dashed")
-            plt.xticks(rotation=90)
-            plt.tick_params(axis="x", which="major", labelsize="small")
-            axis.axhline(y=threshold, color="red",
-                         label=f"Heavy Traffic Threshold {threshold:.2f}")
-            threshold_label = mpatches.Patch(
-                color="red",
-                label=f"Heavy traffic threshold: {threshold:.2f}")
-            interval_label = mpatches.Patch(
-                color="blue",
-                label=f"Interval: {self.interval:.2f}s")
-            axis.legend(handles=[interval_label, threshold_label])
-            change_interval_location = plt.axes([0.15, 0.02, 0.8, 0.04])
-            change_interval = TextBox(change_interval_location,
-                                      "Interval",
-                                      initial=round(self.interval, 2))
-            change_interval.on_submit(self.change_interval)
-            plt.tight_layout()
-            if self.writefile:
-                try:
-                    figure.savefig(self.writefile, bbox_inches="tight")
-                except PermissionError:
-                    pass
-            plt.show()
+            self.draw(axis, graph_data, threshold)
+            if not self.headless:
+                # pylint: disable=C0415
+                from matplotlib.widgets import TextBox
+                change_interval_location = figure.add_axes(
+                    [0.15, 0.02, 0.8, 0.04])
+                change_interval = TextBox(change_interval_location,
+                                          "Interval",
+                                          initial=round(self.interval, 2))
+                change_interval.on_submit(
+                    lambda value: self.change_interval(value, axis))
+            figure.tight_layout()
+            self.save(figure)
+            if self.headless:
+                plt.close(figure)
+            else:
+                plt.show()
         else:
             figure = plt.figure(f"{self.write_filename} Analysis Failure")
             axis = figure.add_subplot()
@@ -161,5 +219,9 @@ class Grapher:
                      TIME PERIOD OF PCAP FILE TOO SHORT""")
             axis.axhline(y=5, color="red",
                          label="ERROR - COULD NOT CALCULATE")
-            plt.legend()
-            plt.show(block=False)
+            axis.legend()
+            if self.headless:
+                self.save(figure)
+                plt.close(figure)
+            else:
+                plt.show(block=False)
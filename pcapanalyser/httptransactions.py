@@ -0,0 +1,311 @@
+'''
+/***
+** Script:   httptransactions.py
+** Desc:     HTTP transaction extractor for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Only TCP connections that look like HTTP are reassembled,
+*               request and response heads are parsed straight from the
+*               stream bytes and paired up per connection.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+"""HTTP request and response extraction from reassembled TCP streams."""
+import bisect
+import re
+from typing import NamedTuple
+
+from pcapanalyser.reassembly import (TcpReassembler, TcpStream,
+                                     connection_key, reverse_flow)
+from pcapanalyser.types import HttpTransaction, TcpSegment
+
+# Connections on these ports are HTTP even when captured mid-stream
+HTTP_PORTS = frozenset((80, 591, 3128, 8000, 8008, 8080, 8888))
+HTTP_METHODS = (b"GET", b"HEAD", b"POST", b"PUT", b"DELETE", b"OPTIONS",
+                b"TRACE", b"CONNECT", b"PATCH")
+# What the first payload of a connection on another port must start with
+HTTP_PREFIXES = tuple(method + b" " for method in HTTP_METHODS) + (b"HTTP/",)
+REQUEST_LINE = re.compile(
+    rb"(?P<method>" + b"|".join(HTTP_METHODS) +
+    rb") (?P<uri>[^ \r\n]+) HTTP/\d\.\d\r?\n")
+RESPONSE_LINE = re.compile(rb"HTTP/\d\.\d (?P<status>\d{3})[^\r\n]*\r?\n")
+# Responses to these never have a body
+BODYLESS_STATUSES = (204, 304)
+IMAGE_EXTENSIONS = ["jpg", "jpeg", "gif", "png", "ico"]
+
+
+class HttpRequest(NamedTuple):
+    """Request head, waiting to be paired with its response."""
+
+    timestamp: float
+    method: str
+    host: str
+    uri: str
+
+
+class HttpResponse(NamedTuple):
+    """Response head, waiting to be paired with its request."""
+
+    timestamp: float
+    status: int
+    content_type: str
+
+
+def parse_headers(data: bytes,
+                  position: int) -> tuple[dict[bytes, bytes], int] | None:
+    """Parse header lines up to the blank line that ends them.
+
+    Returns
+    (headers, end) -- lower case names to values and the position after
+    the blank line, None if the stream ends before it
+    """
+    headers: dict[bytes, bytes] = {}
+    while True:
+        line_end = data.find(b"\n", position)
+        if line_end < 0:
+            return None
+        line = data[position:line_end].rstrip(b"\r")
+        position = line_end + 1
+        if not line:
+            return (headers, position)
+        name, _, value = line.partition(b":")
+        headers[name.strip().lower()] = value.strip()
+
+
+def skip_chunks(data: bytes, position: int) -> int:
+    """Get the position after a chunked body."""
+    while True:
+        line_end = data.find(b"\n", position)
+        if line_end < 0:
+            return len(data)
+        try:
+            size = int(data[position:line_end].split(b";")[0], 16)
+        except ValueError:
+            # Not a chunk, resynchronise from here
+            return position
+        position = line_end + 1
+        if not size:
+            # Skip any trailer fields
+            trailers = parse_headers(data, position)
+            return trailers[1] if trailers else len(data)
+        position += size + 2
+
+
+def body_end(data: bytes, position: int, headers: dict[bytes, bytes],
+             response: bool) -> int:
+    """Get the position after the body of a message.
+
+    Arguments
+    position -- where the body starts, after the header block
+    response -- responses without a length run to the end of the stream
+    """
+    if b"chunked" in headers.get(b"transfer-encoding", b"").lower():
+        return skip_chunks(data, position)
+    length = headers.get(b"content-length", b"")
+    if length.isdigit():
+        return min(len(data), position + int(length))
+    return len(data) if response else position
+
+
+def parse_messages(stream: TcpStream, start_line: re.Pattern,
+                   response: bool) -> list[tuple[re.Match,
+                                                 dict[bytes, bytes]]]:
+    """Parse the start line and headers of every message in a stream.
+
+    Messages are only looked for where the previous message's body ends
+    or, failing that, where a segment starts. A message never has to be
+    searched for inside another's body, and a wrong Content-Length, e.g.
+    from missing segments, is recovered from at the next segment.
+
+    Returns
+    messages -- (start line match, headers) of each message
+    """
+    messages = []
+    data = bytes(stream.data)
+    position = resync_from = 0
+    while position < len(data):
+        match = start_line.match(data, position)
+        parsed = parse_headers(data, match.end()) if match else None
+        if match is None or parsed is None:
+            # Continue from the next segment after the last good position
+            index = bisect.bisect_right(stream.segment_offsets, resync_from)
+            if index == len(stream.segment_offsets):
+                break
+            position = resync_from = stream.segment_offsets[index]
+            continue
+        headers, position = parsed
+        messages.append((match, headers))
+        resync_from = position
+        status = int(match["status"]) if response else 200
+        # Responses to HEAD requests give a length but carry no body
+        if status not in BODYLESS_STATUSES and status >= 200 and \
+                not data.startswith(b"HTTP/", position):
+            position = body_end(data, position, headers, response)
+    return messages
+
+
+def parse_requests(stream: TcpStream) -> list[HttpRequest]:
+    """Parse every request head in a client to server stream."""
+    return [HttpRequest(stream.timestamp_at(match.start()),
+                        match["method"].decode(),
+                        headers.get(b"host", b"").decode("ascii",
+                                                         "replace"),
+                        match["uri"].decode("ascii", "replace"))
+            for match, headers in parse_messages(stream, REQUEST_LINE,
+                                                 response=False)]
+
+
+def parse_responses(stream: TcpStream) -> list[HttpResponse]:
+    """Parse every response head in a server to client stream."""
+    return [HttpResponse(stream.timestamp_at(match.start()),
+                         int(match["status"]),
+                         headers.get(b"content-type", b"").split(b";")[0]
+                         .strip().lower().decode("ascii", "replace"))
+            for match, headers in parse_messages(stream, RESPONSE_LINE,
+                                                 response=True)]
+
+
+class HttpExtractor:
+    """Pairs the requests and responses of HTTP connections.
+
+    Segments of connections that are not HTTP are dropped before
+    reassembly. A connection is HTTP if either port is in HTTP_PORTS,
+    or its first payload starts with a request or status line.
+    Responses are paired with requests in order, as HTTP/1.x answers
+    requests in the order they were sent. Extractors of consecutive
+    shards of a capture are combined with merge.
+    """
+
+    def __init__(self) -> None:
+        """Initialise variables."""
+        self.reassembler = TcpReassembler()
+        # Lower of the two directions' flows -> is HTTP
+        self.http_connections: dict[tuple[int, int, int, int], bool] = {}
+        # Keyed by the client to server flow
+        self.requests: dict[tuple[int, int, int, int],
+                            list[HttpRequest]] = {}
+        self.responses: dict[tuple[int, int, int, int],
+                             list[HttpResponse]] = {}
+        self.transactions: list[HttpTransaction] = []
+
+    def is_http(self, segment: TcpSegment) -> bool | None:
+        """Check a segment's connection, None if it is undecided."""
+        connection = connection_key(segment.flow)
+        decided = self.http_connections.get(connection)
+        if decided is not None:
+            return decided
+        if segment.flow[1] in HTTP_PORTS or segment.flow[3] in HTTP_PORTS:
+            decided = True
+        elif segment.payload:
+            decided = segment.payload.startswith(HTTP_PREFIXES)
+            if not decided:
+                # Drop anything already reassembled for the connection
+                self.reassembler.streams.pop(segment.flow, None)
+                self.reassembler.streams.pop(reverse_flow(segment.flow),
+                                             None)
+        else:
+            return None
+        self.http_connections[connection] = decided
+        return decided
+
+    def add(self, segment: TcpSegment) -> None:
+        """Reassemble a segment of a HTTP connection."""
+        if self.reassembler.carry(segment):
+            # Classified once it follows the earlier shard's segments
+            return
+        if self.is_http(segment) is not False:
+            self.parse(self.reassembler.add(segment))
+
+    def parse(self, streams: list[TcpStream]) -> None:
+        """Parse completed streams, pairing up what can be paired."""
+        for stream in streams:
+            requests = parse_requests(stream)
+            if requests:
+                client_flow = stream.flow
+                self.requests.setdefault(client_flow, []).extend(requests)
+            else:
+                client_flow = reverse_flow(stream.flow)
+                self.responses.setdefault(client_flow, []).extend(
+                    parse_responses(stream))
+            self.pair(client_flow)
+
+    def pair(self, client_flow: tuple[int, int, int, int]) -> None:
+        """Match up the waiting requests and responses of a connection.
+
+        A response sent before the next request answers one that was not
+        captured, e.g. it was sent before the capture or shard started.
+        """
+        requests = self.requests.get(client_flow, [])
+        responses = self.responses.get(client_flow, [])
+        paired = answered = 0
+        while paired < len(requests) and answered < len(responses):
+            response = responses[answered]
+            answered += 1
+            if response.timestamp >= requests[paired].timestamp:
+                self.transactions.append(HttpTransaction(
+                    *requests[paired], response.status,
+                    response.content_type))
+                paired += 1
+        del requests[:paired], responses[:answered]
+
+    def merge(self, other: "HttpExtractor") -> None:
+        """Continue with the unfinished extractor of the next shard.
+
+        The segments it carried continue this extractor's connections,
+        then its own connections, requests and responses are taken over.
+        """
+        for segment in other.reassembler.carried:
+            self.add(segment)
+        for connection, decided in other.http_connections.items():
+            self.http_connections.setdefault(connection, decided)
+        self.parse(self.reassembler.adopt(other.reassembler))
+        for client_flow, requests in other.requests.items():
+            self.requests.setdefault(client_flow, []).extend(requests)
+        for client_flow, responses in other.responses.items():
+            self.responses.setdefault(client_flow, []).extend(responses)
+        for client_flow in other.requests.keys() | other.responses.keys():
+            self.pair(client_flow)
+        self.transactions += other.transactions
+
+    def finish(self) -> list[HttpTransaction]:
+        """Parse the remaining streams, unanswered requests are kept.
+
+        Returns
+        transactions -- every transaction, in the order requests were sent
+        """
+        self.parse(self.reassembler.finish())
+        for requests in self.requests.values():
+            self.transactions += [HttpTransaction(*request, None, "")
+                                  for request in requests]
+        self.requests.clear()
+        self.responses.clear()
+        self.transactions.sort(key=lambda transaction: transaction.timestamp)
+        return self.transactions
+
+
+def is_image(transaction: HttpTransaction,
+             file_extensions: list[str]) -> bool:
+    """Check if a transaction fetched an image.
+
+    Decided by the response's Content-Type. Without one, e.g. no
+    response was captured or a 304, by the extension of the URI's path.
+    """
+    if transaction.content_type:
+        return transaction.content_type.startswith("image/")
+    name = transaction.uri.split("?")[0].rsplit("/", 1)[-1]
+    return "." in name and \
+        name.rsplit(".", 1)[-1].lower() in file_extensions
+
+
+def image_uris(transactions: list[HttpTransaction],
+               file_extensions: list[str] | None = None) -> list[str]:
+    """Get the URIs of the transactions that fetched an image."""
+    if not file_extensions:
+        file_extensions = IMAGE_EXTENSIONS
+    return [transaction.uri[0:45] for transaction in transactions
+            if is_image(transaction, file_extensions)]
@@ -12,63 +12,91 @@
 # suppress PEP8 import errors due to PATH settings
 # pylint: disable=E0401
 """Output functionality."""
-import simplekml
-import dpkt
-import geoip2.database
+import io
+import zipfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import TextIO
+from xml.sax.saxutils import escape
 
-from pcapanalyser.utils import hex_to_ipv4, create_logger
-from pcapanalyser.types import Packets
+from pcapanalyser.geoip import DB_PATH, locate
+from pcapanalyser.types import GeoLocation
+from pcapanalyser.utils import create_logger, format_address
 
-DB_PATH = "pcapanalyser/geolitedatabase/GeoLiteCity.mmdb"
+KML_PATH = "pcapanalyser/outputs/ip_activity.kml"
+KML_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<kml xmlns="http://www.opengis.net/kml/2.2">\n<Document>\n')
+KML_FOOTER = "</Document>\n</kml>\n"
+# Addresses named in a city's description, the busiest first
+LISTED_ADDRESSES = 10
 
 logger = create_logger()
 
 
-def generate_kml(packets: Packets) -> str:
-    """Generate KML file from packets."""
-    logger.info("Generating KML file")
-    # Find unique destination addresses and how many packets were sent to each
-    dst_addresses = set()
-    packets_sent_to_address: dict[str, int] = {}
-    for _, pkt in packets["raw"].items():
-        ethernet = dpkt.ethernet.Ethernet(pkt)
-        if ethernet.type == dpkt.ethernet.ETH_TYPE_IP:
-            dst_ip = hex_to_ipv4(ethernet.data.dst.hex())
-            dst_addresses.add(dst_ip)
-            packets_sent_to_address.setdefault(dst_ip, 0)
-            packets_sent_to_address[dst_ip] += 1
+@contextmanager
+def open_kml(path: str) -> Iterator[TextIO]:
+    """Open a KML file for writing, zipped as doc.kml for a .kmz path."""
+    if not path.lower().endswith(".kmz"):
+        with open(path, "w", encoding="utf-8") as kml_file:
+            yield kml_file
+        return
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as kmz, \
+            kmz.open("doc.kml", "w") as member, \
+            io.TextIOWrapper(member, encoding="utf-8") as kml_file:
+        yield kml_file
+
+
+def city_placemark(location: GeoLocation,
+                   addresses: list[tuple[int, int]]) -> str:
+    """Format the placemark of a city.
 
-    # Plot the KML
-    kml = simplekml.Kml()
-    with geoip2.database.Reader(DB_PATH) as reader:
-        for address in dst_addresses:
-            try:
-                response = reader.city(address)
-                country = response.country.name if response.country.name \
-                    is not None else "N/A"
-                city = response.city.name if response.city.name \
-                    is not None else "N/A"
-                kml.newpoint(name=address,
-                             coords=[(response.location.longitude,
-                                      response.location.latitude)],
-                             description=f"""Packets Sent : \
-                                {packets_sent_to_address[address]}
-                                Country : {country}
-                                City : {city}""")
-            except geoip2.errors.AddressNotFoundError:
-                # Address unknown (probably means it's private), just pass
-                logger.error("KML - Found unknown address (probably private)")
-    kml.save("pcapanalyser/outputs/ip_activity.kml")
-    return "KML file saved to pcapanalyser/outputs/ip_activity.kml"
+    Arguments
+    addresses -- (packets sent, address) of every address in the city
+    """
+    addresses.sort(reverse=True)
+    listed = ", ".join(format_address(address)
+                       for _, address in addresses[:LISTED_ADDRESSES])
+    if len(addresses) > LISTED_ADDRESSES:
+        listed += f" and {len(addresses) - LISTED_ADDRESSES} more"
+    name = location.city if location.city != "N/A" else location.country
+    description = (f"Packets Sent : {sum(number for number, _ in addresses)}"
+                   f"\nCountry : {location.country}"
+                   f"\nCity : {location.city}"
+                   f"\nAddresses : {listed}")
+    return (f"<Placemark><name>{escape(name)}</name>"
+            f"<description>{escape(description)}</description>"
+            f"<Point><coordinates>{location.longitude},{location.latitude}"
+            "</coordinates></Point></Placemark>\n")
 
 
-def write_command_output(output: str,
-                         writefile: str = "pcapanalyser/outputs/results.txt"
-                         ) -> None:
-    """Write specified output to a given output file."""
-    try:
-        logger.info("Writing results to %s", writefile)
-        with open(writefile, "a", encoding="utf-8") as out_file:
-            out_file.write(f"{output}\n")
-    except TypeError:
-        logger.error("Malformed data attempted to be written to outfile")
+def generate_kml(packets_sent_to_address: dict[int, int],
+                 path: str = KML_PATH, db_path: str = DB_PATH,
+                 use_cache: bool = True, in_memory: bool = False) -> str:
+    """Generate KML file from packets.
+
+    Private and reserved addresses are skipped and the rest grouped into
+    one point per city. A point totals every address in its city, so all
+    the addresses are located and grouped first, only writing the points
+    is done a point at a time.
+
+    Arguments
+    packets_sent_to_address -- unique destination addresses, as integers,
+    and how many packets were sent to each
+    path -- where to save the points, zipped as KMZ for a .kmz path
+    use_cache -- use and update the GeoIP result cache
+    in_memory -- keep the GeoIP database in memory for later calls
+    """
+    logger.info("Generating KML file")
+    locations = locate(packets_sent_to_address, db_path, use_cache,
+                       in_memory)
+    cities: dict[GeoLocation, list[tuple[int, int]]] = {}
+    for address, location in locations.items():
+        cities.setdefault(location, []).append(
+            (packets_sent_to_address[address], address))
+    with open_kml(path) as kml_file:
+        kml_file.write(KML_HEADER)
+        for location, addresses in cities.items():
+            kml_file.write(city_placemark(location, addresses))
+        kml_file.write(KML_FOOTER)
+    return (f"KML file saved to {path}, {len(locations)} addresses "
+            f"in {len(cities)} places")
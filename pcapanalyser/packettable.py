@@ -0,0 +1,181 @@
+'''
+/***
+** Script:   packettable.py
+** Desc:     Columnar packet storage for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+# pylint: disable=R0902
+"""Columnar, array backed table of decoded packets."""
+from array import array
+from collections.abc import Iterable, Iterator
+
+import dpkt
+import numpy as np
+
+from pcapanalyser.reader import open_capture
+from pcapanalyser.types import PacketRecord
+
+
+class PacketTable:
+    """Decoded packets stored as one typed array per field.
+
+    Row i of every column describes the i-th frame of the capture, every
+    frame is kept even when several share a timestamp. time_order() gives
+    the rows sorted by timestamp for ordered and windowed lookups.
+    Addresses are interned, the srcs and dsts columns hold an index into
+    self.addresses (0 for non-IP frames). Protocols are stored as an
+    index into self.protocols. Payloads are not copied, TCP payloads are
+    located by their offset in the capture and read back from it by the
+    extractors that need them, see read_payloads.
+    """
+
+    def __init__(self, filename: str = "") -> None:
+        """Initialise empty columns.
+
+        Arguments
+        filename -- the capture the packets are parsed from
+        """
+        self.filename = filename
+        self.timestamps = array("d")
+        self.timestamps_ns = array("q")
+        self.lengths = array("I")
+        self.l2_types = array("H")
+        self.protocol_index = array("H")
+        self.srcs = array("I")
+        self.dsts = array("I")
+        self.sports = array("H")
+        self.dports = array("H")
+        self.payload_offsets = array("Q")
+        self.payload_lengths = array("I")
+        self.tcp_seqs = array("I")
+        self.tcp_flags = array("H")
+        self.tcp_acks = array("I")
+        # ProtocolIndex values, position is the value in protocol_index
+        self.protocols: list[int | str | None] = []
+        self._protocol_positions: dict[int | str | None, int] = {}
+        self.count: dict[str, int] = {}
+        # Integer IPv4/IPv6 addresses, position is the value in srcs/dsts.
+        # Position 0 stands in for the missing address of non-IP frames
+        self.addresses: list[int] = [0]
+        self._address_positions: dict[int | None, int] = {None: 0}
+        # Built on first use, rebuilt if packets were appended since
+        self._time_order = np.empty(0, dtype=np.intp)
+        self._sorted_timestamps = np.empty(0)
+
+    def __len__(self) -> int:
+        """Return the number of packets in the table."""
+        return len(self.timestamps)
+
+    def get_protocol_index(self, protocol: int | str | None) -> int:
+        """Get the column value for a protocol, adding it if unseen."""
+        if protocol not in self._protocol_positions:
+            self._protocol_positions[protocol] = len(self.protocols)
+            self.protocols.append(protocol)
+        return self._protocol_positions[protocol]
+
+    def get_address_index(self, address: int | None) -> int:
+        """Get the column value for an address, adding it if unseen."""
+        position = self._address_positions.get(address)
+        if position is None:
+            position = self._address_positions[address] = \
+                len(self.addresses)
+            self.addresses.append(address or 0)
+        return position
+
+    def append(self, record: PacketRecord, protocol_name: str,
+               offset: int = 0) -> None:
+        """Append a decoded packet to the table.
+
+        Arguments
+        record -- the decoded packet
+        protocol_name -- the name to count the packet under
+        offset -- where the frame starts in the capture
+        """
+        self.timestamps.append(record.timestamp)
+        self.timestamps_ns.append(record.timestamp_ns)
+        self.lengths.append(record.length)
+        self.l2_types.append(record.l2_type)
+        self.protocol_index.append(self.get_protocol_index(record.protocol))
+        self.srcs.append(self.get_address_index(record.src))
+        self.dsts.append(self.get_address_index(record.dst))
+        self.sports.append(record.sport or 0)
+        self.dports.append(record.dport or 0)
+        self.tcp_seqs.append(record.tcp_seq or 0)
+        self.tcp_flags.append(record.tcp_flags)
+        self.tcp_acks.append(record.tcp_ack)
+        self.payload_offsets.append(offset + record.payload_offset)
+        # Only TCP payloads are needed by the extractors
+        self.payload_lengths.append(
+            record.payload_length
+            if record.protocol == dpkt.ip.IP_PROTO_TCP else 0)
+        # Add protocol to counter if not already otherwise increment
+        if protocol_name not in self.count:
+            self.count[protocol_name] = 0
+        self.count[protocol_name] += 1
+
+    def column(self, name: str) -> np.ndarray:
+        """Get a zero-copy NumPy view of a column, e.g. "lengths"."""
+        values = getattr(self, name)
+        return np.frombuffer(values, dtype=values.typecode)
+
+    def time_order(self) -> np.ndarray:
+        """Get the row indices sorted by timestamp.
+
+        Sorted by the exact nanosecond timestamps, frames sharing one keep
+        their capture order. Captures are nearly always in order already,
+        which is checked before sorting.
+        """
+        if len(self._time_order) != len(self):
+            timestamps = self.column("timestamps")
+            exact = self.column("timestamps_ns")
+            if np.all(exact[1:] >= exact[:-1]):
+                self._time_order = np.arange(len(self))
+            else:
+                self._time_order = np.argsort(exact, kind="stable")
+            # Copy, a view would stop the timestamps array from growing
+            self._sorted_timestamps = timestamps[self._time_order]
+        return self._time_order
+
+    def sorted_timestamps(self) -> np.ndarray:
+        """Get every timestamp in ascending order."""
+        self.time_order()
+        return self._sorted_timestamps
+
+    def between(self, start: float | None = None,
+                end: float | None = None) -> np.ndarray:
+        """Get the rows captured in [start, end), in timestamp order.
+
+        Found by binary search, so a window costs O(log n) plus its size.
+        A bound of None leaves that side of the window open.
+        """
+        window = time_window(self.sorted_timestamps(), start, end)
+        return self._time_order[window]
+
+    def read_payloads(self, rows: Iterable[int]) -> Iterator[bytes]:
+        """Read the TCP payloads of rows back from the capture.
+
+        Rows in capture order read the capture front to back, a
+        compressed one is decompressed once per call.
+        """
+        with open_capture(self.filename) as capture:
+            for row in rows:
+                length = self.payload_lengths[row]
+                yield capture.read(self.payload_offsets[row], length) \
+                    if length else b""
+
+
+def time_window(sorted_timestamps: np.ndarray, start: float | None,
+                end: float | None) -> slice:
+    """Binary search the slice of sorted_timestamps in [start, end)."""
+    first = 0 if start is None else int(
+        np.searchsorted(sorted_timestamps, start, side="left"))
+    last = len(sorted_timestamps) if end is None else int(
+        np.searchsorted(sorted_timestamps, end, side="left"))
+    return slice(first, max(first, last))
@@ -13,230 +13,712 @@
 # suppress PEP8 import errors due to PATH settings
 # pylint: disable=E0401
 """Methods to handle the parsing of the pcap file."""
-import re
+import struct
+from collections.abc import Iterator
 from datetime import datetime
 
 import dpkt
+import numpy as np
 
 from pcapanalyser.utils import (get_src_dst_address, create_logger,
-                                key_from_val)
-from pcapanalyser.types import Conversations, Emails, Packets
+                                IPV4_MAPPED)
+from pcapanalyser.dissectors import (DISSECTORS, IPX_DST_SOCKET,
+                                     IPX_HEADER_LENGTH, SNAP_HEADER_LENGTH,
+                                     SNAP_LLC, Dissection, ip_protocol_name)
+from pcapanalyser.types import (Emails, FlowKey, HttpTransaction,
+                                PacketRecord, ProtocolStats, TcpSegment)
+from pcapanalyser.packettable import PacketTable
+from pcapanalyser.protocolindex import ProtocolIndex
+from pcapanalyser.reader import open_capture, to_seconds
+from pcapanalyser.timeindex import TimeIndex
+from pcapanalyser.timeseries import TrafficBuckets, TrafficPyramid
+from pcapanalyser.reassembly import reassemble
+from pcapanalyser.flows import Flow, FlowTable
+from pcapanalyser.smtp import SmtpAddresses
+from pcapanalyser.httptransactions import (HttpExtractor, IMAGE_EXTENSIONS,
+                                           image_uris)
+
+# Bump whenever decoding or query results change, the cache depends on it
+PARSER_VERSION = 12
+# Link type -> (offset of the EtherType, offset of the network header).
+# Raw IP link types have no EtherType, the IP version nibble decides.
+LINK_HEADERS: dict[int, tuple[int | None, int]] = {
+    dpkt.pcap.DLT_EN10MB: (12, 14),
+    dpkt.pcap.DLT_LINUX_SLL: (14, 16),
+    dpkt.pcap.DLT_LINUX_SLL2: (0, 20),
+    dpkt.pcap.DLT_C_HDLC: (2, 4),
+    dpkt.pcap.DLT_RAW: (None, 0),
+    # DLT_RAW on OpenBSD, and the LINKTYPE_RAW value stored in files
+    14: (None, 0),
+    101: (None, 0),
+    dpkt.pcap.DLT_IPV4: (None, 0),
+    dpkt.pcap.DLT_IPV6: (None, 0)
+}
+IP_VERSION_TYPES = {4: dpkt.ethernet.ETH_TYPE_IP,
+                    6: dpkt.ethernet.ETH_TYPE_IP6}
+ETHER_TYPE = struct.Struct("!H")
+# version/IHL, total length, flags/fragment offset, protocol, src, dst
+IPV4_HEADER = struct.Struct("!BxHxxHxBxxII")
+PORTS = struct.Struct("!HH")
+# sequence number, acknowledgement number, data offset and flags
+TCP_SEQ_ACK_FLAGS = struct.Struct("!IIH")
+TCP_FLAGS_MASK = 0x1ff
+IP_TYPES = (dpkt.ethernet.ETH_TYPE_IP, dpkt.ethernet.ETH_TYPE_IP6)
+VLAN_TYPES = (dpkt.ethernet.ETH_TYPE_8021Q, dpkt.ethernet.ETH_TYPE_8021AD)
+# EtherType values up to this are the length of an 802.3 frame
+MAX_8023_LENGTH = 1500
+TRANSPORT_HEADER_LENGTHS = {dpkt.ip.IP_PROTO_TCP: 20, dpkt.ip.IP_PROTO_UDP: 8}
+SMTP_PORTS = [25, 465, 2525, 587]
 
-protocol_ids = {}
 logger = create_logger()
 
 
-def parse_packets(filename: str) -> Packets:
-    """Parse packets from filename.
+def decode_packet(timestamp_ns: int, pkt: bytes | memoryview,
+                  link_type: int = dpkt.pcap.DLT_EN10MB) -> tuple[
+                      PacketRecord, str]:
+    """Decode a single frame into a PacketRecord.
+
+    Untagged IPv4 frames of the link types in LINK_HEADERS are decoded
+    straight from the buffer, as are untagged frames of the network
+    protocols in the dissector registry. Everything else goes through
+    dpkt.
 
     Arguments
-    file_buffer -- the file buffer to read and parse
+    timestamp_ns -- the capture timestamp of the frame in nanoseconds
+    pkt -- the raw frame, a memoryview is only copied for dpkt
+    link_type -- the DLT_* link type of the interface it was captured on
+
+    Returns
+    (record, protocol_name) -- the decoded record and the protocol name
+    used as the key in the packet counter.
     """
-    packets: Packets = {"raw": {}, "count": {}}
-    logger.info("Parsing file: %s", filename)
-    # Loop through each packet
-    with open(filename, "rb") as pcap_file_buffer:
-        for timestamp, pkt in dpkt.pcap.Reader(pcap_file_buffer):
-            # Store the raw packet with timestamp key
-            packets["raw"][timestamp] = pkt
-            # Get ethernet frame & IP header
+    record = decode_ipv4_frame(timestamp_ns, pkt, link_type)
+    if record is None:
+        record = decode_registered_frame(timestamp_ns, pkt, link_type)
+    if record is None:
+        return decode_with_dpkt(timestamp_ns, bytes(pkt), link_type)
+    protocol_name = ip_protocol_name(record.protocol) \
+        if isinstance(record.protocol, int) else str(record.protocol)
+    return (record, protocol_name)
+
+
+def ipv4_header_start(pkt: bytes | memoryview,
+                      link_type: int) -> int | None:
+    """Get where the IPv4 header of a frame starts, None if it is not IPv4.
+
+    Only frames without VLAN/MPLS tags or IP options are checked for, the
+    rest are left to dpkt.
+    """
+    type_offset, ip_start = LINK_HEADERS.get(link_type, (None, -1))
+    if ip_start < 0 or len(pkt) < ip_start + IPV4_HEADER.size:
+        return None
+    if type_offset is None:
+        return ip_start if pkt[0] >> 4 == 4 else None
+    return ip_start if ETHER_TYPE.unpack_from(pkt, type_offset)[0] == \
+        dpkt.ethernet.ETH_TYPE_IP else None
+
+
+def decode_ipv4_frame(timestamp_ns: int, pkt: bytes | memoryview,
+                      link_type: int = dpkt.pcap.DLT_EN10MB
+                      ) -> PacketRecord | None:
+    """Decode an untagged IPv4 frame without dpkt.
+
+    Mirrors what dpkt extracts from these frames, returns None for any
+    other frame (or a malformed header) so the caller can fall back.
+    """
+    ip_start = ipv4_header_start(pkt, link_type)
+    if ip_start is None:
+        return None
+    version_ihl, total_length, flags_offset, protocol, *addresses = \
+        IPV4_HEADER.unpack_from(pkt, ip_start)
+    data_start = ip_start + (version_ihl & 0xf) * 4
+    if data_start < ip_start + IPV4_HEADER.size:
+        return None
+    # Like dpkt, trust the IP total length unless it is zero (TSO)
+    data_length = max(0, (min(ip_start + total_length, len(pkt))
+                          if total_length else len(pkt)) - data_start)
+    ports: tuple[int | None, int | None] = (None, None)
+    # Offset and length of the TCP/UDP payload
+    payload = (0, 0)
+    tcp: tuple[int | None, int, int] = (None, 0, 0)
+    transport_length = TRANSPORT_HEADER_LENGTHS.get(protocol)
+    # Fragments and truncated transport headers are left undecoded
+    if transport_length and not flags_offset & 0x1fff and \
+            data_length >= transport_length:
+        if protocol == dpkt.ip.IP_PROTO_TCP:
+            tcp = TCP_SEQ_ACK_FLAGS.unpack_from(pkt, data_start + 4)
+            # Data offset is the top 4 bits, flags the bottom 9
+            transport_length = (tcp[2] >> 12) * 4
+            tcp = (tcp[0], tcp[2] & TCP_FLAGS_MASK, tcp[1])
+        if transport_length >= TRANSPORT_HEADER_LENGTHS[protocol]:
+            ports = PORTS.unpack_from(pkt, data_start)
+            payload = (data_start + transport_length,
+                       max(0, data_length - transport_length))
+    return PacketRecord(to_seconds(timestamp_ns), len(pkt),
+                        dpkt.ethernet.ETH_TYPE_IP, protocol,
+                        IPV4_MAPPED | addresses[0], IPV4_MAPPED | addresses[1],
+                        *ports, *payload, pkt, tcp_seq=tcp[0],
+                        tcp_flags=tcp[1], tcp_ack=tcp[2],
+                        timestamp_ns=timestamp_ns, link_type=link_type)
+
+
+def registered_network_layer(pkt: bytes | memoryview, link_type: int,
+                             ) -> tuple[int, Dissection] | None:
+    """Find the network layer of a frame in the dissector registry.
+
+    Only frames without VLAN tags are checked for, only the headers
+    identifying the protocol are read.
+
+    Returns
+    (ether_type, dissection) -- the EtherType (the length of 802.3
+    frames) and the network layer, None if it is not registered
+    """
+    type_offset, start = LINK_HEADERS.get(link_type, (None, -1))
+    if type_offset is None or len(pkt) < start:
+        return None
+    ether_type = ETHER_TYPE.unpack_from(pkt, type_offset)[0]
+    dissector = DISSECTORS["ethertype"].get(ether_type)
+    if dissector is not None:
+        return (ether_type, dissector.dissect(pkt, start))
+    if link_type != dpkt.pcap.DLT_EN10MB or \
+            ether_type > MAX_8023_LENGTH or \
+            len(pkt) < start + SNAP_HEADER_LENGTH or \
+            bytes(pkt[start:start + 3]) != SNAP_LLC:
+        return None
+    snap_type = (int.from_bytes(pkt[start + 3:start + 6], "big"),
+                 ETHER_TYPE.unpack_from(pkt, start + 6)[0])
+    dissector = DISSECTORS["snap"].get(snap_type)
+    if dissector is None:
+        return None
+    return (ether_type, dissector.dissect(pkt, start + SNAP_HEADER_LENGTH))
+
+
+def decode_registered_frame(timestamp_ns: int, pkt: bytes | memoryview,
+                            link_type: int = dpkt.pcap.DLT_EN10MB
+                            ) -> PacketRecord | None:
+    """Decode a frame of a registered non-IP network protocol.
+
+    The protocol is named from its header alone, none of its fields are
+    parsed. Returns None for any other frame.
+    """
+    network = registered_network_layer(pkt, link_type)
+    if network is None:
+        return None
+    ether_type, dissection = network
+    return PacketRecord(to_seconds(timestamp_ns), len(pkt), ether_type,
+                        dissection.dissector.name, None, None, None, None,
+                        0, 0, pkt, timestamp_ns=timestamp_ns,
+                        link_type=link_type)
+
+
+def decode_link_layer(pkt: bytes, link_type: int) -> tuple[
+        int, dpkt.Packet | bytes, int]:
+    """Strip the link layer header of a frame with dpkt.
+
+    Returns
+    (ether_type, network, network_offset) -- the EtherType of the network
+    layer (0 if unknown), the decoded network layer and where it starts
+    within the frame
+    """
+    type_offset, network_offset = LINK_HEADERS.get(link_type, (None, -1))
+    if link_type == dpkt.pcap.DLT_EN10MB:
+        try:
             ethernet = dpkt.ethernet.Ethernet(pkt)
-            # If it's IP
-            if ethernet.type == dpkt.ethernet.ETH_TYPE_IP:
-                # Get header, extract protocol name. Store in protocol_ids
-                ip_header = ethernet.data
-                protocol_name = dpkt.ip.get_ip_proto_name(ip_header.p)
-                protocol_ids[protocol_name] = ip_header.p
-                # Add protocol to counter if not already otherwise increment
-                if protocol_name not in packets["count"]:
-                    packets["count"][protocol_name] = 0
-                packets["count"][protocol_name] += 1
-            # Anything other than IP (e.g ARP)
-            else:
-                try:
-                    # Try and get the network layer name
-                    network_layer_name = ethernet.get_type(
-                        ethernet.type).__name__
-                except KeyError:
-                    # If this fails, just call it unknown
-                    logger.error("Unknown or unsupported packet detected")
-                    network_layer_name = "Unknown Protocol"
-                # Add protocol to counter if not already otherwise increment
-                protocol_ids[network_layer_name] = network_layer_name
-                if network_layer_name not in packets["count"]:
-                    packets["count"][network_layer_name] = 0
-                packets["count"][network_layer_name] += 1
-        logger.info("Finished parsing. Found %s packets",
-                    (sum(packets['count'].values())))
-    return packets
+        except dpkt.UnpackError:
+            return (0, pkt, 0)
+        # Ethernet header, then any VLAN/MPLS tags
+        return (ethernet.type, ethernet.data, network_offset
+                + 4 * len(getattr(ethernet, "vlan_tags", []))
+                + 4 * len(getattr(ethernet, "mpls_labels", [])))
+    if network_offset < 0 or len(pkt) <= network_offset:
+        return (0, pkt, 0)
+    if type_offset is None:
+        ether_type = IP_VERSION_TYPES.get(pkt[0] >> 4, 0)
+    else:
+        ether_type = ETHER_TYPE.unpack_from(pkt, type_offset)[0]
+    try:
+        return (ether_type, dpkt.ethernet.Ethernet.get_type(ether_type)(
+            pkt[network_offset:]), network_offset)
+    except (KeyError, dpkt.UnpackError):
+        # Left undecoded, as dpkt does with a malformed Ethernet payload
+        return (ether_type, pkt[network_offset:], network_offset)
+
+
+def decode_with_dpkt(timestamp_ns: int, pkt: bytes,
+                     link_type: int = dpkt.pcap.DLT_EN10MB) -> tuple[
+                         PacketRecord, str]:
+    """Decode any frame dpkt understands into a PacketRecord."""
+    ether_type, network, network_offset = decode_link_layer(pkt, link_type)
+    protocol: int | str | None = None
+    src = dst = None
+    ports: tuple[int | None, int | None] = (None, None)
+    # Offset and length of the TCP/UDP payload
+    payload = (0, 0)
+    tcp: tuple[int | None, int, int] = (None, 0, 0)
+    # If it's IPv4 or IPv6
+    if ether_type in IP_TYPES and \
+            isinstance(network, (dpkt.ip.IP, dpkt.ip6.IP6)):
+        # Get header, extract protocol name
+        protocol = network.p
+        protocol_name = ip_protocol_name(network.p)
+        src, dst = get_src_dst_address(network)
+        transport = network.data
+        if isinstance(transport, (dpkt.tcp.TCP, dpkt.udp.UDP)):
+            ports = (transport.sport, transport.dport)
+            # Link layer header, then the IP (with any IPv6 extension
+            # headers) and L4 headers
+            payload = (network_offset + len(network) - len(transport.data),
+                       len(transport.data))
+            if isinstance(transport, dpkt.tcp.TCP):
+                tcp = (transport.seq, transport.flags, transport.ack)
+    # Anything other than IP (e.g ARP)
+    else:
+        try:
+            # Try and get the network layer name
+            protocol_name = dpkt.ethernet.Ethernet.get_type(
+                ether_type).__name__
+            protocol = protocol_name
+        except KeyError:
+            # If this fails, just call it unknown
+            logger.error("Unknown or unsupported packet detected")
+            protocol_name = "Unknown Protocol"
+    return (PacketRecord(to_seconds(timestamp_ns), len(pkt), ether_type,
+                         protocol, src, dst, *ports, *payload, pkt,
+                         tcp_seq=tcp[0], tcp_flags=tcp[1], tcp_ack=tcp[2],
+                         timestamp_ns=timestamp_ns, link_type=link_type),
+            protocol_name)
+
+
+def dissect(record: PacketRecord) -> list[Dissection]:
+    """Find the registered protocols of a decoded frame, outermost first.
+
+    Only the headers leading to each protocol are read, its fields are
+    parsed as they are asked for. Frames with VLAN tags or IPv6
+    extension headers are only dissected above the IP layer.
+    """
+    dissections = []
+    frame = record.frame
+    network = registered_network_layer(frame, record.link_type)
+    if network is not None:
+        dissections.append(network[1])
+        start = network[1].start
+        if network[0] == dpkt.ethernet.ETH_TYPE_IPX and \
+                len(frame) > start + IPX_HEADER_LENGTH:
+            dissector = DISSECTORS["ipx"].get(
+                ETHER_TYPE.unpack_from(frame, start + IPX_DST_SOCKET)[0])
+            if dissector is not None:
+                dissections.append(dissector.dissect(
+                    frame, start + IPX_HEADER_LENGTH))
+        return dissections
+    if not isinstance(record.protocol, int):
+        return dissections
+    payload_start = ip_payload_start(frame, record)
+    dissector = DISSECTORS["ip"].get(record.protocol)
+    if dissector is not None and payload_start is not None:
+        dissections.append(dissector.dissect(frame, payload_start))
+    if record.protocol == dpkt.ip.IP_PROTO_UDP and record.payload_length:
+        dissector = DISSECTORS["udp"].get(record.dport) or \
+            DISSECTORS["udp"].get(record.sport)
+        if dissector is not None:
+            dissections.append(dissector.dissect(frame,
+                                                 record.payload_offset))
+    return dissections
+
+
+def ip_payload_start(frame: bytes | memoryview,
+                     record: PacketRecord) -> int | None:
+    """Get where the payload of an untagged IP frame starts, None if unsure."""
+    type_offset, start = LINK_HEADERS.get(record.link_type, (None, -1))
+    if start < 0 or len(frame) <= start or record.l2_type not in IP_TYPES or \
+            (type_offset is not None and
+             ETHER_TYPE.unpack_from(frame, type_offset)[0] in VLAN_TYPES):
+        return None
+    if record.l2_type == dpkt.ethernet.ETH_TYPE_IP:
+        return start + (frame[start] & 0xf) * 4
+    # IPv6, unless extension headers come before the protocol
+    if len(frame) > start + 6 and frame[start + 6] == record.protocol:
+        return start + 40
+    return None
+
 
+def iter_packets(filename: str, start: int = 0,
+                 end: int | None = None, start_time: float | None = None,
+                 end_time: float | None = None) -> Iterator[
+                     tuple[PacketRecord, str]]:
+    """Decode the packets of filename one at a time.
 
-def get_first_last_timestamps(packets: Packets,
-                              protocol: int) -> tuple[datetime, datetime] | \
-                                                tuple[str, str]:
-    """Get, format and return first and last timestamps.
+    Nothing is kept once a packet has been yielded, so this can feed the
+    streaming aggregators without holding the capture in memory.
 
     Arguments
-    protocol -- the desired protocol
+    filename -- the pcap or pcapng file to read
+    start, end -- only decode the records in this byte range
+    start_time, end_time -- only decode the records captured in
+    [start_time, end_time), None leaves that side open
     """
-    logger.info("""Finding first and last timestamps for protocol: %s""",
-                (key_from_val(protocol_ids, protocol)))
-    try:
-        timestamps = []
-        # Loop through packets, extract ethernet and IP objects
-        for timestamp, pkt in packets["raw"].items():
-            ethernet = dpkt.ethernet.Ethernet(pkt)
-            # IP Objects use different syntax
-            if ethernet.type == dpkt.ethernet.ETH_TYPE_IP:
-                ip_object = ethernet.data
-                if ip_object.p == protocol:
-                    timestamps.append(timestamp)
-            # Going off frame type
-            try:
-                if ethernet.get_type(ethernet.type).__name__ == protocol:
-                    timestamps.append(timestamp)
-            except KeyError:
-                continue
-        # Select and format the first and last timestamps
-        first = datetime.fromtimestamp(min(timestamps)) \
-            .strftime("%H:%M:%S.%f")[:-3]
-        last = datetime.fromtimestamp(max(timestamps)) \
-            .strftime("%H:%M:%S.%f")[:-3]
-    except ValueError:
-        # This will be hit when there's an unkown protocol (EG ARP)
-        return ("Unable to Calculate", "Unable to Calculate")
-    return (first, last)
+    for _, record, protocol_name in iter_located_packets(
+            filename, start, end, start_time, end_time):
+        yield (record, protocol_name)
 
 
-def get_avg_packet_length(packets: Packets, protocol: int) -> float | str:
-    """Get the average packet length for a given protocol.
+def iter_located_packets(filename: str, start: int = 0,
+                         end: int | None = None,
+                         start_time: float | None = None,
+                         end_time: float | None = None) -> Iterator[
+                             tuple[int, PacketRecord, str]]:
+    """Decode the packets of filename, with where each frame starts.
+
+    As iter_packets, yielding (offset, record, protocol_name) where
+    offset is the frame's offset in the capture.
+    """
+    with open_capture(filename) as reader:
+        for timestamp_ns, link_type, offset, pkt in reader.located_frames(
+                start, end):
+            timestamp = to_seconds(timestamp_ns)
+            # Checked before decoding, skipped records cost a compare
+            if (start_time is None or timestamp >= start_time) and \
+                    (end_time is None or timestamp < end_time):
+                yield (offset, *decode_packet(timestamp_ns, pkt, link_type))
+
+
+def window_ranges(filename: str, start_time: float | None,
+                  end_time: float | None) -> list[tuple[int, int | None]]:
+    """Get the byte ranges to read for a time window.
+
+    The whole capture when there are no bounds, otherwise the ranges of
+    the time index blocks that overlap [start_time, end_time).
+    """
+    if start_time is None and end_time is None:
+        return [(0, None)]
+    ranges = TimeIndex(filename).byte_ranges(start_time, end_time)
+    logger.info("Reading %s byte ranges of %s for the time window",
+                len(ranges), filename)
+    return list(ranges)
+
+
+def parse_packets(filename: str, start_time: float | None = None,
+                  end_time: float | None = None,
+                  protocols: ProtocolIndex | None = None) -> PacketTable:
+    """Parse packets from filename.
+
+    Every frame is decoded exactly once into a columnar PacketTable that
+    is shared by all of the analysis commands.
 
     Arguments
-    protocol -- the desired protocol
-    """
-    logger.info("Finding avg packet length for protocol: %s",
-                (key_from_val(protocol_ids, protocol)))
-    total_length = 0
-    number_of_packets = 0
-    # Loop through packets, extract ethernet and IP objects
-    for _, pkt in packets["raw"].items():
-        ethernet = dpkt.ethernet.Ethernet(pkt)
-        # IP has different syntax to non-IP objects (eg ARP)
-        if ethernet.type == dpkt.ethernet.ETH_TYPE_IP:
-            ip_header = ethernet.data
-            if ip_header.p == protocol:
-                total_length += len(pkt)
-                number_of_packets += 1
-        # Going off frame type now (eg ARP)
-        try:
-            if ethernet.get_type(ethernet.type).__name__ == protocol:
-                total_length += len(pkt)
-                number_of_packets += 1
-        except KeyError:
-            continue
+    filename -- the pcap file to read and parse
+    start_time, end_time -- only parse the packets captured in
+    [start_time, end_time), found through the capture's time index
+    protocols -- index of the analysis, the protocols found are added
+    """
+    packets = PacketTable(filename)
+    protocols = protocols if protocols is not None else ProtocolIndex()
+    logger.info("Parsing file: %s", filename)
+    # Loop through each packet
+    for start, end in window_ranges(filename, start_time, end_time):
+        for offset, record, protocol_name in iter_located_packets(
+                filename, start, end, start_time, end_time):
+            packets.append(record, protocol_name, offset)
+            protocols.add(protocol_name, record.protocol)
+    logger.info("Finished parsing. Found %s packets",
+                (sum(packets.count.values())))
+    return packets
+
+
+def format_timestamp(timestamp: float) -> str:
+    """Format a capture timestamp for output."""
+    return datetime.fromtimestamp(timestamp).strftime("%H:%M:%S.%f")[:-3]
+
+
+def calculate_average(total_length: int,
+                      number_of_packets: int) -> float | str:
+    """Calculate an average packet length for output."""
     try:
-        average_packet_length = round(total_length / number_of_packets, 2)
+        return round(total_length / number_of_packets, 2)
     except ZeroDivisionError:
         # This will be hit when there's an unkown protocol
         return "Unable to calculate"
-    return average_packet_length
 
 
-def get_filenames_from_uris(packets: Packets) -> list[str]:
-    """Get filenames from URI / requests."""
-    uris = get_image_uris(packets)
-    filenames = []
-    for uri in uris:
-        # Strip off path and irrelevent HTTP parameters (? mark).
-        filenames.append(uri.split("/")[-1].split("?")[0])
-    return filenames
+def uri_to_filename(uri: str) -> str:
+    """Strip off path and irrelevent HTTP parameters (? mark)."""
+    return uri.split("/")[-1].split("?")[0]
+
+
+def get_protocol_count(packets: PacketTable) -> dict[str, int]:
+    """Get the number of packets seen for each protocol name."""
+    return packets.count
+
+
+def get_traffic(packets: PacketTable, start: float | None = None,
+                end: float | None = None) -> TrafficPyramid:
+    """Bin the packets and bytes in [start, end) over time, per protocol.
+
+    Rows of the pyramid are the protocol values of PacketTable. The
+    packets are binned into the same buckets as streamed ones, which
+    are the finest level of the pyramid.
+    """
+    rows = packets.between(start, end)
+    buckets = TrafficBuckets(packets.protocols)
+    buckets.add_many(packets.column("timestamps")[rows],
+                     packets.column("lengths")[rows],
+                     packets.column("protocol_index")[rows])
+    return TrafficPyramid(buckets)
+
+
+def group_by_protocol(packets: PacketTable) -> tuple[np.ndarray,
+                                                     np.ndarray]:
+    """Sort the packets by protocol, then by length.
+
+    Returns
+    (order, starts) -- the row order and the position in it at which
+    each protocol's group starts
+    """
+    order = np.lexsort((packets.column("lengths"),
+                        packets.column("protocol_index")))
+    sorted_protocols = packets.column("protocol_index")[order]
+    starts = np.flatnonzero(np.concatenate(
+        ([True], sorted_protocols[1:] != sorted_protocols[:-1])))
+    return (order, starts)
+
+
+def get_protocol_stats(
+        packets: PacketTable) -> dict[int | str, ProtocolStats]:
+    """Get packet, timestamp and length statistics for every protocol.
+
+    All protocols are computed together with a vectorised group-by over
+    the protocol column instead of rescanning the packets per protocol.
+
+    Returns
+    protocol_stats -- dictionary keyed by the protocol value, see
+    ProtocolIndex
+    """
+    logger.info("Calculating statistics for protocols: %s",
+                list(packets.count))
+    protocol_stats: dict[int | str, ProtocolStats] = {}
+    if not packets:
+        return protocol_stats
+    order, starts = group_by_protocol(packets)
+    ends = np.append(starts[1:], len(order))
+    # Lengths are sorted within each group, percentiles need no extra sort
+    sorted_lengths = packets.column("lengths")[order]
+    sorted_timestamps = packets.column("timestamps")[order]
+    firsts = np.minimum.reduceat(sorted_timestamps, starts)
+    lasts = np.maximum.reduceat(sorted_timestamps, starts)
+    totals = np.add.reduceat(sorted_lengths.astype(np.int64), starts)
+    for group, (start, end) in enumerate(zip(starts, ends)):
+        protocol = packets.protocols[packets.protocol_index[order[start]]]
+        if protocol is None:
+            # This will be hit when there's an unkown protocol
+            continue
+        percentiles = np.percentile(sorted_lengths[start:end], [50, 95])
+        protocol_stats[protocol] = {
+            "packets": int(end - start),
+            "first": float(firsts[group]),
+            "last": float(lasts[group]),
+            "total_length": int(totals[group]),
+            "min_length": int(sorted_lengths[start]),
+            "max_length": int(sorted_lengths[end - 1]),
+            "median_length": float(percentiles[0]),
+            "p95_length": float(percentiles[1])
+        }
+    return protocol_stats
+
+
+def format_first_last(stats: ProtocolStats | None) -> tuple[str, str]:
+    """Format the first and last timestamps of a protocol for output."""
+    if stats is None:
+        # This will be hit when there's an unkown protocol (EG ARP)
+        return ("Unable to Calculate", "Unable to Calculate")
+    return (format_timestamp(stats["first"]),
+            format_timestamp(stats["last"]))
+
+
+def format_avg_length(stats: ProtocolStats | None) -> float | str:
+    """Format the average packet length of a protocol for output."""
+    if stats is None:
+        return calculate_average(0, 0)
+    return calculate_average(stats["total_length"], stats["packets"])
+
+
+def format_lengths(stats: ProtocolStats | None) -> list[float | str]:
+    """Format the avg, min, max, median and 95th percentile lengths."""
+    if stats is None:
+        return [calculate_average(0, 0)] * 5
+    return [format_avg_length(stats), stats["min_length"],
+            stats["max_length"], round(stats["median_length"], 2),
+            round(stats["p95_length"], 2)]
 
 
-def get_image_uris(packets: Packets,
+def iter_tcp_segments(packets: PacketTable,
+                      ports: list | None = None) -> Iterator[TcpSegment]:
+    """Yield the TCP segments of the capture, in capture order.
+
+    Their payloads are read back from the capture as they are yielded.
+
+    Arguments
+    ports -- only yield segments to or from one of these ports
+    """
+    rows = np.flatnonzero(packets.column("protocol_index") ==
+                          packets.get_protocol_index(dpkt.ip.IP_PROTO_TCP))
+    if ports is not None:
+        rows = rows[np.isin(packets.column("sports")[rows], ports) |
+                    np.isin(packets.column("dports")[rows], ports)]
+    indices = rows.tolist()
+    for index, payload in zip(indices, packets.read_payloads(indices)):
+        yield TcpSegment(packets.timestamps[index],
+                         (packets.addresses[packets.srcs[index]],
+                          packets.sports[index],
+                          packets.addresses[packets.dsts[index]],
+                          packets.dports[index]),
+                         packets.tcp_seqs[index], packets.tcp_flags[index],
+                         payload, packets.tcp_acks[index])
+
+
+def record_to_segment(record: PacketRecord) -> TcpSegment:
+    """Get the TcpSegment of a decoded TCP packet."""
+    return TcpSegment(record.timestamp,
+                      (record.src or 0, record.sport or 0,
+                       record.dst or 0, record.dport or 0),
+                      record.tcp_seq or 0, record.tcp_flags, record.payload,
+                      record.tcp_ack)
+
+
+def get_http_transactions(packets: PacketTable) -> list[HttpTransaction]:
+    """Extract every HTTP request and its response, in request order.
+
+    Only connections that look like HTTP are reassembled, their request
+    and response heads are parsed and paired per connection.
+    """
+    logger.info("Extracting HTTP transactions")
+    extractor = HttpExtractor()
+    for segment in iter_tcp_segments(packets):
+        extractor.add(segment)
+    return extractor.finish()
+
+
+def get_image_uris(packets: PacketTable,
                    file_extensions: list = None) -> list[str]:
     """Find all of the URIs / filenames of image files from the pcap.
 
+    An image is a response with an image Content-Type, or a request for
+    a path with one of file_extensions when there is no Content-Type.
+
     Arguments
     file_extensions -- a list of file extensions to look for.
     """
-    if not file_extensions:
-        file_extensions = ["jpg", "jpeg", "gif", "png", "ico"]
     logger.info("Finding image URIS with extensions %s",
-                (list(file_extensions)))
-    uris = []
-    for _, pkt in packets["raw"].items():
-        ethernet = dpkt.ethernet.Ethernet(pkt)
-        if ethernet.type == dpkt.ethernet.ETH_TYPE_IP:
-            ip_object = ethernet.data
-            if ip_object.p == dpkt.ip.IP_PROTO_TCP:
-                try:
-                    http = dpkt.http.Request(ip_object.data.data)
-                    uri_lower = http.uri.lower()  # Performance
-                    # If URI contains extension
-                    if any(extension in uri_lower for extension
-                            in file_extensions):
-                        uris.append(http.uri[0:45])
-                except (dpkt.dpkt.NeedData, dpkt.dpkt.UnpackError):
-                    # Not valid HTTP request, leave it, move onto the next.
-                    pass
-    return uris
-
-
-def get_smtp_emails(packets: Packets, smtp_ports: list = None) -> Emails:
+                (list(file_extensions or IMAGE_EXTENSIONS)))
+    return image_uris(get_http_transactions(packets), file_extensions)
+
+
+def get_smtp_emails(packets: PacketTable, smtp_ports: list = None) -> Emails:
     """Extract emails from SMTP packets.
 
+    Each direction of an SMTP connection is reassembled and scanned
+    once, so commands split across segments are found. Senders come from
+    MAIL FROM and From headers, recipients from RCPT TO, To and Cc.
+
     Arguments
     smtp_ports -- the ports to filter by
     """
     if not smtp_ports:
-        smtp_ports = [25, 465, 2525, 587]
+        smtp_ports = SMTP_PORTS
     logger.info("Finding emails via SMTP on ports: %s",
                 (list(smtp_ports)))
-    emails: Emails = {"From": [], "To": []}
-    to_pattern = r"TO: <[\w\._-]+@[\w\._-]+.[\w\._-]+>"
-    from_pattern = r"FROM: <[\w\._-]+@[\w\._-]+.[\w\._-]+>"
-    for _, pkt in packets["raw"].items():
-        ethernet = dpkt.ethernet.Ethernet(pkt)
-        if ethernet.type == dpkt.ethernet.ETH_TYPE_IP:
-            # SMTP is TCP
-            ip_object = ethernet.data
-            if ip_object.p == dpkt.ip.IP_PROTO_TCP:
-                src_port, dst_port = ip_object.data.sport, ip_object.data.dport
-                if src_port in smtp_ports or dst_port in smtp_ports:
-                    data = str(ip_object.data.data)
-                    emails["From"] += [
-                        x[:-1].split("<")[1] for x in re.findall(
-                            from_pattern, str(data)
-                        )]
-                    emails["To"] += [
-                        x[:-1].split("<")[1] for x in re.findall(
-                            to_pattern, str(data)
-                        )]
-    # Convert to set and back to list, as to remove any non-unique emails
-    # TypedDict in utils.py, this wont change
-    emails["From"] = list(set(emails["From"]))
-    emails["To"] = list(set(emails["To"]))
-    return emails
-
-
-def get_conversations(packets: Packets) -> Conversations:
-    """Find and store unique conversations.
+    addresses = SmtpAddresses()
+    for stream in reassemble(iter_tcp_segments(packets, smtp_ports)):
+        addresses.scan(stream)
+    return addresses.emails()
 
-    Arguments
-    packets -- the packets to extract conversations from
+
+def group_by_flow(packets: PacketTable) -> tuple[np.ndarray, list[FlowKey],
+                                                 np.ndarray, np.ndarray]:
+    """Sort the IP packets by their bidirectional 5-tuple.
+
+    Addresses are too wide for NumPy, so they are ranked first and the
+    ranks sorted in their place, keeping the order of the addresses.
+
+    Returns
+    (rows, keys, starts, reverse) -- the sorted IP rows, the FlowKey of
+    each flow, the position at which each flow's group starts and
+    whether each packet was sent from b to a
+    """
+    rows = np.flatnonzero(packets.column("srcs"))
+    if not rows.size:
+        return (rows, [], rows, rows.astype(bool))
+    protocol_numbers = np.array([protocol if isinstance(protocol, int)
+                                 else 0 for protocol in packets.protocols],
+                                dtype=np.int64)
+    addresses = sorted(packets.addresses[1:])
+    rank = {address: position for position, address in enumerate(addresses)}
+    ranks = np.array([0] + [rank[address]
+                            for address in packets.addresses[1:]],
+                     dtype=np.int64)
+    src_ends = ranks[packets.column("srcs")[rows]] << 16 \
+        | packets.column("sports")[rows]
+    dst_ends = ranks[packets.column("dsts")[rows]] << 16 \
+        | packets.column("dports")[rows]
+    reverse = src_ends > dst_ends
+    keys = np.stack((
+        protocol_numbers[packets.column("protocol_index")[rows]],
+        np.where(reverse, dst_ends, src_ends),
+        np.where(reverse, src_ends, dst_ends)))
+    order = np.lexsort(keys[::-1])
+    keys = keys[:, order]
+    starts = np.flatnonzero(np.concatenate(
+        ([True], np.any(keys[:, 1:] != keys[:, :-1], axis=0))))
+    flow_keys = [FlowKey(protocol, addresses[a_end >> 16], a_end & 0xffff,
+                         addresses[b_end >> 16], b_end & 0xffff)
+                 for protocol, a_end, b_end in keys[:, starts].T.tolist()]
+    return (rows[order], flow_keys, starts, reverse[order])
+
+
+def reduce_direction(packets: PacketTable, rows: np.ndarray,
+                     starts: np.ndarray, sent: np.ndarray) -> tuple[
+                         np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Reduce the packets sent in one direction of each flow.
 
     Returns
-    conversations -- dictionary with keys and values as (src, dst)
-    tuple and number of packets sent respectively.
-    """
-    logger.info("Getting conversations")
-    conversations: Conversations = {}
-    for _, pkt in packets["raw"].items():
-        ethernet = dpkt.ethernet.Ethernet(pkt)
-        if ethernet.type == dpkt.ethernet.ETH_TYPE_IP:
-            ip_object = ethernet.data
-            src_dst = get_src_dst_address(ip_object)
-            conversations.setdefault(src_dst, []).append(ip_object)
-        else:
-            conversations.setdefault(("Unable to", "Calculate"), [])
-    return conversations
+    (packets, bytes, first, last) -- one value per flow
+    """
+    timestamps = packets.column("timestamps")[rows]
+    lengths = packets.column("lengths")[rows].astype(np.int64)
+    return (np.add.reduceat(sent.astype(np.int64), starts),
+            np.add.reduceat(np.where(sent, lengths, 0), starts),
+            np.minimum.reduceat(np.where(sent, timestamps, np.inf), starts),
+            np.maximum.reduceat(np.where(sent, timestamps, -np.inf), starts))
+
+
+def get_flows(packets: PacketTable) -> FlowTable:
+    """Count every IP packet against its bidirectional 5-tuple flow.
+
+    Like get_protocol_stats, the flows are found with one sort and the
+    counters of both directions are reduced per flow with NumPy.
+    """
+    logger.info("Getting flows")
+    flows = FlowTable()
+    rows, keys, starts, reverse = group_by_flow(packets)
+    flows.non_ip_packets = len(packets) - len(rows)
+    if not rows.size:
+        return flows
+    tcp_flags = np.bitwise_or.reduceat(packets.column("tcp_flags")[rows],
+                                       starts)
+    forward, backward = (reduce_direction(packets, rows, starts, sent)
+                         for sent in (~reverse, reverse))
+    for group, key in enumerate(keys):
+        flow = Flow()
+        flow.packets = [int(forward[0][group]), int(backward[0][group])]
+        flow.bytes = [int(forward[1][group]), int(backward[1][group])]
+        flow.first = [float(forward[2][group]), float(backward[2][group])]
+        flow.last = [float(forward[3][group]), float(backward[3][group])]
+        flow.tcp_flags = int(tcp_flags[group])
+        flows.flows[key] = flow
+    return flows
+
+
+def get_destination_counts(packets: PacketTable) -> dict[int, int]:
+    """Find how many IP packets were sent to each destination address."""
+    dsts = packets.column("dsts")
+    positions, counts = np.unique(dsts[dsts != 0], return_counts=True)
+    return {packets.addresses[position]: int(count)
+            for position, count in zip(positions, counts)}
@@ -0,0 +1,71 @@
+'''
+/***
+** Script:   protocolindex.py
+** Desc:     Protocol index for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Each analysis keeps its own index of the protocols it has
+*               seen, so nothing is shared between captures, and worker
+*               processes return theirs to be merged.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+"""Two way mapping between protocol names and protocol values."""
+from collections.abc import ItemsView, Iterator
+
+
+class ProtocolIndex:
+    """The protocols of one capture, by name and by protocol value.
+
+    A protocol value is what PacketRecord.protocol holds, the IP protocol
+    number or the name of a non-IP network protocol. Packets of unknown
+    protocols have no value and are indexed under their name. Both
+    directions are a dict lookup, and protocols are kept in the order
+    they were first seen.
+    """
+
+    def __init__(self) -> None:
+        """Initialise empty mappings."""
+        self._values: dict[str, int | str] = {}
+        self._names: dict[int | str, str] = {}
+
+    def add(self, name: str, protocol: int | str | None) -> None:
+        """Index a protocol, if it is not already."""
+        if name not in self._values:
+            value = protocol if protocol is not None else name
+            self._values[name] = value
+            self._names[value] = name
+
+    def update(self, other: "ProtocolIndex") -> None:
+        """Add the protocols of another index, e.g. a worker's."""
+        for name, value in other.items():
+            self.add(name, value)
+
+    def value(self, name: str) -> int | str:
+        """Get the protocol value of a name."""
+        return self._values[name]
+
+    def name(self, value: int | str) -> str:
+        """Get the name of a protocol value."""
+        return self._names[value]
+
+    def items(self) -> ItemsView[str, int | str]:
+        """Get (name, value) pairs in the order they were first seen."""
+        return self._values.items()
+
+    def __contains__(self, name: object) -> bool:
+        """Check if a protocol name is indexed."""
+        return name in self._values
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the protocol names."""
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        """Return the number of protocols."""
+        return len(self._values)
@@ -0,0 +1,493 @@
+'''
+/***
+** Script:   reader.py
+** Desc:     Memory mapped PCAP reader for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               pcap and pcapng captures are read through one interface,
+*               every record comes with the link type of the interface it
+*               was captured on and an exact nanosecond timestamp.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+"""Zero-copy readers for pcap and pcapng files."""
+import bisect
+import mmap
+import struct
+import sys
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from types import TracebackType
+from typing import NamedTuple
+
+from pcapanalyser.compression import (ChunkStream, DecompressedStream,
+                                      detect_compression, first_bytes)
+
+NANOSECONDS = 1_000_000_000
+GLOBAL_HEADER_LENGTH = 24
+# Magic number read big endian -> (byte order, record header length,
+# nanoseconds per timestamp fraction). Covers microsecond, nanosecond
+# and the "modified" (Kuznetzov) pcap format, in both byte orders.
+PCAP_MAGICS = {
+    0xa1b2c3d4: (">", 16, 1000),
+    0xd4c3b2a1: ("<", 16, 1000),
+    0xa1b23c4d: (">", 16, 1),
+    0x4d3cb2a1: ("<", 16, 1),
+    0xa1b2cd34: (">", 24, 1000),
+    0x34cdb2a1: ("<", 24, 1000)
+}
+# pcapng block types
+SECTION_HEADER_BLOCK = 0x0a0d0d0a
+INTERFACE_DESCRIPTION_BLOCK = 1
+PACKET_BLOCK = 2
+SIMPLE_PACKET_BLOCK = 3
+ENHANCED_PACKET_BLOCK = 6
+BYTE_ORDER_MAGIC = 0x1a2b3c4d
+# Interface description options
+OPTION_END = 0
+OPTION_TSRESOL = 9
+OPTION_TSOFFSET = 14
+# Microseconds, unless the interface says otherwise
+DEFAULT_UNITS_PER_SECOND = 1_000_000
+BLOCK_HEADER = {order: struct.Struct(f"{order}II") for order in "<>"}
+# Interface ID, timestamp high and low words, captured length
+ENHANCED_PACKET_HEADER = {order: struct.Struct(f"{order}IIII")
+                          for order in "<>"}
+# Interface ID, drops, timestamp high and low words, captured length
+PACKET_HEADER = {order: struct.Struct(f"{order}HxxIII") for order in "<>"}
+
+
+def to_seconds(timestamp_ns: int) -> float:
+    """Convert a nanosecond timestamp to float seconds.
+
+    Whole seconds and the fraction are converted separately, so
+    microsecond captures get the same floats as seconds + usec / 1e6.
+    """
+    seconds, fraction = divmod(timestamp_ns, NANOSECONDS)
+    return seconds + fraction / NANOSECONDS
+
+
+class Interface(NamedTuple):
+    """A pcapng capture interface, from its description block."""
+
+    link_type: int
+    snaplen: int
+    units_per_second: int
+    offset_seconds: int
+
+
+class Section(NamedTuple):
+    """Reader state from a pcapng section or interface block onwards."""
+
+    offset: int
+    byte_order: str
+    interfaces: tuple[Interface, ...]
+
+
+class CaptureReader(ABC):
+    """Walk the records of a capture through a read-only memory map.
+
+    Iterating yields (timestamp_ns, link_type, frame) where frame is a
+    memoryview into the mapping, nothing is copied unless the caller asks
+    for it. Raises ValueError for anything that is not a capture file,
+    like dpkt.pcap.Reader.
+
+    Compressed captures, and captures still being written, are read
+    through a window of a ChunkStream instead, self.mapping then holds the
+    bytes from offset self.base on. Offsets are always into the
+    decompressed capture. A walk over the records stops early where the
+    stream has no more data yet, self.stopped_at is where to carry on.
+    """
+
+    # First offset that can hold a record
+    data_start = 0
+
+    def __init__(self, filename: str,
+                 stream: ChunkStream | None = None) -> None:
+        """Map the file, or start decompressing it.
+
+        Arguments
+        stream -- read the capture from this instead of filename
+        """
+        self.stream = stream
+        self.base = 0
+        # Offset of the record a walk stopped at, or ended before
+        self.stopped_at = 0
+        compression = detect_compression(filename) if stream is None \
+            else None
+        if compression is not None:
+            self.stream = DecompressedStream(filename, compression)
+        if self.stream is not None:
+            self.mapping: mmap.mmap | bytes = b""
+        else:
+            with open(filename, "rb") as capture:
+                try:
+                    self.mapping = mmap.mmap(capture.fileno(), 0,
+                                             access=mmap.ACCESS_READ)
+                except ValueError as error:
+                    # Empty files cannot be mapped
+                    raise ValueError("invalid tcpdump header") from error
+        self.view = memoryview(self.mapping)
+        # Offsets before this are in self.mapping
+        self.window_end = len(self.mapping)
+
+    @property
+    def seekable(self) -> bool:
+        """Check if reading can start at any record cheaply."""
+        return self.stream is None or self.stream.seekable
+
+    @property
+    def size(self) -> int | None:
+        """Get the length of the capture, None if not known yet."""
+        return len(self.mapping) if self.stream is None else \
+            self.stream.size
+
+    def end_or_size(self, end: int | None) -> int:
+        """Get the offset to read up to, the end of the capture for None."""
+        if end is not None:
+            return end
+        size = self.size
+        return sys.maxsize if size is None else size
+
+    def available(self, offset: int, length: int) -> bool:
+        """Check if the bytes from offset on are in self.mapping.
+
+        Only called outside the window. For compressed captures it
+        moves the window to offset, decompressing up to length bytes.
+        """
+        if self.stream is None:
+            return offset + length <= len(self.mapping)
+        self.base, self.mapping = self.stream.window(offset,
+                                                     offset + length)
+        self.view = memoryview(self.mapping)
+        self.window_end = self.base + len(self.mapping)
+        return offset + length <= self.window_end
+
+    @abstractmethod
+    def records(self, start: int = 0, end: int | None = None) -> Iterator[
+            tuple[int, int, int, int, int]]:
+        """Walk the record headers.
+
+        Arguments
+        start -- file offset of the first record to read
+        end -- stop before the record at or after this offset
+
+        Yields
+        (timestamp_ns, record_offset, offset, caplen, link_type) -- where
+        the record and its frame data start
+        """
+
+    def frames(self, start: int = 0, end: int | None = None) -> Iterator[
+            tuple[int, int, memoryview]]:
+        """Yield (timestamp_ns, link_type, frame) for a byte range."""
+        for timestamp, _, offset, caplen, link_type in self.records(start,
+                                                                    end):
+            offset -= self.base
+            yield (timestamp, link_type, self.view[offset:offset + caplen])
+
+    def located_frames(self, start: int = 0, end: int | None = None
+                       ) -> Iterator[tuple[int, int, int, memoryview]]:
+        """Yield (timestamp_ns, link_type, offset, frame) for a byte range.
+
+        offset is where frame starts in the capture, see read.
+        """
+        for timestamp, _, offset, caplen, link_type in self.records(start,
+                                                                    end):
+            yield (timestamp, link_type, offset,
+                   self.view[offset - self.base:
+                             offset - self.base + caplen])
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Copy length bytes of the capture from offset.
+
+        Reading in offset order only moves the window of a compressed
+        capture forwards. Raises ValueError if the capture is shorter.
+        """
+        if not self.base <= offset <= offset + length <= self.window_end \
+                and not self.available(offset, length):
+            raise ValueError(f"capture ends before offset {offset + length}")
+        offset -= self.base
+        return bytes(self.view[offset:offset + length])
+
+    def __iter__(self) -> Iterator[tuple[int, int, memoryview]]:
+        """Yield (timestamp_ns, link_type, frame) for every record."""
+        return self.frames()
+
+    def shard_offsets(self, shards: int, start: int = 0,
+                      end: int | None = None) -> list[int]:
+        """Split the records in a byte range into shards of similar size.
+
+        Only the record headers are read, shard boundaries always fall on
+        the start of a record.
+
+        Returns
+        offsets -- shards + 1 offsets, shard i covers offsets[i] to
+        offsets[i + 1]. Empty shards are dropped, captures that are not
+        seekable are one shard.
+        """
+        start = max(start, self.data_start)
+        end = self.end_or_size(end)
+        if not self.seekable:
+            return [start, end]
+        step = (end - start) / shards
+        offsets = [start]
+        for _, record_offset, _, _, _ in self.records(start, end):
+            if record_offset >= start + step * len(offsets):
+                offsets.append(record_offset)
+        offsets.append(end)
+        # Several boundaries can land on the same record for huge frames
+        return sorted(set(offsets))
+
+    def close(self) -> None:
+        """Release the memory map, or stop decompressing."""
+        self.view.release()
+        if self.stream is not None:
+            self.stream.close()
+        if not isinstance(self.mapping, mmap.mmap):
+            return
+        try:
+            self.mapping.close()
+        except BufferError:
+            # A frame view is still referenced, the mapping is released
+            # once it is garbage collected.
+            pass
+
+    def __enter__(self) -> "CaptureReader":
+        """Use the reader as a context manager."""
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None,
+                 exc_value: BaseException | None,
+                 traceback: TracebackType | None) -> None:
+        """Close the reader on leaving the context."""
+        self.close()
+
+
+class PcapReader(CaptureReader):
+    """Reader for the classic pcap format, one link type per file."""
+
+    data_start = GLOBAL_HEADER_LENGTH
+
+    def __init__(self, filename: str,
+                 stream: ChunkStream | None = None) -> None:
+        """Map the file and read the global header."""
+        super().__init__(filename, stream)
+        if not self.available(0, GLOBAL_HEADER_LENGTH) or \
+                struct.unpack_from(">I", self.mapping)[0] not in PCAP_MAGICS:
+            self.close()
+            raise ValueError("invalid tcpdump header")
+        byte_order, self.record_header_length, self.fraction_ns = \
+            PCAP_MAGICS[struct.unpack_from(">I", self.mapping)[0]]
+        self.snaplen, linktype = struct.unpack_from(
+            f"{byte_order}II", self.mapping, 16)
+        # The upper bits hold the FCS length, not the link type
+        self.linktype = linktype & 0xffff
+        self.record_header = struct.Struct(f"{byte_order}IIII")
+
+    def records(self, start: int = 0, end: int | None = None) -> Iterator[
+            tuple[int, int, int, int, int]]:
+        """Walk the record headers, see CaptureReader.records."""
+        end = self.end_or_size(end)
+        offset = max(start, self.data_start)
+        header_length = self.record_header_length
+        unpack_from = self.record_header.unpack_from
+        if offset < self.base:
+            # Going back to before the window of a compressed capture
+            self.available(offset, header_length)
+        while offset + header_length <= end:
+            self.stopped_at = offset
+            if offset + header_length > self.window_end and \
+                    not self.available(offset, header_length):
+                return
+            seconds, fraction, caplen, _ = unpack_from(self.mapping,
+                                                       offset - self.base)
+            if offset + header_length + caplen > self.window_end and \
+                    not self.available(offset, header_length + caplen):
+                # Truncated record at the end of the capture
+                return
+            yield (seconds * NANOSECONDS + fraction * self.fraction_ns,
+                   offset, offset + self.record_header_length, caplen,
+                   self.linktype)
+            offset += self.record_header_length + caplen
+        self.stopped_at = offset
+
+
+def read_interface(mapping: mmap.mmap | bytes, offset: int, length: int,
+                   byte_order: str) -> Interface:
+    """Read an interface description block's link type and options."""
+    link_type, snaplen = struct.unpack_from(f"{byte_order}HxxI", mapping,
+                                            offset + 8)
+    units_per_second = DEFAULT_UNITS_PER_SECOND
+    offset_seconds = 0
+    position = offset + 16
+    # Options run up to the trailing block length
+    while position + 4 <= offset + length - 4:
+        code, option_length = struct.unpack_from(f"{byte_order}HH", mapping,
+                                                 position)
+        if code == OPTION_END:
+            break
+        value = position + 4
+        if code == OPTION_TSRESOL and option_length >= 1:
+            resolution = mapping[value]
+            # Top bit set for a power of two, otherwise of ten
+            units_per_second = 2 ** (resolution & 0x7f) \
+                if resolution & 0x80 else 10 ** resolution
+        elif code == OPTION_TSOFFSET and option_length >= 8:
+            offset_seconds = struct.unpack_from(f"{byte_order}q", mapping,
+                                                value)[0]
+        # Option values are padded to 32 bits
+        position = value + (option_length + 3) // 4 * 4
+    return Interface(link_type, snaplen, units_per_second, offset_seconds)
+
+
+class PcapngReader(CaptureReader):
+    """Reader for pcapng, with per-interface link types and resolutions.
+
+    Section and interface description blocks can appear anywhere, so the
+    reader state they give is remembered by offset. Reading from the
+    middle of the file first walks the block headers up to it, once.
+    """
+
+    def __init__(self, filename: str,
+                 stream: ChunkStream | None = None) -> None:
+        """Map the file and read the first section header."""
+        super().__init__(filename, stream)
+        if not self.available(0, 28) or struct.unpack_from(
+                "<I", self.mapping)[0] != SECTION_HEADER_BLOCK or \
+                self.section_byte_order(0) is None:
+            self.close()
+            raise ValueError("invalid pcapng header")
+        # Reader state at each section and interface block, in file order
+        self.sections: list[Section] = []
+        # Blocks before this offset have been walked
+        self.walked = 0
+
+    def section_byte_order(self, offset: int) -> str | None:
+        """Get the byte order of the section starting at offset."""
+        for byte_order in "<>":
+            if struct.unpack_from(f"{byte_order}I", self.mapping,
+                                  offset - self.base + 8)[0] == \
+                    BYTE_ORDER_MAGIC:
+                return byte_order
+        return None
+
+    def walk_to(self, offset: int) -> None:
+        """Walk the blocks before offset, remembering the reader state."""
+        if offset > self.walked:
+            for _ in self.blocks(self.walked, offset):
+                pass
+
+    def state_at(self, offset: int) -> Section | None:
+        """Get the reader state left by the blocks before offset."""
+        position = bisect.bisect_left(
+            [section.offset for section in self.sections], offset)
+        return self.sections[position - 1] if position else None
+
+    def blocks(self, start: int, end: int) -> Iterator[tuple[
+            int, int, int, Section]]:
+        """Walk the blocks from start, which must begin a block.
+
+        Yields
+        (offset, block_type, length, state) -- of each packet block
+        """
+        self.walk_to(start)
+        state = self.state_at(start)
+        offset = start
+        if offset < self.base:
+            # Going back to before the window of a compressed capture
+            self.available(offset, 12)
+        while offset + 12 <= end:
+            self.stopped_at = offset
+            if offset + 12 > self.window_end and \
+                    not self.available(offset, 12):
+                return
+            if struct.unpack_from("<I", self.mapping, offset - self.base)[
+                    0] == SECTION_HEADER_BLOCK:
+                byte_order = self.section_byte_order(offset)
+                if byte_order is None:
+                    return
+                state = Section(offset, byte_order, ())
+            elif state is None:
+                # Not a pcapng block boundary
+                return
+            block_type, length = BLOCK_HEADER[state.byte_order].unpack_from(
+                self.mapping, offset - self.base)
+            if length < 12 or length % 4 or \
+                    (offset + length > self.window_end and
+                     not self.available(offset, length)):
+                # Truncated or corrupt block at the end of the capture
+                return
+            if block_type == INTERFACE_DESCRIPTION_BLOCK:
+                state = state._replace(offset=offset, interfaces=(
+                    *state.interfaces, read_interface(
+                        self.mapping, offset - self.base, length,
+                        state.byte_order)))
+            if offset >= self.walked:
+                if state.offset == offset:
+                    self.sections.append(state)
+                self.walked = offset + length
+            if block_type in (ENHANCED_PACKET_BLOCK, PACKET_BLOCK,
+                              SIMPLE_PACKET_BLOCK):
+                yield (offset, block_type, length, state)
+            offset += length
+        self.stopped_at = offset
+
+    def records(self, start: int = 0, end: int | None = None) -> Iterator[
+            tuple[int, int, int, int, int]]:
+        """Walk the packet blocks, see CaptureReader.records.
+
+        Simple packet blocks carry no timestamp, they are given the one
+        of the packet before them.
+        """
+        timestamp = 0
+        for offset, block_type, length, state in self.blocks(
+                start, self.end_or_size(end)):
+            if block_type == SIMPLE_PACKET_BLOCK:
+                interface_id, data_offset = 0, offset + 12
+                ticks = None
+                caplen = min(struct.unpack_from(
+                    f"{state.byte_order}I", self.mapping,
+                    offset - self.base + 8)[0], length - 16)
+            else:
+                header = ENHANCED_PACKET_HEADER \
+                    if block_type == ENHANCED_PACKET_BLOCK else PACKET_HEADER
+                # Timestamps are split into high and low 32 bit words
+                interface_id, *words, caplen = header[
+                    state.byte_order].unpack_from(self.mapping,
+                                                  offset - self.base + 8)
+                data_offset = offset + 28
+                caplen = min(caplen, length - 32)
+                ticks = words[0] << 32 | words[1]
+            if interface_id >= len(state.interfaces):
+                continue
+            interface = state.interfaces[interface_id]
+            if ticks is not None:
+                timestamp = (interface.offset_seconds * NANOSECONDS
+                             + ticks * NANOSECONDS
+                             // interface.units_per_second)
+            yield (timestamp, offset, data_offset, caplen,
+                   interface.link_type)
+
+
+def open_capture(filename: str,
+                 stream: ChunkStream | None = None) -> CaptureReader:
+    """Open a pcap or pcapng capture, detected from its first bytes.
+
+    gzip, zstd and lz4 compressed captures are decompressed as they are
+    read.
+
+    Arguments
+    stream -- read the capture from this instead, e.g. one still being
+    written, see follow.TailStream
+    """
+    magic = first_bytes(filename, 4) if stream is None else \
+        stream.window(0, 4)[1][:4]
+    if len(magic) == 4 and \
+            struct.unpack("<I", magic)[0] == SECTION_HEADER_BLOCK:
+        return PcapngReader(filename, stream)
+    return PcapReader(filename, stream)
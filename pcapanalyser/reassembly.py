@@ -0,0 +1,305 @@
+'''
+/***
+** Script:   reassembly.py
+** Desc:     TCP stream reassembly for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Segments are put back in sequence order per direction of
+*               each connection, so application parsers see whole
+*               requests even when they were split across segments.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+# pylint: disable=R0902
+"""Flow table based TCP reassembler."""
+import bisect
+from array import array
+from collections.abc import Iterable, Iterator
+
+import dpkt
+
+from pcapanalyser.types import TcpSegment
+
+SEQ_MASK = 0xffffffff
+SEQ_HALF = 0x80000000
+# Out of order data buffered per direction before a gap is given up on
+MAX_PENDING_BYTES = 256 * 1024
+# Reassembled data kept per direction, the rest is counted but dropped
+MAX_STREAM_BYTES = 1024 * 1024
+# Directions idle for this many capture seconds are evicted
+IDLE_TIMEOUT = 120.0
+
+
+def reverse_flow(
+        flow: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+    """Get the flow of the other direction of a connection."""
+    return (flow[2], flow[3], flow[0], flow[1])
+
+
+def connection_key(
+        flow: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+    """Get the key both directions of a connection share."""
+    return min(flow, reverse_flow(flow))
+
+
+class TcpStream:
+    """One direction of a TCP connection, in sequence order.
+
+    data holds the reassembled payload, segment_offsets and
+    segment_timestamps record where in data each segment starts so a
+    position can be mapped back to a capture time. A stream is complete
+    once the other direction has acknowledged its FIN.
+    """
+
+    def __init__(self, flow: tuple[int, int, int, int],
+                 timestamp: float) -> None:
+        """Initialise variables."""
+        self.flow = flow
+        self.data = bytearray()
+        self.segment_offsets = array("Q")
+        self.segment_timestamps = array("d")
+        # Initial sequence number, None until a SYN is seen
+        self.isn: int | None = None
+        # Only meaningful once synchronised, by a SYN or the first data
+        self.next_seq = 0
+        self.synchronised = False
+        # seq -> (timestamp, payload) of segments ahead of next_seq
+        self.pending: dict[int, tuple[float, bytes]] = {}
+        self.pending_bytes = 0
+        self.last_seen = timestamp
+        # Sequence number the FIN takes, None until a FIN is seen
+        self.fin_seq: int | None = None
+        self.acknowledged = False
+        self.truncated = False
+
+    def add(self, segment: TcpSegment) -> None:
+        """Add a segment, buffering it if it arrived out of order."""
+        self.last_seen = segment.timestamp
+        seq = segment.seq
+        if segment.flags & dpkt.tcp.TH_SYN:
+            # SYN takes one sequence number, any data follows it
+            seq = (seq + 1) & SEQ_MASK
+            # A retransmitted SYN must not drop what followed it
+            if segment.seq != self.isn:
+                self.isn = segment.seq
+                self.next_seq = seq
+                self.synchronised = True
+        if segment.flags & dpkt.tcp.TH_FIN:
+            self.fin_seq = (seq + len(segment.payload)) & SEQ_MASK
+        if not segment.payload:
+            return
+        if not self.synchronised:
+            # Capture started mid connection
+            self.next_seq = seq
+            self.synchronised = True
+        ahead = (seq - self.next_seq) & SEQ_MASK
+        if 0 < ahead < SEQ_HALF:
+            if seq in self.pending:
+                # Retransmitted while still out of order
+                return
+            if self.pending_bytes + len(segment.payload) > \
+                    MAX_PENDING_BYTES:
+                # The missing data is not coming, skip over the gap
+                self.skip_gap()
+            self.pending[seq] = (segment.timestamp, segment.payload)
+            self.pending_bytes += len(segment.payload)
+        else:
+            self.append(segment.timestamp, seq, segment.payload)
+        self.drain()
+
+    def append(self, timestamp: float, seq: int, payload: bytes) -> bool:
+        """Append a segment at or behind next_seq, trimming any overlap.
+
+        Returns False if the segment was entirely a retransmission.
+        """
+        behind = (self.next_seq - seq) & SEQ_MASK
+        if behind >= SEQ_HALF or behind >= len(payload):
+            return False
+        payload = payload[behind:]
+        self.next_seq = (self.next_seq + len(payload)) & SEQ_MASK
+        room = MAX_STREAM_BYTES - len(self.data)
+        if len(payload) > room:
+            self.truncated = True
+            payload = payload[:room]
+        if payload:
+            self.segment_offsets.append(len(self.data))
+            self.segment_timestamps.append(timestamp)
+            self.data += payload
+        return True
+
+    def drain(self) -> None:
+        """Append buffered segments that next_seq has caught up with."""
+        while self.pending:
+            ready = [seq for seq in self.pending
+                     if (seq - self.next_seq) & SEQ_MASK >= SEQ_HALF
+                     or seq == self.next_seq]
+            if not ready:
+                return
+            for seq in ready:
+                timestamp, payload = self.pending.pop(seq)
+                self.pending_bytes -= len(payload)
+                self.append(timestamp, seq, payload)
+
+    def skip_gap(self) -> None:
+        """Give up on missing data, continue from the next buffered one."""
+        if self.pending:
+            self.next_seq = min(self.pending, key=lambda seq:
+                                (seq - self.next_seq) & SEQ_MASK)
+            self.drain()
+
+    def acknowledge(self, ack: int) -> None:
+        """Note an acknowledgment number sent by the other direction."""
+        if self.fin_seq is not None and \
+                (ack - self.fin_seq - 1) & SEQ_MASK < SEQ_HALF:
+            self.acknowledged = True
+
+    def finish(self) -> None:
+        """Append everything still buffered, skipping over any gaps."""
+        while self.pending:
+            self.skip_gap()
+
+    def timestamp_at(self, offset: int) -> float:
+        """Get the capture time of the segment holding data[offset]."""
+        position = bisect.bisect_right(self.segment_offsets, offset) - 1
+        return self.segment_timestamps[max(0, position)]
+
+
+class TcpReassembler:
+    """Flow table of TcpStreams keyed by direction.
+
+    add() returns the streams that a segment completed, and any that
+    were idle for longer than idle_timeout. A stream is kept after its
+    FIN, as segments captured out of order may still follow, until the
+    other direction acknowledges the FIN. There is no acknowledgment of
+    a RST, reset streams are kept until they are idle. Only streams
+    that carried data are returned, finish() returns the rest at the
+    end of the capture.
+
+    A reassembler of a shard that continues an earlier one holds back
+    the connections that were already open when the shard started, see
+    carry, and is merged into the earlier shard's with adopt.
+    """
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT) -> None:
+        """Initialise variables."""
+        self.idle_timeout = idle_timeout
+        self.streams: dict[tuple[int, int, int, int], TcpStream] = {}
+        self.next_eviction: float | None = None
+        self.continues = False
+        # Connections seen opening with a SYN, and those carried
+        self.opened: set[tuple[int, int, int, int]] = set()
+        self.carried_connections: set[tuple[int, int, int, int]] = set()
+        self.carried: list[TcpSegment] = []
+
+    def continue_shard(self) -> None:
+        """Mark the segments to come as following an earlier shard's."""
+        self.continues = True
+
+    def carry(self, segment: TcpSegment) -> bool:
+        """Hold back a segment of a connection open before the shard.
+
+        A shard that continues another starts in the middle of the
+        connections still open at its start, and can neither reassemble
+        nor classify them. Every segment of a connection whose first one
+        in the shard is not a SYN is kept in carried instead, to be added
+        to the earlier shard's streams when the shards are merged.
+
+        Returns True if the segment was carried.
+        """
+        if not self.continues:
+            return False
+        connection = connection_key(segment.flow)
+        if connection in self.carried_connections:
+            self.carried.append(segment)
+            return True
+        if connection in self.opened:
+            return False
+        if segment.flags & dpkt.tcp.TH_SYN:
+            self.opened.add(connection)
+            return False
+        self.carried_connections.add(connection)
+        self.carried.append(segment)
+        return True
+
+    def adopt(self, other: "TcpReassembler") -> list[TcpStream]:
+        """Take over the open streams of the next shard's reassembler.
+
+        The segments other carried are to be added before. A stream of
+        this reassembler on a flow that other opened again is complete.
+
+        Returns
+        streams -- the completed streams, as add
+        """
+        replaced = [self.streams.pop(flow) for flow in other.streams
+                    if flow in self.streams]
+        self.streams.update(other.streams)
+        if other.next_eviction is not None:
+            self.next_eviction = other.next_eviction
+        return self.complete(replaced)
+
+    def add(self, segment: TcpSegment) -> list[TcpStream]:
+        """Add a segment to its stream.
+
+        A SYN with a new initial sequence number starts a new connection
+        on the flow, completing the stream of the one before.
+        """
+        finished = self.acknowledge(segment)
+        stream = self.streams.get(segment.flow)
+        if stream is not None and segment.flags & dpkt.tcp.TH_SYN and \
+                segment.seq != stream.isn:
+            finished.append(self.streams.pop(segment.flow))
+            stream = None
+        if stream is None and (segment.payload or
+                               segment.flags & dpkt.tcp.TH_SYN):
+            stream = self.streams[segment.flow] = TcpStream(
+                segment.flow, segment.timestamp)
+        # Otherwise bare ACKs, or a FIN of a stream without data
+        if stream is not None:
+            stream.add(segment)
+        if self.next_eviction is None or \
+                segment.timestamp >= self.next_eviction:
+            finished += self.evict_idle(segment.timestamp)
+        return self.complete(finished)
+
+    def acknowledge(self, segment: TcpSegment) -> list[TcpStream]:
+        """Pass on a segment's ACK, removing the stream it completes."""
+        if not segment.flags & dpkt.tcp.TH_ACK:
+            return []
+        peer = self.streams.get(reverse_flow(segment.flow))
+        if peer is None:
+            return []
+        peer.acknowledge(segment.ack)
+        return [self.streams.pop(peer.flow)] if peer.acknowledged else []
+
+    def evict_idle(self, timestamp: float) -> list[TcpStream]:
+        """Remove the streams not seen for idle_timeout seconds."""
+        self.next_eviction = timestamp + self.idle_timeout / 4
+        idle = [flow for flow, stream in self.streams.items()
+                if timestamp - stream.last_seen > self.idle_timeout]
+        return [self.streams.pop(flow) for flow in idle]
+
+    def finish(self) -> list[TcpStream]:
+        """Remove and return every remaining stream."""
+        streams = list(self.streams.values())
+        self.streams.clear()
+        return self.complete(streams)
+
+    @staticmethod
+    def complete(streams: list[TcpStream]) -> list[TcpStream]:
+        """Flush buffered data of streams leaving the table."""
+        for stream in streams:
+            stream.finish()
+        return [stream for stream in streams if stream.data]
+
+
+def reassemble(segments: Iterable[TcpSegment]) -> Iterator[TcpStream]:
+    """Reassemble segments, yielding each stream once it is complete."""
+    reassembler = TcpReassembler()
+    for segment in segments:
+        yield from reassembler.add(segment)
+    yield from reassembler.finish()
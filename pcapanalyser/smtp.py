@@ -0,0 +1,98 @@
+'''
+/***
+** Script:   smtp.py
+** Desc:     SMTP address scanner for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Reassembled SMTP streams are scanned once as bytes for the
+*               envelope commands and the address headers of each message.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+"""Single pass SMTP sender and recipient extraction."""
+import re
+
+from pcapanalyser.reassembly import TcpStream
+from pcapanalyser.types import Emails
+
+# Envelope commands, or the DATA command that starts a message
+SMTP_COMMAND = re.compile(
+    rb"^(?:(?P<command>MAIL FROM|RCPT TO):[ \t]*<(?P<address>[^>\r\n]+)>"
+    rb"|DATA[ \t]*\r?\n)", re.IGNORECASE | re.MULTILINE)
+# Address header fields of a message, with any folded lines
+HEADER_FIELD = re.compile(
+    rb"^(?P<field>From|To|Cc):(?P<value>.*(?:\r?\n[ \t].*)*)",
+    re.IGNORECASE | re.MULTILINE)
+ADDRESS = re.compile(rb"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+HEADERS_END = re.compile(rb"\r?\n\r?\n")
+MESSAGE_END = re.compile(rb"\r?\n\.\r?\n")
+# Emails key each command or header field counts towards
+ROLES = {b"mail from": "From", b"from": "From",
+         b"rcpt to": "To", b"to": "To", b"cc": "To"}
+
+
+class SmtpAddresses:
+    """Unique addresses of each role, with when they were first seen.
+
+    Addresses are de-duplicated ignoring case as they are found, the
+    first spelling seen is the one reported.
+    """
+
+    def __init__(self) -> None:
+        """Initialise variables."""
+        # role -> lower case address -> (first timestamp, address)
+        self.found: dict[str, dict[str, tuple[float, str]]] = {
+            "From": {}, "To": {}}
+
+    def add(self, role: str, address: str, timestamp: float) -> None:
+        """Record an address, keeping the earliest sighting."""
+        seen = self.found[role].get(address.lower())
+        if seen is None or timestamp < seen[0]:
+            self.found[role][address.lower()] = (timestamp, address)
+
+    def scan(self, stream: TcpStream) -> None:
+        """Find the addresses in one direction of an SMTP connection.
+
+        The envelope commands are found in one pass, each message's
+        header block is scanned for From, To and Cc and its body is
+        skipped.
+        """
+        data = bytes(stream.data)
+        position = 0
+        while match := SMTP_COMMAND.search(data, position):
+            position = match.end()
+            if match["command"]:
+                self.add(ROLES[match["command"].lower()],
+                         match["address"].decode("ascii", "replace"),
+                         stream.timestamp_at(match.start()))
+                continue
+            headers_end = HEADERS_END.search(data, position)
+            headers_end_position = headers_end.start() if headers_end \
+                else len(data)
+            for field in HEADER_FIELD.finditer(data, position,
+                                               headers_end_position):
+                for address in ADDRESS.findall(field["value"]):
+                    self.add(ROLES[field["field"].lower()],
+                             address.decode("ascii"),
+                             stream.timestamp_at(field.start()))
+            message_end = MESSAGE_END.search(data, headers_end_position)
+            position = message_end.end() if message_end else len(data)
+
+    def merge(self, other: "SmtpAddresses") -> None:
+        """Combine with the addresses found elsewhere."""
+        for role, addresses in other.found.items():
+            for timestamp, address in addresses.values():
+                self.add(role, address, timestamp)
+
+    def emails(self) -> Emails:
+        """Get the addresses of each role, in the order first seen."""
+        return {"From": self.in_order("From"), "To": self.in_order("To")}
+
+    def in_order(self, role: str) -> list[str]:
+        """Get the addresses of a role, in the order first seen."""
+        return [address for _, address in sorted(self.found[role].values())]
@@ -0,0 +1,516 @@
+'''
+/***
+** Script:   streaming.py
+** Desc:     Streaming analysis for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Every command is answered by an aggregator that is fed one
+*               packet at a time, so the capture is never held in memory.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+# pylint: disable=R0903
+"""Incremental aggregators used by the streaming analysis mode."""
+from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any
+
+import dpkt
+
+from pcapanalyser import parsing
+from pcapanalyser.protocolindex import ProtocolIndex
+from pcapanalyser.reader import open_capture
+from pcapanalyser.reassembly import TcpReassembler, TcpStream
+from pcapanalyser.flows import FlowTable, flow_key
+from pcapanalyser.smtp import SmtpAddresses
+from pcapanalyser.timeseries import TrafficBuckets, TrafficPyramid
+from pcapanalyser.httptransactions import HttpExtractor, image_uris
+from pcapanalyser.utils import create_logger
+from pcapanalyser.types import (Emails, HttpTransaction, PacketRecord,
+                                ProtocolStats)
+
+logger = create_logger()
+
+
+def percentile_from_histogram(histogram: list[tuple[int, int]],
+                              percentile: float) -> float:
+    """Linearly interpolated percentile, matching numpy.percentile.
+
+    Arguments
+    histogram -- sorted (value, number of occurrences) pairs
+    percentile -- the percentile to calculate, between 0 and 100
+    """
+    total = sum(number for _, number in histogram)
+    position = (total - 1) * percentile / 100
+    lower_rank = int(position)
+    values: list[int] = []
+    seen = 0
+    # Find the values at the two ranks either side of position
+    for value, number in histogram:
+        seen += number
+        while len(values) < 2 and lower_rank + len(values) < seen:
+            values.append(value)
+        if len(values) == 2:
+            break
+    if len(values) == 1:
+        return float(values[0])
+    return values[0] + (values[1] - values[0]) * (position - lower_rank)
+
+
+class Aggregator(ABC):
+    """Base class for an incremental, per packet computation."""
+
+    @abstractmethod
+    def update(self, record: PacketRecord, protocol_name: str) -> None:
+        """Add a single decoded packet to the aggregate."""
+
+    @abstractmethod
+    def merge(self, other: Any) -> None:
+        """Add the aggregate of the packets that follow this one's."""
+
+    def continue_shard(self) -> None:
+        """Mark the packets to come as following an earlier shard's."""
+
+    def finish(self) -> None:
+        """Complete the aggregate once every packet has been added."""
+
+    def result(self) -> Any:
+        """Get the answer to the aggregator's query, see get_aggregate."""
+        return self
+
+
+class ProtocolAggregator(Aggregator):
+    """Packet count, timestamp extrema and lengths for each protocol.
+
+    Lengths are kept as a histogram, which is bounded by the largest
+    frame size and still gives exact percentiles.
+    """
+
+    def __init__(self) -> None:
+        """Initialise variables."""
+        self.count: dict[str, int] = {}
+        self.first: dict[int | str, float] = {}
+        self.last: dict[int | str, float] = {}
+        self.lengths: dict[int | str, Counter] = {}
+
+    def update(self, record: PacketRecord, protocol_name: str) -> None:
+        """Count the packet and add it to its protocol statistics."""
+        self.count.setdefault(protocol_name, 0)
+        self.count[protocol_name] += 1
+        protocol = record.protocol
+        if protocol is None:
+            # Unknown protocols have no statistics, as in parsing.py
+            return
+        if protocol not in self.lengths:
+            self.first[protocol] = self.last[protocol] = record.timestamp
+            self.lengths[protocol] = Counter()
+        self.first[protocol] = min(self.first[protocol], record.timestamp)
+        self.last[protocol] = max(self.last[protocol], record.timestamp)
+        self.lengths[protocol][record.length] += 1
+
+    def merge(self, other: Any) -> None:
+        """Combine counts, extrema and length histograms."""
+        for protocol_name, number_of_packets in other.count.items():
+            self.count.setdefault(protocol_name, 0)
+            self.count[protocol_name] += number_of_packets
+        for protocol, lengths in other.lengths.items():
+            if protocol not in self.lengths:
+                self.first[protocol] = other.first[protocol]
+                self.last[protocol] = other.last[protocol]
+                self.lengths[protocol] = Counter()
+            self.first[protocol] = min(self.first[protocol],
+                                       other.first[protocol])
+            self.last[protocol] = max(self.last[protocol],
+                                      other.last[protocol])
+            self.lengths[protocol].update(lengths)
+
+    def get_stats(self, protocol: int | str) -> ProtocolStats:
+        """Summarise the statistics gathered for a protocol."""
+        histogram = sorted(self.lengths[protocol].items())
+        return {
+            "packets": sum(self.lengths[protocol].values()),
+            "first": self.first[protocol],
+            "last": self.last[protocol],
+            "total_length": sum(length * number
+                                for length, number in histogram),
+            "min_length": histogram[0][0],
+            "max_length": histogram[-1][0],
+            "median_length": percentile_from_histogram(histogram, 50),
+            "p95_length": percentile_from_histogram(histogram, 95)
+        }
+
+
+class HttpAggregator(Aggregator):
+    """HTTP requests paired with their responses.
+
+    Connections still open between shards are reassembled across them,
+    see HttpExtractor.merge.
+    """
+
+    def __init__(self) -> None:
+        """Initialise variables."""
+        self.extractor = HttpExtractor()
+        self.transactions: list[HttpTransaction] = []
+
+    def update(self, record: PacketRecord, protocol_name: str) -> None:
+        """Reassemble the segment if it belongs to a HTTP connection."""
+        if record.protocol == dpkt.ip.IP_PROTO_TCP:
+            self.extractor.add(parsing.record_to_segment(record))
+
+    def continue_shard(self) -> None:
+        """Carry the connections already open, see TcpReassembler.carry."""
+        self.extractor.reassembler.continue_shard()
+
+    def finish(self) -> None:
+        """Parse the streams still open at the end of the capture."""
+        self.transactions = self.extractor.finish()
+
+    def merge(self, other: Any) -> None:
+        """Continue with the unfinished aggregator of the next shard."""
+        self.extractor.merge(other.extractor)
+
+
+class SmtpEmailAggregator(Aggregator):
+    """Unique SMTP sender and recipient addresses."""
+
+    def __init__(self) -> None:
+        """Initialise variables."""
+        self.addresses = SmtpAddresses()
+        self.reassembler = TcpReassembler()
+
+    def update(self, record: PacketRecord, protocol_name: str) -> None:
+        """Reassemble packets sent to or from an SMTP port."""
+        if record.protocol == dpkt.ip.IP_PROTO_TCP and \
+                (record.sport in parsing.SMTP_PORTS or
+                 record.dport in parsing.SMTP_PORTS):
+            segment = parsing.record_to_segment(record)
+            if not self.reassembler.carry(segment):
+                self.search(self.reassembler.add(segment))
+
+    def search(self, streams: list[TcpStream]) -> None:
+        """Extract addresses from completed streams."""
+        for stream in streams:
+            self.addresses.scan(stream)
+
+    def continue_shard(self) -> None:
+        """Carry the connections already open, see TcpReassembler.carry."""
+        self.reassembler.continue_shard()
+
+    def finish(self) -> None:
+        """Search the streams still open at the end of the capture."""
+        self.search(self.reassembler.finish())
+
+    def merge(self, other: Any) -> None:
+        """Continue with the unfinished aggregator of the next shard.
+
+        The segments it carried continue this aggregator's streams, then
+        its streams and addresses are taken over.
+        """
+        for segment in other.reassembler.carried:
+            self.search(self.reassembler.add(segment))
+        self.search(self.reassembler.adopt(other.reassembler))
+        self.addresses.merge(other.addresses)
+
+
+class FlowAggregator(Aggregator):
+    """Counters of every bidirectional 5-tuple flow."""
+
+    def __init__(self) -> None:
+        """Initialise variables."""
+        self.flows = FlowTable()
+
+    def update(self, record: PacketRecord, protocol_name: str) -> None:
+        """Count the packet against its flow."""
+        # Only IP packets have addresses and an IP protocol number
+        if record.src is None or record.dst is None or \
+                not isinstance(record.protocol, int):
+            self.flows.non_ip_packets += 1
+            return
+        key, direction = flow_key(record.protocol, record.src,
+                                  record.sport or 0, record.dst,
+                                  record.dport or 0)
+        self.flows.add(key, direction, record.timestamp, record.length,
+                       record.tcp_flags)
+
+    def merge(self, other: Any) -> None:
+        """Add the flows of the later packets."""
+        self.flows.merge(other.flows)
+
+
+class DestinationAggregator(Aggregator):
+    """Number of IP packets sent to each destination address."""
+
+    def __init__(self) -> None:
+        """Initialise variables."""
+        self.packets_sent_to_address: dict[int, int] = {}
+
+    def update(self, record: PacketRecord, protocol_name: str) -> None:
+        """Count the packet against its destination."""
+        if record.dst is not None:
+            self.packets_sent_to_address.setdefault(record.dst, 0)
+            self.packets_sent_to_address[record.dst] += 1
+
+    def merge(self, other: Any) -> None:
+        """Add up the packets sent to each destination."""
+        for dst_ip, number_of_packets in \
+                other.packets_sent_to_address.items():
+            self.packets_sent_to_address.setdefault(dst_ip, 0)
+            self.packets_sent_to_address[dst_ip] += number_of_packets
+
+
+class TimestampAggregator(Aggregator):
+    """Packets and bytes sent over time, per protocol, for the graph.
+
+    Packets are counted into TrafficBuckets as they arrive, so only the
+    buckets are kept. Rows are the protocol values of PacketTable.
+    """
+
+    def __init__(self) -> None:
+        """Initialise variables."""
+        self.buckets = TrafficBuckets()
+
+    def update(self, record: PacketRecord, protocol_name: str) -> None:
+        """Count the packet in its bucket."""
+        self.buckets.add(record.timestamp, record.length,
+                         self.buckets.row(record.protocol))
+
+    def merge(self, other: Any) -> None:
+        """Add the buckets of the later packets' aggregator."""
+        self.buckets.merge(other.buckets)
+
+    def get_traffic(self) -> TrafficPyramid:
+        """Bin the packets and bytes over time."""
+        return TrafficPyramid(self.buckets)
+
+
+class FieldAggregator(Aggregator):
+    """How often each value of each registered protocol field was seen.
+
+    Only frames of the protocols in the dissector registry are dissected,
+    see parsing.dissect.
+    """
+
+    def __init__(self) -> None:
+        """Initialise variables."""
+        # Protocol name -> field -> value -> number of packets
+        self.values: dict[str, dict[str, Counter]] = {}
+
+    def update(self, record: PacketRecord, protocol_name: str) -> None:
+        """Count the field values of every registered protocol in the frame."""
+        for dissection in parsing.dissect(record):
+            fields = self.values.setdefault(dissection.dissector.name, {})
+            for field, value in dissection.values().items():
+                fields.setdefault(field, Counter())[value] += 1
+
+    def merge(self, other: Any) -> None:
+        """Add up the values of the later packets."""
+        for protocol, fields in other.values.items():
+            for field, values in fields.items():
+                self.values.setdefault(protocol, {}).setdefault(
+                    field, Counter()).update(values)
+
+    def result(self) -> dict[str, dict[str, Counter]]:
+        """Get the values seen of each protocol's fields."""
+        return self.values
+
+
+AGGREGATORS: dict[str, type[Aggregator]] = {
+    "protocols": ProtocolAggregator,
+    "http": HttpAggregator,
+    "emails": SmtpEmailAggregator,
+    "flows": FlowAggregator,
+    "destinations": DestinationAggregator,
+    "timestamps": TimestampAggregator,
+    "fields": FieldAggregator
+}
+
+
+def register_aggregator(name: str, aggregator: type[Aggregator]) -> None:
+    """Add an aggregator, its result is the query get_aggregate(name).
+
+    Registered aggregators are streamed with the rest, so new commands
+    need no change to the streaming loop.
+    """
+    AGGREGATORS[name] = aggregator
+
+
+def aggregate_shard(filename: str, names: list[str],
+                    ranges: list[tuple[int, int | None]],
+                    window: tuple[float | None, float | None],
+                    shard: int | None = None) -> tuple[
+                        dict[str, Aggregator], ProtocolIndex]:
+    """Run the named aggregators over byte ranges of a capture.
+
+    Runs in a worker process, so the protocols it found are returned
+    alongside the aggregators, to be merged by the caller.
+
+    Arguments
+    ranges -- (start, end) byte ranges to read, in capture order
+    window -- (start_time, end_time) of the packets to aggregate
+    shard -- the shard's number in a parallel run, None for the whole
+    capture. Shards are left unfinished, for the caller to merge in
+    capture order and finish, and every one after the first continues
+    the one before.
+    """
+    aggregators = {name: AGGREGATORS[name]() for name in names}
+    if shard:
+        for aggregator in aggregators.values():
+            aggregator.continue_shard()
+    protocols = ProtocolIndex()
+    for start, end in ranges:
+        for record, protocol_name in parsing.iter_packets(filename, start,
+                                                          end, *window):
+            protocols.add(protocol_name, record.protocol)
+            for aggregator in aggregators.values():
+                aggregator.update(record, protocol_name)
+    if shard is None:
+        for aggregator in aggregators.values():
+            aggregator.finish()
+    return (aggregators, protocols)
+
+
+class StreamingAnalysis:
+    """Answer the parsing queries by streaming the capture.
+
+    Methods mirror the parsing.get_* functions so CaptureAnalyser can use
+    either. Aggregators are only run when their results are first needed,
+    prepare() runs several of them with a single read of the file.
+    With more than one worker the file is split into shards that are
+    aggregated in parallel and merged in capture order.
+    """
+
+    def __init__(self, filename: str, workers: int = 1,
+                 start_time: float | None = None,
+                 end_time: float | None = None,
+                 protocols: ProtocolIndex | None = None) -> None:
+        """Initialise variables.
+
+        Arguments
+        start_time, end_time -- only aggregate the packets captured in
+        [start_time, end_time), found through the capture's time index
+        protocols -- index of the analysis, the protocols streamed are
+        added
+        """
+        self.filename = filename
+        self.workers = workers
+        self.window = (start_time, end_time)
+        self.protocols = protocols if protocols is not None \
+            else ProtocolIndex()
+        self.aggregators: dict[str, Aggregator] = {}
+
+    def prepare(self, *names: str) -> None:
+        """Run the named aggregators over the capture in one pass."""
+        pending = [name for name in names if name not in self.aggregators]
+        if not pending:
+            return
+        logger.info("Streaming %s through %s", self.filename, pending)
+        ranges = parsing.window_ranges(self.filename, *self.window)
+        if self.workers > 1 and ranges:
+            self.aggregators.update(self.aggregate_in_parallel(pending,
+                                                               ranges))
+            return
+        self.aggregators.update(self.aggregate(pending, ranges))
+
+    def aggregate(self, names: list[str],
+                  ranges: list[tuple[int, int | None]]
+                  ) -> dict[str, Aggregator]:
+        """Aggregate the byte ranges of the capture in this process."""
+        aggregators, protocols = aggregate_shard(self.filename, names,
+                                                 ranges, self.window)
+        self.protocols.update(protocols)
+        return aggregators
+
+    def aggregate_in_parallel(self, names: list[str],
+                              ranges: list[tuple[int, int | None]]
+                              ) -> dict[str, Aggregator]:
+        """Aggregate byte range shards of the capture on a process pool.
+
+        The shards split the span from the first to the last range,
+        records outside the time window are skipped by each shard. Each
+        shard carries what it cannot finish on its own, e.g. TCP
+        connections open at its start, to the merge.
+        """
+        with open_capture(self.filename) as reader:
+            if not reader.seekable:
+                logger.info("%s cannot be read from the middle, "
+                            "aggregating it in one pass", self.filename)
+                return self.aggregate(names, ranges)
+            offsets = reader.shard_offsets(self.workers, ranges[0][0],
+                                           ranges[-1][1])
+        logger.info("Aggregating %s in %s shards", self.filename,
+                    len(offsets) - 1)
+        merged = {name: AGGREGATORS[name]() for name in names}
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            shards = pool.map(aggregate_shard, repeat(self.filename),
+                              repeat(names),
+                              [[shard] for shard in zip(offsets[:-1],
+                                                        offsets[1:])],
+                              repeat(self.window), range(len(offsets) - 1))
+            # map() returns the shards in capture order
+            for aggregators, protocols in shards:
+                self.protocols.update(protocols)
+                for name, aggregator in aggregators.items():
+                    merged[name].merge(aggregator)
+        for aggregator in merged.values():
+            aggregator.finish()
+        return merged
+
+    def get_aggregator(self, name: str) -> Any:
+        """Get a finished aggregator, streaming the capture if needed."""
+        self.prepare(name)
+        return self.aggregators[name]
+
+    def get_aggregate(self, name: str) -> Any:
+        """Get the result of any aggregator, e.g. a registered one."""
+        return self.get_aggregator(name).result()
+
+    def get_protocol_count(self) -> dict[str, int]:
+        """Get the number of packets seen for each protocol name."""
+        protocols: ProtocolAggregator = self.get_aggregator("protocols")
+        return protocols.count
+
+    def get_protocol_stats(self) -> dict[int | str, ProtocolStats]:
+        """Get packet, timestamp and length statistics for every protocol."""
+        protocols: ProtocolAggregator = self.get_aggregator("protocols")
+        return {protocol: protocols.get_stats(protocol)
+                for protocol in protocols.lengths}
+
+    def get_http_transactions(self) -> list[HttpTransaction]:
+        """Extract every HTTP request and its response, in request order."""
+        http: HttpAggregator = self.get_aggregator("http")
+        # Shards are in capture order, which is not always time order
+        return sorted(http.transactions,
+                      key=lambda transaction: transaction.timestamp)
+
+    def get_image_uris(self, file_extensions: list | None = None
+                       ) -> list[str]:
+        """Find all of the URIs / filenames of image files."""
+        return image_uris(self.get_http_transactions(), file_extensions)
+
+    def get_smtp_emails(self) -> Emails:
+        """Extract emails from SMTP packets."""
+        emails: SmtpEmailAggregator = self.get_aggregator("emails")
+        return emails.addresses.emails()
+
+    def get_flows(self) -> FlowTable:
+        """Count every IP packet against its bidirectional 5-tuple flow."""
+        flows: FlowAggregator = self.get_aggregator("flows")
+        return flows.flows
+
+    def get_destination_counts(self) -> dict[int, int]:
+        """Find how many IP packets were sent to each destination address."""
+        destinations: DestinationAggregator = self.get_aggregator(
+            "destinations")
+        return destinations.packets_sent_to_address
+
+    def get_traffic(self) -> TrafficPyramid:
+        """Bin the packets and bytes of the stream's window over time."""
+        timestamps: TimestampAggregator = self.get_aggregator("timestamps")
+        return timestamps.get_traffic()
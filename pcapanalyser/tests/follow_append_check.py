@@ -0,0 +1,76 @@
+"""Script for checking --follow against a capture as it is written."""
+import pathlib
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+GLOBAL_HEADER_LENGTH = 24
+RECORD_HEADER = struct.Struct("<IIII")
+# Records written between pauses, the last one of each burst is split
+RECORDS_PER_BURST = 50
+PAUSE = 0.05
+
+
+def split_records(capture: bytes) -> list[bytes]:
+    """Split a little endian microsecond pcap into its records."""
+    records = []
+    offset = GLOBAL_HEADER_LENGTH
+    while offset + RECORD_HEADER.size <= len(capture):
+        caplen = RECORD_HEADER.unpack_from(capture, offset)[2]
+        end = offset + RECORD_HEADER.size + caplen
+        records.append(capture[offset:end])
+        offset = end
+    return records
+
+
+def append_records(sample: pathlib.Path, growing: pathlib.Path) -> None:
+    """Write sample to growing a burst of records at a time."""
+    capture = sample.read_bytes()
+    records = split_records(capture)
+    with open(growing, "ab", buffering=0) as out_file:
+        out_file.write(capture[:GLOBAL_HEADER_LENGTH])
+        for start in range(0, len(records), RECORDS_PER_BURST):
+            burst = b"".join(records[start:start + RECORDS_PER_BURST])
+            # Leave a truncated record for the follower to wait on
+            out_file.write(burst[:-5])
+            time.sleep(PAUSE)
+            out_file.write(burst[-5:])
+
+
+def main() -> None:
+    """Follow a sample as it is appended, compare with analysing it."""
+    root = pathlib.Path(__file__).resolve().parent.parent.parent
+    sample = root / "pcapanalyser" / "samples" / "test.pcap"
+    with tempfile.TemporaryDirectory() as directory:
+        growing = pathlib.Path(directory) / "growing.pcap"
+        growing.touch()
+        # A window far longer than the sample covers all of it
+        with subprocess.Popen(
+                [sys.executable, "pcap_analyser.py", str(growing),
+                 "summarise", "--follow", "--window", "1e9", "--every",
+                 "0.5", "--idle-timeout", "2",
+                 "--out", str(pathlib.Path(directory) / "follow.txt")],
+                cwd=root, stdout=subprocess.PIPE, text=True) as follower:
+            append_records(sample, growing)
+            followed, _ = follower.communicate()
+        analysed = subprocess.run(
+            [sys.executable, "pcap_analyser.py", str(sample), "summarise",
+             "--no-cache",
+             "--out", str(pathlib.Path(directory) / "analyse.txt")],
+            cwd=root, stdout=subprocess.PIPE, text=True, check=True).stdout
+    snapshots = followed.split("Window ")
+    print(f"[*] {len(snapshots) - 1} snapshots")
+    # Drop the window heading and the closing line of the last snapshot
+    last = snapshots[-1].split("\n", 1)[1].rsplit("\n", 2)[0]
+    if last.strip() == analysed.strip():
+        print("[*] Final snapshot matches the analysis of the whole sample")
+    else:
+        print("[!] Final snapshot differs from the analysis of the sample")
+        print(last)
+        print(analysed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Script for checking GeoIP lookups against a generated test database."""
+import ipaddress
+import os
+import pathlib
+import sys
+import tempfile
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent.parent))
+
+import geoip2.database
+import geoip2.models
+
+from pcapanalyser import geoip
+from pcapanalyser.output import generate_kml
+from pcapanalyser.tests.make_geoip_fixture import write_fixture
+from pcapanalyser.utils import address_to_int
+
+ADDRESSES = [
+    *(f"8.8.8.{host}" for host in range(1, 60)),
+    *(f"8.8.4.{host}" for host in range(1, 10)),
+    *(f"1.1.1.{host}" for host in range(1, 5)),
+    "81.2.69.142", "81.2.69.160",
+    *(f"93.184.{subnet}.34" for subnet in range(216, 220)),
+    "185.199.108.153", "185.199.111.153",
+    # Not in the database, nor are the private addresses looked up
+    *(f"9.9.9.{host}" for host in range(1, 10)),
+    "10.0.0.1", "192.168.1.1",
+    "2a00:1450:4009:81b::200e", "2a00:1450:4009:81b::200f",
+    "2606:4700::1111",
+]
+
+
+class CountingReader(geoip2.database.Reader):
+    """A database reader that counts its searches."""
+
+    searches = 0
+
+    def city(self, ip_address: str | ipaddress.IPv4Address |
+             ipaddress.IPv6Address) -> geoip2.models.City:
+        """Search for ip_address."""
+        self.searches += 1
+        return super().city(ip_address)
+
+
+def expected(reader: geoip2.database.Reader,
+             addresses: list[int]) -> dict:
+    """Look every public address up on its own."""
+    results = {}
+    for address in addresses:
+        if geoip.is_public(address):
+            location, _ = geoip.lookup(reader, address)
+            if location is not None:
+                results[address] = location
+    return results
+
+
+def main() -> None:
+    """Compare grouped lookups, in memory and mapped, with single ones."""
+    addresses = [address_to_int(ipaddress.ip_address(address).packed)
+                 for address in ADDRESSES]
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "GeoIP2-City-Test.mmdb")
+        write_fixture(database)
+        with geoip2.database.Reader(database) as reader:
+            singles = expected(reader, addresses)
+        with CountingReader(database) as reader:
+            geoip.lookup_many(reader, [address for address in addresses
+                                       if geoip.is_public(address)])
+        print(f"[*] {len(singles)} addresses found, "
+              f"{reader.searches} searches for {len(addresses)} addresses")
+        for in_memory in (False, True):
+            found = geoip.locate(addresses, database, use_cache=False,
+                                 in_memory=in_memory)
+            print(f"[{'*' if found == singles else '!'}] in_memory="
+                  f"{in_memory} matches looking up one at a time")
+        resident = geoip.load_database(database)
+        kept = geoip.load_database(database) is resident
+        print(f"[{'*' if kept else '!'}] Database stays loaded between runs")
+        os.utime(database, ns=(0, 0))
+        reloaded = geoip.load_database(database) is not resident
+        print(f"[{'*' if reloaded else '!'}] Database is loaded again once "
+              "it changes")
+        print(generate_kml(dict.fromkeys(addresses, 1),
+                           os.path.join(directory, "ip_activity.kml"),
+                           database, use_cache=False, in_memory=True))
+
+
+if __name__ == "__main__":
+    main()
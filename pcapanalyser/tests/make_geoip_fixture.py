@@ -0,0 +1,150 @@
+"""Script for writing a small GeoIP City database to test lookups with.
+
+Writes the MaxMind DB format directly, see
+https://maxmind.github.io/MaxMind-DB/, so no writer library is needed.
+"""
+import ipaddress
+import struct
+import sys
+import time
+
+# Network -> (country, ISO code, city, latitude, longitude), city None
+# leaves it out as for addresses only known to a country
+NETWORKS = {
+    "8.8.8.0/24": ("United States", "US", "Mountain View", 37.386, -122.0838),
+    "8.8.4.0/24": ("United States", "US", "Mountain View", 37.386, -122.0838),
+    "1.1.1.0/24": ("Australia", "AU", "Sydney", -33.8688, 151.209),
+    "81.2.69.0/24": ("United Kingdom", "GB", "London", 51.5142, -0.0931),
+    "93.184.216.0/22": ("United States", "US", "Norwell", 42.1596, -70.8217),
+    "185.199.108.0/22": ("Netherlands", "NL", None, 52.3824, 4.8995),
+    "2a00:1450::/32": ("Ireland", "IE", "Dublin", 53.3498, -6.2603),
+}
+FIXTURE_PATH = "pcapanalyser/tests/GeoIP2-City-Test.mmdb"
+RECORD_SIZE = 24
+METADATA_START = b"\xab\xcd\xefMaxMind.com"
+# Data section type numbers
+UTF8_STRING, DOUBLE, UINT16, UINT32, MAP, UINT64, ARRAY = 2, 3, 5, 6, 7, 9, 11
+
+
+def control(type_number: int, size: int) -> bytes:
+    """Encode the control byte(s) of a field of type_number and size."""
+    if size < 29:
+        extra = b""
+    elif size < 285:
+        extra, size = bytes([size - 29]), 29
+    else:
+        extra, size = (size - 285).to_bytes(2, "big"), 30
+    if type_number > 7:
+        return bytes([size]) + bytes([type_number - 7]) + extra
+    return bytes([type_number << 5 | size]) + extra
+
+
+def encode(value: object) -> bytes:
+    """Encode a value for the data section.
+
+    Integers are the smallest unsigned type they fit, a (type number,
+    integer) tuple is that type.
+    """
+    if isinstance(value, tuple):
+        type_number, number = value
+        data = number.to_bytes((number.bit_length() + 7) // 8, "big")
+        return control(type_number, len(data)) + data
+    if isinstance(value, str):
+        data = value.encode()
+        return control(UTF8_STRING, len(data)) + data
+    if isinstance(value, float):
+        return control(DOUBLE, 8) + struct.pack(">d", value)
+    if isinstance(value, int):
+        type_number = UINT16 if value < 1 << 16 else \
+            UINT32 if value < 1 << 32 else UINT64
+        return encode((type_number, value))
+    if isinstance(value, dict):
+        return control(MAP, len(value)) + b"".join(
+            encode(key) + encode(item) for key, item in value.items())
+    if isinstance(value, list):
+        return control(ARRAY, len(value)) + b"".join(
+            encode(item) for item in value)
+    raise TypeError(f"Cannot encode {value!r}")
+
+
+def city_record(country: str, iso_code: str, city: str | None,
+                latitude: float, longitude: float) -> dict:
+    """Build the record of a network as a GeoIP2 City database has it."""
+    record: dict = {"country": {"iso_code": iso_code,
+                                "names": {"en": country}},
+                    "location": {"latitude": latitude,
+                                 "longitude": longitude}}
+    if city is not None:
+        record["city"] = {"names": {"en": city}}
+    return record
+
+
+def network_bits(network: str) -> list[int]:
+    """Get the path of a network in an IPv6 tree, IPv4 under ::/96."""
+    parsed = ipaddress.ip_network(network)
+    address, length = int(parsed.network_address), parsed.prefixlen
+    # ::a.b.c.d has the same integer as a.b.c.d
+    if parsed.version == 4:
+        length += 96
+    return [address >> (127 - bit) & 1 for bit in range(length)]
+
+
+def build_tree(networks: dict[str, bytes]) -> tuple[list[list], bytes]:
+    """Insert networks into a search tree, their records into data.
+
+    Returns
+    (nodes, data) -- each node's left and right record, ("node", index),
+    ("data", offset) or None for no data, and the data section
+    """
+    nodes: list[list] = [[None, None]]
+    data = b""
+    for network, record in networks.items():
+        bits = network_bits(network)
+        node = 0
+        for bit in bits[:-1]:
+            if nodes[node][bit] is None:
+                nodes.append([None, None])
+                nodes[node][bit] = ("node", len(nodes) - 1)
+            node = nodes[node][bit][1]
+        nodes[node][bits[-1]] = ("data", len(data))
+        data += record
+    return (nodes, data)
+
+
+def write_fixture(path: str = FIXTURE_PATH) -> None:
+    """Write the NETWORKS database to path."""
+    records = {network: encode(city_record(*location))
+               for network, location in NETWORKS.items()}
+    nodes, data = build_tree(records)
+
+    def pointer(record: tuple | None) -> int:
+        if record is None:
+            return len(nodes)
+        if record[0] == "node":
+            return record[1]
+        # Data is after the tree and a 16 byte separator
+        return len(nodes) + 16 + record[1]
+
+    tree = b"".join(pointer(left).to_bytes(RECORD_SIZE // 8, "big") +
+                    pointer(right).to_bytes(RECORD_SIZE // 8, "big")
+                    for left, right in nodes)
+    # Readers check the type of each metadata field, not just its value
+    metadata = encode({
+        "binary_format_major_version": (UINT16, 2),
+        "binary_format_minor_version": (UINT16, 0),
+        "build_epoch": (UINT64, int(time.time())),
+        "database_type": "GeoIP2-City",
+        "description": {"en": "PCAP_Analyser test database"},
+        "ip_version": (UINT16, 6),
+        "languages": ["en"],
+        "node_count": (UINT32, len(nodes)),
+        "record_size": (UINT16, RECORD_SIZE)
+    })
+    with open(path, "wb") as database:
+        database.write(tree + b"\0" * 16 + data + METADATA_START +
+                       metadata)
+
+
+if __name__ == "__main__":
+    write_fixture(sys.argv[1] if len(sys.argv) > 1 else FIXTURE_PATH)
+    print(f"[*] GeoIP test database of {len(NETWORKS)} networks written")
@@ -0,0 +1,19 @@
+"""Script for testing the batch analysis program against every sample."""
+import subprocess
+import pathlib
+
+from test_against_samples import change_working_directory
+
+
+def main() -> None:
+    """Test the samples folder with one batch run on a shared pool."""
+    path = str(pathlib.Path.cwd().parent.parent)
+    samples = pathlib.Path(path) / "pcapanalyser" / "samples"
+    print(f"[*] Testing {samples} as a batch")
+    with change_working_directory(path):
+        subprocess.run(f"py -3.10 batch_analyser.py {samples} summarise",
+                       check=False)
+
+
+if __name__ == "__main__":
+    main()
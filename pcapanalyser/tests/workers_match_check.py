@@ -0,0 +1,48 @@
+"""Script for checking --workers against analysing a capture in memory.
+
+Shards are cut by byte range, so many workers split TCP connections,
+and HTTP and SMTP streams, across shards.
+"""
+import pathlib
+import subprocess
+import sys
+import tempfile
+
+SAMPLES = ["test.pcap", "smtp.pcap", "webpage.pcap", "mozilla.pcap"]
+COMMANDS = ["uris", "emails", "flows"]
+WORKERS = [4, 32]
+
+
+def analyse(root: pathlib.Path, sample: pathlib.Path, command: str,
+            directory: str, *options: str) -> str:
+    """Run a command on a sample without the cache, return its output."""
+    return subprocess.run(
+        [sys.executable, "pcap_analyser.py", str(sample), command,
+         "--no-cache", "--out", str(pathlib.Path(directory) / "out.txt"),
+         *options],
+        cwd=root, stdout=subprocess.PIPE, text=True, check=True).stdout
+
+
+def main() -> None:
+    """Compare every command with many workers and in memory."""
+    root = pathlib.Path(__file__).resolve().parent.parent.parent
+    with tempfile.TemporaryDirectory() as directory:
+        for name in SAMPLES:
+            sample = root / "pcapanalyser" / "samples" / name
+            for command in COMMANDS:
+                in_memory = analyse(root, sample, command, directory)
+                for workers in WORKERS:
+                    parallel = analyse(root, sample, command, directory,
+                                       "--workers", str(workers))
+                    matches = parallel == in_memory
+                    print(f"[{'*' if matches else '!'}] {name} {command} "
+                          f"with {workers} workers "
+                          f"{'matches' if matches else 'differs from'} "
+                          "the in-memory analysis")
+                    if not matches:
+                        print(parallel)
+                        print(in_memory)
+
+
+if __name__ == "__main__":
+    main()
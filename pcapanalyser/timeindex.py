@@ -0,0 +1,157 @@
+'''
+/***
+** Script:   timeindex.py
+** Desc:     Sparse time index for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Records are grouped into blocks, and each block's file
+*               offset and timestamp range are stored in a sidecar file
+*               next to the capture. A time window then only decodes the
+*               blocks that overlap it.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+"""Sparse timestamp to file offset index for pcap files."""
+import bisect
+import os
+import struct
+from itertools import accumulate
+from typing import NamedTuple
+
+from pcapanalyser.reader import open_capture, to_seconds
+from pcapanalyser.utils import create_logger
+
+logger = create_logger()
+
+INDEX_SUFFIX = ".tidx"
+INDEX_MAGIC = b"PTIX"
+INDEX_VERSION = 1
+# Records per index block, the index holds one entry per block
+BLOCK_RECORDS = 1024
+# magic, version, capture size, capture mtime, number of blocks
+INDEX_HEADER = struct.Struct("<4sIQqQ")
+# offset of the first record header, first timestamp, last timestamp
+INDEX_ENTRY = struct.Struct("<Qdd")
+
+
+class IndexBlock(NamedTuple):
+    """A run of records, from the file offset of its first record header."""
+
+    offset: int
+    first: float
+    last: float
+
+
+class TimeIndex:
+    """Sparse index mapping capture time to record offsets.
+
+    Built from the record headers on first use and saved next to the
+    capture, later runs load it as long as the capture is unchanged.
+    Blocks are in file order, which is nearly always time order. The
+    running maximum of their last timestamps and the minimum of the
+    first timestamps from each block on are in order regardless, and
+    are binary searched for the blocks of a window.
+    """
+
+    def __init__(self, filename: str) -> None:
+        """Load the index for filename, building it if needed."""
+        self.filename = filename
+        self.index_filename = filename + INDEX_SUFFIX
+        stat = os.stat(filename)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+        loaded = self.load()
+        self.blocks = self.build() if loaded is None else loaded
+        if loaded is None:
+            self.save()
+        self.latest = list(accumulate((block.last for block in self.blocks),
+                                      max))
+        self.earliest = list(accumulate(
+            (block.first for block in reversed(self.blocks)), min))[::-1]
+
+    def build(self) -> list[IndexBlock]:
+        """Walk the record headers, one entry per BLOCK_RECORDS records."""
+        logger.info("Building time index for %s", self.filename)
+        blocks: list[IndexBlock] = []
+        with open_capture(self.filename) as reader:
+            for number, (timestamp_ns, offset, _, _, _) in enumerate(
+                    reader.records()):
+                timestamp = to_seconds(timestamp_ns)
+                if number % BLOCK_RECORDS == 0:
+                    blocks.append(IndexBlock(offset, timestamp, timestamp))
+                # Captures are not always in time order
+                elif not blocks[-1].first <= timestamp <= blocks[-1].last:
+                    blocks[-1] = blocks[-1]._replace(
+                        first=min(blocks[-1].first, timestamp),
+                        last=max(blocks[-1].last, timestamp))
+        return blocks
+
+    def load(self) -> list[IndexBlock] | None:
+        """Read the saved index, None if missing or out of date."""
+        try:
+            with open(self.index_filename, "rb") as index_file:
+                data = index_file.read()
+        except OSError:
+            return None
+        try:
+            magic, version, size, mtime, number_of_blocks = \
+                INDEX_HEADER.unpack_from(data)
+        except struct.error:
+            return None
+        if (magic, version, size, mtime) != \
+                (INDEX_MAGIC, INDEX_VERSION, self.size, self.mtime) or \
+                len(data) != INDEX_HEADER.size + \
+                number_of_blocks * INDEX_ENTRY.size:
+            logger.info("Time index for %s is out of date", self.filename)
+            return None
+        return [IndexBlock(*entry) for entry in
+                INDEX_ENTRY.iter_unpack(data[INDEX_HEADER.size:])]
+
+    def save(self) -> None:
+        """Write the index next to the capture, if the directory allows."""
+        data = bytearray(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION,
+                                           self.size, self.mtime,
+                                           len(self.blocks)))
+        for block in self.blocks:
+            data += INDEX_ENTRY.pack(*block)
+        try:
+            with open(self.index_filename, "wb") as index_file:
+                index_file.write(data)
+        except OSError:
+            # Read-only location, keep the index for this run only
+            logger.warning("Unable to save time index %s",
+                           self.index_filename)
+
+    def byte_ranges(self, start: float | None,
+                    end: float | None) -> list[tuple[int, int | None]]:
+        """Get the byte ranges that may hold records in [start, end).
+
+        Adjacent overlapping blocks are merged into one range. The ranges
+        can still hold records outside the window, callers filter them
+        by timestamp. The last block runs to the end of the capture, None,
+        as a compressed capture is longer than its file.
+        """
+        ranges: list[tuple[int, int | None]] = []
+        # Blocks before low all end before start, those from high on
+        # all begin at or after end
+        low = 0 if start is None else bisect.bisect_left(self.latest, start)
+        high = len(self.blocks) if end is None else \
+            bisect.bisect_left(self.earliest, end)
+        for number in range(low, high):
+            block = self.blocks[number]
+            # Out of order blocks in between can still miss the window
+            if (start is not None and block.last < start) or \
+                    (end is not None and block.first >= end):
+                continue
+            block_end = self.blocks[number + 1].offset \
+                if number + 1 < len(self.blocks) else None
+            if ranges and ranges[-1][1] == block.offset:
+                ranges[-1] = (ranges[-1][0], block_end)
+            else:
+                ranges.append((block.offset, block_end))
+        return ranges
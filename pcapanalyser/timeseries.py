@@ -0,0 +1,350 @@
+'''
+/***
+** Script:   timeseries.py
+** Desc:     Traffic rate time series for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Packets and bytes are binned per protocol into fixed
+*               width buckets as they are read, then summed into coarser
+*               resolutions. Any interval is read from the pyramid
+*               without looking at the packets again.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+# pylint: disable=R0902
+"""Multi-resolution packet and byte counts over time."""
+import math
+from collections.abc import Sequence
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+
+# Bin widths in seconds, each a whole multiple of the one before
+RESOLUTIONS = (0.001, 0.01, 0.1, 1.0, 10.0, 60.0, 600.0, 3600.0)
+# Most bins per protocol at the finest resolution kept, longer captures
+# are bucketed at a coarser resolution
+MAX_BINS = 50_000
+
+
+class Level(NamedTuple):
+    """Counts at one resolution, a row per protocol and a column per bin."""
+
+    resolution: float
+    packets: np.ndarray
+    bytes: np.ndarray
+
+
+def number_of_bins(span: float, width: float) -> int:
+    """Get the bins of width needed to cover span seconds.
+
+    Rounded first, float error must not add a bin to a span that is a
+    whole number of them. A span of 0 still needs one bin.
+    """
+    return max(1, math.ceil(round(span / width, 6)))
+
+
+def rebin(counts: np.ndarray, factor: int) -> np.ndarray:
+    """Sum every factor bins along the last axis, the last may be short."""
+    padding = -counts.shape[-1] % factor
+    if padding:
+        counts = np.concatenate(
+            (counts, np.zeros((*counts.shape[:-1], padding),
+                              dtype=counts.dtype)), axis=-1)
+    return counts.reshape(*counts.shape[:-1], -1, factor).sum(axis=-1)
+
+
+def coarsen(counts: np.ndarray, low: int,
+            factor: int) -> tuple[np.ndarray, int]:
+    """Sum buckets into buckets factor times as wide.
+
+    Arguments
+    counts -- a row per protocol and a column per bucket
+    low -- the bucket of the first column, its index from the epoch
+
+    Returns
+    (counts, low) -- the wider buckets and the index of the first
+    """
+    padding = low % factor
+    counts = np.concatenate(
+        (np.zeros((counts.shape[0], padding), dtype=counts.dtype), counts),
+        axis=1)
+    return rebin(counts, factor), low // factor
+
+
+def format_times(timestamps: np.ndarray) -> list[str]:
+    """Format epoch seconds as local HH:MM:SS, all in one go.
+
+    The UTC offset of the first timestamp is used for all of them.
+    """
+    if timestamps.size == 0:
+        return []
+    offset = datetime.fromtimestamp(float(timestamps[0])).astimezone() \
+        .utcoffset()
+    seconds = np.floor(timestamps + (offset.total_seconds() if offset
+                                     else 0)).astype(np.int64)
+    return [time[11:19] for time in
+            np.datetime_as_string(seconds.astype("datetime64[s]")).tolist()]
+
+
+class TrafficBuckets:
+    """Packets and bytes sent per bucket of time, per protocol.
+
+    Buckets are whole multiples of their width from the epoch, so the
+    buckets of separate shards line up and merge by adding them up.
+    They start at the finest resolution and are coarsened to the next
+    whenever the buckets from the first packet to the last would number
+    MAX_BINS or more, so they take memory for the span of the capture
+    rather than for its packets. Which resolution that ends at only
+    depends on the span, not on the order packets are added in.
+    """
+
+    def __init__(self, names: list | None = None) -> None:
+        """Initialise variables.
+
+        Arguments
+        names -- the protocol of each row to start with, more are added
+        by row
+        """
+        self.names: list = []
+        self._rows: dict = {}
+        # Index into RESOLUTIONS, and finest buckets per bucket
+        self.level = 0
+        self.scale = 1
+        # Buckets from offset on, with room to grow into. start and end
+        # are the first and last bucket with packets in.
+        self.offset = 0
+        self.start = 0
+        self.end = 0
+        self.packets = np.zeros((0, 0), dtype=np.int64)
+        self.bytes = np.zeros((0, 0), dtype=np.int64)
+        self.first = math.inf
+        self.last = -math.inf
+        self.packet_count = 0
+        for name in names or []:
+            self.row(name)
+
+    @property
+    def resolution(self) -> float:
+        """Get the width of a bucket in seconds."""
+        return RESOLUTIONS[self.level]
+
+    def row(self, name: int | str | None) -> int:
+        """Get the row of a protocol, adding it if unseen."""
+        if name not in self._rows:
+            self._rows[name] = len(self.names)
+            self.names.append(name)
+            empty = np.zeros((1, self.packets.shape[1]), dtype=np.int64)
+            self.packets = np.concatenate((self.packets, empty))
+            self.bytes = np.concatenate((self.bytes, empty))
+        return self._rows[name]
+
+    def coarsen(self) -> None:
+        """Sum the buckets into those of the next resolution."""
+        factor = round(RESOLUTIONS[self.level + 1] / self.resolution)
+        self.packets, offset = coarsen(self.packets, self.offset, factor)
+        self.bytes, _ = coarsen(self.bytes, self.offset, factor)
+        self.offset = offset
+        self.start //= factor
+        self.end //= factor
+        self.level += 1
+        self.scale *= factor
+
+    def cover(self, low: int, high: int) -> None:
+        """Make room for the finest buckets low to high.
+
+        The buckets are coarsened until the span they cover fits.
+        """
+        while True:
+            start, end = low // self.scale, high // self.scale
+            if self.packet_count:
+                start, end = min(start, self.start), max(end, self.end)
+            if end - start < MAX_BINS or self.level == len(RESOLUTIONS) - 1:
+                break
+            self.coarsen()
+        self.start, self.end = start, end
+        width = self.packets.shape[1]
+        if not self.packet_count:
+            self.offset = start
+            self.packets = np.zeros((len(self.names), end - start + 1),
+                                    dtype=np.int64)
+            self.bytes = self.packets.copy()
+            return
+        if self.offset <= start and end < self.offset + width:
+            return
+        # Grow by at least the width already held, so a capture read in
+        # order copies its buckets a logarithmic number of times
+        growth = min(width, MAX_BINS)
+        low, high = self.offset, self.offset + width - 1
+        if start < low:
+            low = min(start, low - growth)
+        if end > high:
+            high = max(end, high + growth)
+        for name in ("packets", "bytes"):
+            grown = np.zeros((len(self.names), high - low + 1),
+                             dtype=np.int64)
+            grown[:, self.offset - low:self.offset - low + width] = \
+                getattr(self, name)
+            setattr(self, name, grown)
+        self.offset = low
+
+    def add(self, timestamp: float, length: int, row: int) -> None:
+        """Count a packet in its bucket, row as given by row()."""
+        finest = math.floor(timestamp / RESOLUTIONS[0])
+        bucket = finest // self.scale
+        if not self.packet_count or not self.start <= bucket <= self.end:
+            self.cover(finest, finest)
+            bucket = finest // self.scale
+        self.packets[row, bucket - self.offset] += 1
+        self.bytes[row, bucket - self.offset] += length
+        self.first = min(self.first, timestamp)
+        self.last = max(self.last, timestamp)
+        self.packet_count += 1
+
+    def add_many(self, timestamps: Sequence[float] | np.ndarray,
+                 lengths: Sequence[int] | np.ndarray | None = None,
+                 rows: Sequence[int] | np.ndarray | None = None) -> None:
+        """Count packets in their buckets, all in one go.
+
+        Every packet is given a cell, its row and bucket flattened, and
+        the cells counted with bincount.
+
+        Arguments
+        timestamps -- the capture timestamp of every packet, in any order
+        lengths -- the length of every packet, None counts no bytes
+        rows -- every packet's row, as given by row(). None puts every
+        packet in the first row.
+        """
+        timestamps = np.asarray(timestamps, dtype="d")
+        if timestamps.size == 0:
+            return
+        if not self.names:
+            self.row(None)
+        finest = np.floor(timestamps / RESOLUTIONS[0]).astype(np.int64)
+        self.cover(int(finest.min()), int(finest.max()))
+        width = self.packets.shape[1]
+        cells = (finest // self.scale - self.offset) + width * (
+            0 if rows is None else np.asarray(rows, dtype=np.int64))
+        size = len(self.names) * width
+        self.packets += np.bincount(cells, minlength=size).reshape(
+            len(self.names), width)
+        if lengths is not None:
+            self.bytes += np.bincount(
+                cells, weights=np.asarray(lengths, dtype="d"),
+                minlength=size).astype(np.int64).reshape(len(self.names),
+                                                         width)
+        self.first = min(self.first, float(timestamps.min()))
+        self.last = max(self.last, float(timestamps.max()))
+        self.packet_count += len(timestamps)
+
+    def merge(self, other: "TrafficBuckets") -> None:
+        """Add the buckets of other, which is left as it is."""
+        if not other.packet_count:
+            return
+        rows = [self.row(name) for name in other.names]
+        while self.level < other.level:
+            self.coarsen()
+        # The finest buckets other's buckets span
+        self.cover(other.start * other.scale,
+                   (other.end + 1) * other.scale - 1)
+        factor = self.scale // other.scale
+        begin = other.start - other.offset
+        for name in ("packets", "bytes"):
+            counts, low = coarsen(
+                getattr(other, name)[:, begin:other.end - other.offset + 1],
+                other.start, factor)
+            getattr(self, name)[rows, low - self.offset:
+                                low - self.offset + counts.shape[1]] += counts
+        self.first = min(self.first, other.first)
+        self.last = max(self.last, other.last)
+        self.packet_count += other.packet_count
+
+
+class TrafficPyramid:
+    """Packets and bytes sent per bin, per protocol, at every resolution.
+
+    The finest level is the buckets from the first packet's to the
+    last's, so bins with no packets are zero rather than missing, and
+    every coarser level sums whole bins of the one below. Bins start at
+    origin, the start of the first packet's bucket.
+    """
+
+    def __init__(self, buckets: TrafficBuckets) -> None:
+        """Sum the buckets into every coarser resolution.
+
+        Arguments
+        buckets -- the capture's packets and bytes, binned as read
+        """
+        self.names = list(buckets.names)
+        self.first = buckets.first if buckets.packet_count else 0.0
+        self.last = buckets.last if buckets.packet_count else 0.0
+        self.packet_count = buckets.packet_count
+        if buckets.packet_count:
+            columns = slice(buckets.start - buckets.offset,
+                            buckets.end - buckets.offset + 1)
+            self.origin = buckets.start * buckets.resolution
+            self.levels = [Level(buckets.resolution,
+                                 buckets.packets[:, columns].copy(),
+                                 buckets.bytes[:, columns].copy())]
+        else:
+            self.names = self.names or [None]
+            empty = np.zeros((len(self.names), 1), dtype=np.int64)
+            self.origin = 0.0
+            self.levels = [Level(buckets.resolution, empty, empty)]
+        for coarser in RESOLUTIONS[buckets.level + 1:]:
+            finer = self.levels[-1]
+            factor = round(coarser / finer.resolution)
+            self.levels.append(Level(coarser, rebin(finer.packets, factor),
+                                     rebin(finer.bytes, factor)))
+
+    def __len__(self) -> int:
+        """Return the number of packets binned."""
+        return self.packet_count
+
+    def round_interval(self, interval: float) -> float:
+        """Round an interval up to whole bins of the finest resolution."""
+        finest = self.levels[0].resolution
+        # Rounded to drop the float error of the multiplication
+        return round(number_of_bins(interval, finest) * finest, 9)
+
+    def series(self, interval: float, protocol: int | str | None = None,
+               value: str = "packets") -> tuple[float, np.ndarray]:
+        """Get the packets or bytes sent in each interval.
+
+        Read from the coarsest level the interval is a whole number of
+        bins of, so the cost depends on the bins, not the packets.
+
+        Arguments
+        interval -- seconds per value, see round_interval
+        protocol -- only count this protocol, None counts every packet
+        value -- "packets" or "bytes"
+
+        Returns
+        (interval, values) -- the interval used, and the value of each
+        interval from origin to the last packet
+        """
+        interval = self.round_interval(interval)
+        # The finest level always fits, interval is whole bins of it
+        level, factor = next(
+            (level, round(interval / level.resolution))
+            for level in reversed(self.levels)
+            if math.isclose(round(interval / level.resolution)
+                            * level.resolution, interval)
+            and interval >= level.resolution)
+        counts: np.ndarray = getattr(level, value)
+        if protocol is None:
+            row = counts.sum(axis=0)
+        elif protocol in self.names:
+            row = counts[self.names.index(protocol)]
+        else:
+            row = np.zeros(counts.shape[1], dtype=np.int64)
+        return (interval, rebin(row, factor))
+
+    def interval_starts(self, interval: float, number: int) -> np.ndarray:
+        """Get the start time of the first number intervals."""
+        return self.origin + np.arange(number) * interval
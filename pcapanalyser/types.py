@@ -10,19 +10,129 @@
 ***/
 '''
 """Custom Types for type annotations."""
-from typing import TypeAlias, TypedDict
+from typing import NamedTuple, TypeAlias, TypedDict
 
-import dpkt
 
+class PacketRecord(NamedTuple):
+    """Fields decoded once from a single frame.
 
-Conversations: TypeAlias = dict[tuple[str, str], list[dpkt.ip.IP]]
+    Every command reads these instead of decoding the frame again.
+    src, dst -- IPv4 or IPv6 addresses as integers, see
+    utils.address_to_int
+    protocol -- the ProtocolIndex value, None if the protocol is unknown
+    payload_offset -- offset of the TCP/UDP payload within frame
+    tcp_seq, tcp_flags, tcp_ack -- sequence number, flags and
+    acknowledgment number of TCP segments
+    timestamp_ns -- the exact capture time, timestamp is rounded to a
+    float
+    link_type -- the DLT_* link type of the frame
+    """
 
+    timestamp: float
+    length: int
+    l2_type: int
+    protocol: int | str | None
+    src: int | None
+    dst: int | None
+    sport: int | None
+    dport: int | None
+    payload_offset: int
+    payload_length: int
+    frame: bytes | memoryview
+    tcp_seq: int | None = None
+    tcp_flags: int = 0
+    tcp_ack: int = 0
+    timestamp_ns: int = 0
+    link_type: int = 1
 
-class Packets(TypedDict):
+    @property
+    def payload(self) -> bytes:
+        """Get a copy of the TCP/UDP payload of the frame."""
+        return bytes(self.frame[self.payload_offset:
+                                self.payload_offset + self.payload_length])
+
+
+class TcpSegment(NamedTuple):
+    """A TCP segment fed to the reassembler.
+
+    flow -- (src, sport, dst, dport), one direction of a connection
+    ack -- the acknowledgment number, for the other direction
+    """
+
+    timestamp: float
+    flow: tuple[int, int, int, int]
+    seq: int
+    flags: int
+    payload: bytes
+    ack: int = 0
+
+
+class HttpTransaction(NamedTuple):
+    """An HTTP request, with its response if one was captured.
+
+    timestamp -- capture time of the segment the request started in
+    status -- response status code, None if there was no response
+    content_type -- response media type in lower case, "" if none
+    """
+
+    timestamp: float
+    method: str
+    host: str
+    uri: str
+    status: int | None
+    content_type: str
+
+
+class FlowKey(NamedTuple):
+    """Bidirectional 5-tuple, endpoint a is the lower (address, port).
+
+    protocol -- IP protocol number
+    a, b -- IPv4 or IPv6 addresses as integers
+    a_port, b_port -- TCP/UDP ports, 0 for other protocols
+    """
+
+    protocol: int
+    a: int
+    a_port: int
+    b: int
+    b_port: int
+
+
+class GeoLocation(NamedTuple):
+    """Where the GeoIP database places an address.
+
+    country, city -- names, "N/A" if the database has none
+    """
+
+    country: str
+    city: str
+    latitude: float
+    longitude: float
+
+
+class ConversationStats(TypedDict):
+    """Custom Type for type annotation."""
+
+    packets: int
+    bytes: int
+    first: float
+    last: float
+
+
+Conversations: TypeAlias = dict[tuple[int, int], ConversationStats]
+
+
+class ProtocolStats(TypedDict):
     """Custom Type for type annotation."""
 
-    raw: dict[float, bytes]
-    count: dict[str, int]
+    packets: int
+    first: float
+    last: float
+    total_length: int
+    min_length: int
+    max_length: int
+    median_length: float
+    p95_length: float
 
 
 class Emails(TypedDict):
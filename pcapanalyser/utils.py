@@ -14,17 +14,19 @@
 # pylint: disable=E0401
 # pylint: disable=R1732
 """Utility methods for packet analyser application."""
+import functools
+import ipaddress
 import logging
-from typing import Any
+from datetime import datetime
 from argparse import ArgumentParser
 from pathlib import Path
 
 import dpkt
 
+from pcapanalyser.reader import open_capture
 
-def key_from_val(d_dic: dict, value: Any) -> Any:
-    """Get key from value."""
-    return list(d_dic.keys())[list(d_dic.values()).index(value)]
+# IPv4 addresses are stored in the IPv4-mapped IPv6 range
+IPV4_MAPPED = 0xffff << 32
 
 
 def create_logger() -> logging.Logger:
@@ -37,26 +39,50 @@ def create_logger() -> logging.Logger:
     return _logger
 
 
-def hex_to_ipv4(ip_hex: str) -> str:
-    """Convert a string of hex characters into an ipv4 address."""
-    hex_octets = [ip_hex[i:i+2] for i in range(0, len(ip_hex), 2)]
-    # ['c0', 'a8'...]
-    decimal_octets = [int(x, 16) for x in hex_octets]
-    # int(x, 16) = base16 = hex = [192, 168...]
-    ip_address = ".".join(str(x) for x in decimal_octets)
-    # 192.168.....
-    return ip_address
+def address_to_int(packed: bytes) -> int:
+    """Convert a packed IPv4 or IPv6 address into an integer.
 
+    IPv4 addresses become IPv4-mapped IPv6 addresses (::ffff:a.b.c.d),
+    so both families share one integer space.
+    """
+    address = int.from_bytes(packed, "big")
+    if len(packed) == 4:
+        return IPV4_MAPPED | address
+    return address
+
+
+def is_ipv4(address: int) -> bool:
+    """Check if an integer address is an IPv4-mapped address."""
+    return address >> 32 == IPV4_MAPPED >> 32
+
+
+@functools.lru_cache(maxsize=65536)
+def format_address(address: int) -> str:
+    """Format an integer address, memoised as captures repeat addresses."""
+    if is_ipv4(address):
+        return str(ipaddress.IPv4Address(address & 0xffffffff))
+    return str(ipaddress.IPv6Address(address))
 
-def get_src_dst_address(ip_object: dpkt.ip.IP) -> tuple[str, str]:
+
+def format_endpoint(address: int, port: int) -> str:
+    """Format an address and port, leaving out port 0."""
+    if not port:
+        return format_address(address)
+    if is_ipv4(address):
+        return f"{format_address(address)}:{port}"
+    return f"[{format_address(address)}]:{port}"
+
+
+def get_src_dst_address(
+        ip_object: dpkt.ip.IP | dpkt.ip6.IP6) -> tuple[int, int]:
     """Get the source and destination IP address from a given IP header.
 
+    Addresses are returned as integers, use format_address to format them.
+
     Arguments
-    ip -- the IP object to process
+    ip -- the IPv4 or IPv6 object to process
     """
-    src_ip_hex, dst_ip_hex = ip_object.src.hex(), ip_object.dst.hex()
-    src_ip, dst_ip = hex_to_ipv4(src_ip_hex), hex_to_ipv4(dst_ip_hex)
-    return (src_ip, dst_ip)
+    return (address_to_int(ip_object.src), address_to_int(ip_object.dst))
 
 
 logger = create_logger()
@@ -74,15 +100,15 @@ def validate_filename(filename: str) -> bool:
 
 
 def validate_file_format(filename: str) -> bool:
-    """Validate that the file is a valid PCAP file."""
+    """Validate that the file is a valid pcap or pcapng file."""
     try:
-        with open(filename, "rb") as pcap_file:
-            for timestamp, _ in dpkt.pcap.Reader(pcap_file):
-                logger.info("Successfully read PCAP file - TS = %s",
+        with open_capture(filename) as reader:
+            for timestamp, _, _, _, _ in reader.records():
+                logger.info("Successfully read capture - TS = %s ns",
                             timestamp)
                 return True
-    except ValueError:
-        logger.error("Invalid PCAP file supplied")
+    except ValueError as error:
+        logger.error("Invalid PCAP file supplied - %s", error)
         return False
     return False
 
@@ -95,3 +121,20 @@ def is_valid_pcap_file(filename: str,
     if not validate_file_format(filename):
         parser.error(f"The file {filename} is not a valid PCAP")
     return filename
+
+
+def parse_time_bound(value: str, parser: ArgumentParser) -> float:
+    """Parse a time bound given as epoch seconds or an ISO 8601 time.
+
+    ISO times without a timezone are taken as local time, like the
+    timestamps in the command output.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        parser.error(f"{value} is not epoch seconds or an ISO 8601 time")
+    return 0.0
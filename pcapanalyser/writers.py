@@ -0,0 +1,325 @@
+'''
+/***
+** Script:   writers.py
+** Desc:     Result writers for PCAP_Analyser to define the Digital Network Signature in the terminal itself
+*
+*               Commands return their results as rows, which are only
+*               rendered as a table to print them or to write the text
+*               results. A run keeps one writer open per results file, in
+*               text, JSON Lines, CSV or Arrow/Parquet.
+** Author:   The Boys
+**              (Pratham Choudhary)
+**              (Shourya Gupta)
+**              (Swarnadeep Karmarkar)
+**              (Aditya Raj Saha)
+***/
+'''
+# suppress PEP8 import errors due to PATH settings
+# pylint: disable=E0401
+# pylint: disable=R1732
+"""Command results and the writers that save them."""
+import csv
+import importlib
+import importlib.util
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from types import TracebackType
+from typing import Any, TextIO
+
+from prettytable import PrettyTable
+
+from pcapanalyser.utils import create_logger
+
+# Format written when none is given
+OUTPUT_FORMAT = "text"
+
+logger = create_logger()
+
+
+class ResultTable:
+    """The rows of a command's result.
+
+    Built like a PrettyTable, which it is only rendered as when printed
+    or written as text.
+    """
+
+    def __init__(self, field_names: list[str] | None = None) -> None:
+        """Initialise variables."""
+        self.field_names = field_names or []
+        self.rows: list[list[Any]] = []
+
+    def add_row(self, row: list[Any]) -> None:
+        """Add a row, a value for each field."""
+        self.rows.append(row)
+
+    def records(self) -> Iterator[dict[str, Any]]:
+        """Get each row as column key -> plain Python value."""
+        keys = [column_key(field) for field in self.field_names]
+        for row in self.rows:
+            yield dict(zip(keys, map(plain, row)))
+
+    def render(self) -> PrettyTable:
+        """Build the PrettyTable of the rows."""
+        table = PrettyTable()
+        table.field_names = self.field_names
+        table.add_rows(self.rows)
+        return table
+
+    def __str__(self) -> str:
+        """Render the rows as a table."""
+        return str(self.render())
+
+
+# A command's result, a table or a message such as "No emails detected"
+Result = ResultTable | str
+
+
+def column_key(field_name: str) -> str:
+    """Turn a table heading into a column name, e.g. Packets A->B."""
+    return re.sub(r"[^0-9a-z]+", "_", field_name.lower()).strip("_")
+
+
+def plain(value: Any) -> Any:
+    """Convert numpy scalars to the Python values they hold."""
+    return value.item() if hasattr(value, "item") else value
+
+
+def command_path(path: str, command: str, extension: str) -> str:
+    """Get the file of one command's results, e.g. results.flows.csv."""
+    root, path_extension = os.path.splitext(path)
+    return f"{root}.{command}{path_extension or '.' + extension}"
+
+
+class ResultWriter(ABC):
+    """Base class for saving the results of a run to a results file."""
+
+    extension = "txt"
+
+    def __init__(self, path: str, capture: str | None = None) -> None:
+        """Initialise variables.
+
+        Arguments
+        path -- the results file, formats with a file per command add
+        the command to its name, see command_path
+        capture -- the capture the results are for, recorded with each
+        row of the machine readable formats
+        """
+        self.path = path
+        self.capture = capture
+
+    @abstractmethod
+    def write(self, command: str, result: Result) -> None:
+        """Save the result of a command."""
+
+    def flush(self) -> None:
+        """Write out the results so far, if the format allows it."""
+
+    def close(self) -> None:
+        """Write out anything still buffered."""
+
+    def __enter__(self) -> "ResultWriter":
+        """Return the writer, to be closed on exit."""
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None,
+                 exc_value: BaseException | None,
+                 traceback: TracebackType | None) -> None:
+        """Close the writer."""
+        self.close()
+
+
+class TextWriter(ResultWriter):
+    """Append results as the tables printed to the terminal.
+
+    The logger appends to the same file, so each table is written out
+    as soon as it is appended to keep the two in order.
+    """
+
+    def __init__(self, path: str, capture: str | None = None) -> None:
+        """Open the results file for appending."""
+        super().__init__(path, capture)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, command: str, result: Result) -> None:
+        """Append the rendered result and write it out."""
+        self.file.write(f"{result}\n")
+        self.file.flush()
+
+    def flush(self) -> None:
+        """Write out the buffered lines."""
+        self.file.flush()
+
+    def close(self) -> None:
+        """Close the results file."""
+        self.file.close()
+
+
+class JsonLinesWriter(ResultWriter):
+    """Append a JSON object per row, with the capture and command.
+
+    Messages are written as an object with a "message" instead of the
+    columns, an empty table writes nothing.
+    """
+
+    extension = "jsonl"
+
+    def __init__(self, path: str, capture: str | None = None) -> None:
+        """Open the results file for appending."""
+        super().__init__(path, capture)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, command: str, result: Result) -> None:
+        """Append a line for each row, or one for a message."""
+        header = {"command": command} if self.capture is None else \
+            {"capture": self.capture, "command": command}
+        records = result.records() if isinstance(result, ResultTable) \
+            else [{"message": result}]
+        for record in records:
+            self.file.write(json.dumps({**header, **record}, default=str)
+                            + "\n")
+
+    def flush(self) -> None:
+        """Write out the buffered lines."""
+        self.file.flush()
+
+    def close(self) -> None:
+        """Close the results file."""
+        self.file.close()
+
+
+class CsvWriter(ResultWriter):
+    """Append each command's rows to a CSV file of its own.
+
+    A file's header is written when it is created. Messages are not
+    written, their commands have no rows.
+    """
+
+    extension = "csv"
+
+    def __init__(self, path: str, capture: str | None = None) -> None:
+        """Initialise variables, files are opened by their first rows."""
+        super().__init__(path, capture)
+        self.files: dict[str, tuple[TextIO, Any]] = {}
+
+    def write(self, command: str, result: Result) -> None:
+        """Append the rows of a table."""
+        if not isinstance(result, ResultTable):
+            logger.info("'%s' has no rows to write as CSV", command)
+            return
+        if command not in self.files:
+            path = command_path(self.path, command, self.extension)
+            new = not os.path.exists(path) or os.path.getsize(path) == 0
+            csv_file = open(path, "a", encoding="utf-8", newline="")
+            self.files[command] = (csv_file, csv.writer(csv_file))
+            if new:
+                self.files[command][1].writerow(
+                    ["capture", *map(column_key, result.field_names)])
+        for record in result.records():
+            self.files[command][1].writerow([self.capture,
+                                             *record.values()])
+
+    def flush(self) -> None:
+        """Write out the buffered rows of every command."""
+        for csv_file, _ in self.files.values():
+            csv_file.flush()
+
+    def close(self) -> None:
+        """Close every command's file."""
+        for csv_file, _ in self.files.values():
+            csv_file.close()
+        self.files.clear()
+
+
+class ArrowWriter(ResultWriter):
+    """Write each command's rows to an Arrow IPC file of its own.
+
+    Columnar files are written whole, so rows are kept until the writer
+    is closed and a run replaces the files of the one before. A column
+    of more than one type, e.g. lengths and "N/A", is written as text.
+    Needs pyarrow.
+    """
+
+    extension = "arrow"
+
+    def __init__(self, path: str, capture: str | None = None) -> None:
+        """Import pyarrow, raises ValueError if it is not installed."""
+        super().__init__(path, capture)
+        try:
+            self.pyarrow = importlib.import_module("pyarrow")
+        except ImportError as error:
+            raise ValueError(f"{self.extension} output needs pyarrow, "
+                             "install it to write it") from error
+        self.tables: dict[str, list[dict[str, Any]]] = {}
+
+    def write(self, command: str, result: Result) -> None:
+        """Keep the rows of a table."""
+        if not isinstance(result, ResultTable):
+            logger.info("'%s' has no rows to write as %s", command,
+                        self.extension)
+            return
+        self.tables.setdefault(command, []).extend(
+            {"capture": self.capture, **record}
+            for record in result.records())
+
+    def build_table(self, records: list[dict[str, Any]]) -> Any:
+        """Build a pyarrow Table of rows, one type per column."""
+        columns: dict[str, list[Any]] = {key: [] for key in records[0]} \
+            if records else {}
+        for record in records:
+            for key, value in record.items():
+                columns[key].append(value)
+        for key, values in columns.items():
+            if len({type(value) for value in values
+                    if value is not None}) > 1:
+                columns[key] = [None if value is None else str(value)
+                                for value in values]
+        return self.pyarrow.table(columns)
+
+    def save(self, table: Any, path: str) -> None:
+        """Write a pyarrow Table to path."""
+        importlib.import_module("pyarrow.feather").write_feather(table,
+                                                                 path)
+
+    def close(self) -> None:
+        """Write every command's rows to its file."""
+        for command, records in self.tables.items():
+            self.save(self.build_table(records),
+                      command_path(self.path, command, self.extension))
+        self.tables.clear()
+
+
+class ParquetWriter(ArrowWriter):
+    """Write each command's rows to a Parquet file of its own."""
+
+    extension = "parquet"
+
+    def save(self, table: Any, path: str) -> None:
+        """Write a pyarrow Table to path."""
+        importlib.import_module("pyarrow.parquet").write_table(table, path)
+
+
+WRITERS: dict[str, type[ResultWriter]] = {
+    "text": TextWriter,
+    "jsonl": JsonLinesWriter,
+    "csv": CsvWriter,
+    "arrow": ArrowWriter,
+    "parquet": ParquetWriter
+}
+
+
+def missing_module(output_format: str) -> str | None:
+    """Get the module an output format needs and is not installed."""
+    if issubclass(WRITERS[output_format], ArrowWriter) and \
+            importlib.util.find_spec("pyarrow") is None:
+        return "pyarrow"
+    return None
+
+
+def close_writers(writers: dict[str, ResultWriter]) -> None:
+    """Close and forget every writer of a run."""
+    for writer in writers.values():
+        writer.close()
+    writers.clear()